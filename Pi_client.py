@@ -1,67 +1,112 @@
-import socket, struct, threading, time, json
-import cv2
+import socket, threading, time, json, uuid
+
+from protocol import (TYPE_SENSOR, TYPE_CMD, MsgReader, Sender, PROTO_VERSION, Backoff, set_keepalive,
+                      UdpFrameSender)
+from pi_pipeline import CameraPipeline, CameraSource, MotionGate, RoiRequests
+from camera import V4L2Backend, FMT_BGR
+from adaptive import AdaptiveController
+from alerts import AlertEngine, LogActuator
 
 # =========================
 # 설정
 # =========================
 SERVER_IP = "192.168.0.25"   # ✅ PC(서버) IP로 바꿔줘
 SERVER_PORT = 6000
-
-TYPE_SENSOR = 1
-TYPE_IMAGE  = 2
-TYPE_CMD    = 3
+DEVICE_ID = socket.gethostname()   # 서버에서 장치 구분용 ID (카메라 여러 대면 각자 다르게)
 
 JPEG_QUALITY = 70
 SEND_FPS = 10                # 카메라 전송 FPS (10~15 권장)
+CAMERA_SIZE = (640, 480)
+# 서버 ROI 요청 때 자를 원본 해상도 (웹캠이 CAMERA_SIZE 와 같은 비율로 지원하는 큰 모드, 예: (1280, 960))
+#   None 이면 ROI 안 함 (HELLO 에 roi 를 안 알림)
+CAMERA_FULL_SIZE = None
+MOTION_GATE = True           # 화면 변화 없으면 안 보냄 (KEYFRAME_INTERVAL 마다 한 장은 보냄)
+ADAPTIVE = True              # 링크 상태 보고 품질/해상도/FPS 자동 조절 (JPEG_QUALITY/SEND_FPS 는 시작값)
 SENSOR_INTERVAL = 1.0        # 센서 전송 주기(초)
 
-# =========================
-# TCP 프로토콜 함수
-# =========================
-def recvall(conn, n):
-    data = b""
-    while len(data) < n:
-        chunk = conn.recv(n - len(data))
-        if not chunk:
-            return None
-        data += chunk
-    return data
-
-def recv_msg(conn):
-    header = recvall(conn, 5)  # 1B type + 4B length
-    if header is None:
-        return None, None
-    mtype, length = struct.unpack("!BI", header)
-    payload = recvall(conn, length)
-    if payload is None:
-        return None, None
-    return mtype, payload
-
-def send_msg(conn, mtype, payload: bytes):
-    conn.sendall(struct.pack("!BI", mtype, len(payload)) + payload)
+# 연결 끊김 감지 / 재접속
+HEARTBEAT_INTERVAL = 2.0     # 서버로 PING 보내는 주기(초)
+HEARTBEAT_TIMEOUT = 6.0      # 이 시간 동안 서버에서 아무것도 안 오면(또는 못 보내면) 끊긴 걸로 보고 재접속
+CONNECT_TIMEOUT = 5.0
+RECONNECT_BASE = 0.5         # 재접속 대기: 0.5 → 1 → 2 ... 초 (jitter 포함)
+RECONNECT_MAX = 30.0
+SESSION_ID = uuid.uuid4().hex   # 이 프로세스의 세션 (같은 세션으로 재접속하면 서버가 상태를 이어감)
+
+# 영상을 UDP 로 (재전송 없음: 잃어버린 프레임은 버리고 다음 프레임으로). 끊김 잦은 Wi-Fi 에서
+# 패킷 하나 때문에 뒤 프레임/센서가 전부 밀리는 것(TCP head-of-line)을 피함. 서버 UDP_PORT 가 열려 있어야 함
+UDP_VIDEO = False
+
+# 연결이 바뀌어도 학습한 링크 상태는 유지
+adaptive = AdaptiveController(quality=JPEG_QUALITY, fps=SEND_FPS)
+
+# 서버 ALERT 를 울리는 곳 (센서 규칙은 Pi_test.py 참고). 부저/TTS 는 actuators 에 추가
+alerts = AlertEngine([LogActuator()], rules=[])
 
 # =========================
 # CMD 수신 루프 (서버 -> Pi)
 # =========================
-def cmd_recv_loop(conn):
+link_lost_ts = None   # 연결 끊긴 시각 (재접속 후 WELCOME 까지 걸린 시간 로그용)
+
+def cmd_recv_loop(conn, tx):
+    global link_lost_ts
+    reader = MsgReader(conn, 64 * 1024)
     while True:
-        mtype, payload = recv_msg(conn)
+        try:
+            mtype, payload = reader.recv_msg()
+        except socket.timeout:
+            print(f"[PI] nothing from server for {HEARTBEAT_TIMEOUT}s, reconnecting")
+            break
+        except OSError as e:
+            print("[PI] recv error:", e)
+            break
         if mtype is None:
             print("[PI] server disconnected (recv)")
             break
 
         if mtype == TYPE_CMD:
             try:
-                text = payload.decode("utf-8", errors="replace")
+                text = bytes(payload).decode("utf-8", errors="replace")
+                obj = json.loads(text)
+
+                # 생존 확인용 (받은 것 자체로 타임아웃이 연장됨)
+                if obj.get("cmd") == "PING":
+                    continue
+
+                # 서버가 주기적으로 보내는 링크 상태 (로그 생략)
+                if obj.get("cmd") == "FEEDBACK":
+                    adaptive.on_feedback(obj)
+                    continue
+
+                # 서버 시계 맞추기: 받자마자 내 시각을 붙여 되돌려줌 (로그 생략)
+                if obj.get("cmd") == "TIME":
+                    reply = {"cmd": "TIME", "t0": obj.get("t0"), "t1": time.time()}
+                    tx.send(TYPE_CMD, json.dumps(reply).encode("utf-8"))
+                    continue
+
+                # 서버가 고해상도로 보고 싶은 영역 (ttl 안에 다시 안 오면 저절로 꺼짐, 연장은 로그 생략)
+                if obj.get("cmd") == "ROI":
+                    if roi_requests.update(obj):
+                        print("[PI] ROI on:", text)
+                    continue
+
                 print("[PI] CMD IN:", text)
 
+                # 서버가 받을 수 있는 프로토콜 (2: seq + 캡처 시각, 3: IMAGE 조각 전송)
+                if obj.get("cmd") == "WELCOME":
+                    tx.proto = int(obj.get("proto", 1))
+                    if obj.get("udp_port"):
+                        # 영상만 UDP 로 (SENSOR / CMD 는 이 TCP 연결 그대로)
+                        tx.udp = UdpFrameSender.connect(SERVER_IP, int(obj["udp_port"]), int(obj["udp_token"]))
+                        print(f"[PI] video over UDP :{obj['udp_port']}")
+                    if link_lost_ts is not None:
+                        print(f"[PI] recovered in {time.monotonic() - link_lost_ts:.1f}s"
+                              f" (resumed={obj.get('resumed')})")
+                        link_lost_ts = None
+
                 # 예: {"cmd":"ALERT","payload":{"type":"person","message":"사람이 앞에 있습니다"}}
-                obj = json.loads(text)
                 if obj.get("cmd") == "ALERT":
-                    p = obj.get("payload", {})
-                    msg = p.get("message", "경고")
-                    # 여기서 TTS/부저/스피커 출력 연결하면 됨
-                    print("[PI][ALERT]", msg)
+                    # 같은 type 이 연달아 오면 DEDUPE_SEC 안에서는 한 번만
+                    alerts.on_server_alert(obj.get("payload", {}))
 
             except Exception as e:
                 print("[PI] CMD parse error:", e)
@@ -69,7 +114,7 @@ def cmd_recv_loop(conn):
 # =========================
 # 센서 전송 루프 (예시)
 # =========================
-def sensor_send_loop(conn):
+def sensor_send_loop(tx):
     while True:
         try:
             # ✅ 너 프로젝트에 맞게 초음파/기타 센서값 넣으면 됨
@@ -78,73 +123,83 @@ def sensor_send_loop(conn):
                 "ts": time.time()
             }
             msg = json.dumps(data, ensure_ascii=False).encode("utf-8")
-            send_msg(conn, TYPE_SENSOR, msg)
+            tx.send(TYPE_SENSOR, msg)
         except Exception as e:
             print("[PI] sensor send error:", e)
             break
         time.sleep(SENSOR_INTERVAL)
 
 # =========================
-# 카메라 전송 루프
+# 카메라 (시작할 때 한 번 열고 재접속해도 계속 사용)
 # =========================
-def camera_send_loop(conn):
-    cap = cv2.VideoCapture(0)
-    if not cap.isOpened():
-        print("[PI] camera open failed")
-        return
-
-    frame_interval = 1.0 / float(SEND_FPS)
-    last = time.time()
-
-    encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), int(JPEG_QUALITY)]
+def open_camera():
+    # USB 웹캠: 드라이버 → BGR 한 번이고 그 뒤론 변환 없이 인코딩 (다른 백엔드는 camera.py)
+    return V4L2Backend(0, size=CAMERA_SIZE, fps=SEND_FPS, full_size=CAMERA_FULL_SIZE)
 
-    while True:
-        ok, frame = cap.read()
-        if not ok:
-            print("[PI] camera read failed")
-            break
+camera = CameraSource(open_camera, "v4l2")
 
-        # 필요하면 크기 줄여서 속도 올리기
-        # frame = cv2.resize(frame, (640, 480))
+# 서버가 요청한 ROI (연결이 바뀌어도 ttl 까지는 유지 - 서버가 곧 다시 연장함)
+roi_requests = RoiRequests()
 
-        ok, jpg = cv2.imencode(".jpg", frame, encode_param)
-        if not ok:
-            continue
+# =========================
+# 카메라 전송 루프 (연결마다)
+# =========================
+def camera_send_loop(tx):
+    # capture / encode(x N) / send 를 단계별 스레드로 (느린 전송이 캡처를 막지 않음)
+    # 캡처는 camera 가 계속 돌리고 있으므로 여기선 최신 프레임에 붙기만 함
+    pipe = CameraPipeline(tx, camera.reader(), fps=SEND_FPS, quality=JPEG_QUALITY, fmt=FMT_BGR,
+                          controller=adaptive if ADAPTIVE else None,
+                          motion=MotionGate() if MOTION_GATE else None,
+                          roi=roi_requests if CAMERA_FULL_SIZE else None)
+    pipe.run()
 
+# =========================
+# 생존 신호 (서버가 반쯤 끊긴 연결을 빨리 알아채게)
+# =========================
+def heartbeat_loop(tx):
+    while True:
+        time.sleep(HEARTBEAT_INTERVAL)
         try:
-            send_msg(conn, TYPE_IMAGE, jpg.tobytes())
-        except Exception as e:
-            print("[PI] image send error:", e)
+            tx.send(TYPE_CMD, b'{"cmd":"PING"}')
+        except OSError:
             break
 
-        # FPS 제어
-        now = time.time()
-        dt = now - last
-        if dt < frame_interval:
-            time.sleep(frame_interval - dt)
-        last = time.time()
-
-    cap.release()
-
 # =========================
 # main
 # =========================
 def main():
+    global link_lost_ts
+    # 카메라는 연결과 상관없이 먼저 켜 둠 (접속 중에 이미 프레임이 쌓여 있음)
+    camera.start()
+
+    backoff = Backoff(RECONNECT_BASE, RECONNECT_MAX)
     while True:
         try:
             print(f"[PI] connecting to {SERVER_IP}:{SERVER_PORT} ...")
-            conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            conn.connect((SERVER_IP, SERVER_PORT))
+            conn = socket.create_connection((SERVER_IP, SERVER_PORT), timeout=CONNECT_TIMEOUT)
+            conn.settimeout(HEARTBEAT_TIMEOUT)   # recv/send 가 이만큼 막히면 끊긴 연결
             conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            set_keepalive(conn)
             print("[PI] connected!")
+            backoff.reset()
+
+            # 접속하자마자 장치 등록 (서버가 device_id 별 room 으로 분리)
+            # 세 스레드가 한 연결을 같이 쓰므로 송신은 Sender 하나로
+            # (소켓은 Sender 스레드만 씀: CMD 응답 > 센서 > 영상 순으로, 영상은 조각내서)
+            tx = Sender(conn)
+            hello = {"cmd": "HELLO", "device": DEVICE_ID, "proto": PROTO_VERSION, "session": SESSION_ID,
+                     "udp": UDP_VIDEO, "roi": CAMERA_FULL_SIZE is not None}
+            tx.send(TYPE_CMD, json.dumps(hello).encode("utf-8"))
 
-            t_cmd = threading.Thread(target=cmd_recv_loop, args=(conn,), daemon=True)
-            t_sen = threading.Thread(target=sensor_send_loop, args=(conn,), daemon=True)
-            t_cam = threading.Thread(target=camera_send_loop, args=(conn,), daemon=True)
+            t_cmd = threading.Thread(target=cmd_recv_loop, args=(conn, tx), daemon=True)
+            t_sen = threading.Thread(target=sensor_send_loop, args=(tx,), daemon=True)
+            t_cam = threading.Thread(target=camera_send_loop, args=(tx,), daemon=True)
+            t_hb = threading.Thread(target=heartbeat_loop, args=(tx,), daemon=True)
 
             t_cmd.start()
             t_sen.start()
             t_cam.start()
+            t_hb.start()
 
             # 연결 유지 (cmd thread가 끊기면 재접속)
             while t_cmd.is_alive() and t_cam.is_alive():
@@ -155,11 +210,15 @@ def main():
 
         try:
             conn.close()
+            tx.close()   # 막혀 있던 send() 들도 에러로 풀림
         except:
             pass
 
-        print("[PI] retry in 2 sec...")
-        time.sleep(2)
+        if link_lost_ts is None:
+            link_lost_ts = time.monotonic()
+        delay = backoff.next()
+        print(f"[PI] retry in {delay:.1f} sec...")
+        time.sleep(delay)
 
 if __name__ == "__main__":
     main()
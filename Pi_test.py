@@ -1,128 +1,164 @@
-import socket, struct, threading, time, json
-import cv2
-import RPi.GPIO as GPIO  # ✅ GPIO 라이브러리 추가
+import socket, threading, time, json, uuid
+
+from protocol import (TYPE_SENSOR, TYPE_CMD, MsgReader, Sender, PROTO_VERSION, Backoff, set_keepalive,
+                      UdpFrameSender, SensorBatch)
+from pi_pipeline import CameraPipeline, CameraSource, MotionGate, RoiRequests
+from camera import GStreamerBackend, FMT_I420
+from adaptive import AdaptiveController
+from alerts import AlertEngine, LogActuator, BuzzerActuator, TtsActuator
+from ultrasonic import UltrasonicSensor, GpioBackend, SimulatedBackend
 
 # =========================
 # 설정
 # =========================
 SERVER_IP = "192.168.0.26"   # 서버 PC IP
 SERVER_PORT = 6000
-
-TYPE_SENSOR = 1
-TYPE_IMAGE  = 2
-TYPE_CMD    = 3
+DEVICE_ID = socket.gethostname()   # 서버에서 장치 구분용 ID (카메라 여러 대면 각자 다르게)
 
 JPEG_QUALITY = 70
-SEND_FPS = 10                # 카메라 전송 FPS
-SENSOR_INTERVAL = 0.5        # ✅ 센서 측정 주기 (초) - 반응 속도를 위해 0.5초로 단축 추천
+SEND_FPS = 15                # 카메라 전송 FPS (GStreamer framerate 과 맞춤)
+CAMERA_SIZE = (640, 480)
+CAMERA_FORMAT = FMT_I420     # I420: YUV 평면 그대로 인코딩 (simplejpeg 필요) / FMT_BGR: cv2.imencode
+# 센서 원본 해상도 (카메라 모듈 v2 전체 화각). 서버가 ROI 를 요청하면 여기서 잘라 보냄, None 이면 ROI 안 함
+#   libcamerasrc 가 이 크기로 주고 CAMERA_SIZE 로 줄이는 건 Pi 에서 (프레임당 몇 ms)
+CAMERA_FULL_SIZE = (1640, 1232)
+MOTION_GATE = True           # 화면 변화 없으면 안 보냄 (KEYFRAME_INTERVAL 마다 한 장은 보냄)
+ADAPTIVE = True              # 링크 상태 보고 품질/해상도/FPS 자동 조절 (JPEG_QUALITY/SEND_FPS 는 시작값)
+SENSOR_INTERVAL = 0.5        # ✅ 센서 전송 주기 (초) - 측정은 SENSOR_HZ 로 따로 돌고
+                             #    서버가 proto 4 면 그 사이 샘플 전부를 바이너리 묶음 하나로, 아니면 최신 필터값 JSON
+SENSOR_HZ = 10               # 초음파 측정 주기 (Hz)
+SENSOR_SIMULATED = False     # True 면 GPIO 없이 가짜 센서 (책상 테스트용)
+
+# 연결 끊김 감지 / 재접속
+HEARTBEAT_INTERVAL = 2.0     # 서버로 PING 보내는 주기(초)
+HEARTBEAT_TIMEOUT = 6.0      # 이 시간 동안 서버에서 아무것도 안 오면(또는 못 보내면) 끊긴 걸로 보고 재접속
+CONNECT_TIMEOUT = 5.0
+RECONNECT_BASE = 0.5         # 재접속 대기: 0.5 → 1 → 2 ... 초 (jitter 포함)
+RECONNECT_MAX = 30.0
+SESSION_ID = uuid.uuid4().hex   # 이 프로세스의 세션 (같은 세션으로 재접속하면 서버가 상태를 이어감)
+
+# 영상을 UDP 로 (재전송 없음: 잃어버린 프레임은 버리고 다음 프레임으로). 끊김 잦은 Wi-Fi 에서
+# 패킷 하나 때문에 뒤 프레임/센서가 전부 밀리는 것(TCP head-of-line)을 피함. 서버 UDP_PORT 가 열려 있어야 함
+UDP_VIDEO = False
 
 # ✅ 초음파 센서 핀 설정 (BCM 모드 기준)
 TRIG_PIN = 18
 ECHO_PIN = 16
 
-# =========================
-# GPIO 초기화 함수
-# =========================
-def setup_gpio():
-    GPIO.setmode(GPIO.BCM)
-    GPIO.setup(TRIG_PIN, GPIO.OUT)
-    GPIO.setup(ECHO_PIN, GPIO.IN)
-    
-    # 초기에 TRIG를 Low로 설정
-    GPIO.output(TRIG_PIN, False)
-    time.sleep(1) # 센서 안정화 대기
-    print("[PI] GPIO & Sensor Ready")
+# 로컬 알림 (서버 왕복 없이 Pi 에서 바로 울림) - 거리 임계값은 alerts.PROXIMITY_CM
+BUZZER_PIN = None            # 부저 달았으면 BCM 핀 번호
+ALERT_TTS = False            # espeak 로 읽어주기
 
 # =========================
-# 초음파 거리 측정 함수
+# 초음파 센서 시작 (엣지 콜백 + median 필터, 별도 스레드)
 # =========================
-def get_distance():
-    try:
-        # 1. TRIG 핀에 10us 펄스 발사
-        GPIO.output(TRIG_PIN, True)
-        time.sleep(0.00001)
-        GPIO.output(TRIG_PIN, False)
-
-        pulse_start = time.time()
-        pulse_end = time.time()
-        
-        # 무한 대기 방지를 위한 타임아웃 설정 (약 0.1초)
-        timeout = pulse_start + 0.1
-
-        # 2. ECHO 핀이 High가 될 때까지 대기 (시작 시간)
-        while GPIO.input(ECHO_PIN) == 0:
-            pulse_start = time.time()
-            if pulse_start > timeout:
-                return None # 타임아웃
-
-        # 3. ECHO 핀이 Low가 될 때까지 대기 (종료 시간)
-        while GPIO.input(ECHO_PIN) == 1:
-            pulse_end = time.time()
-            if pulse_end > timeout:
-                return None # 타임아웃
-
-        # 4. 거리 계산
-        # 거리 = 시간 * 속도(34300cm/s) / 2 (왕복이므로)
-        pulse_duration = pulse_end - pulse_start
-        distance = pulse_duration * 17150
-        distance = round(distance, 2)
-        
-        # 노이즈 필터링 (너무 먼 거리는 무시 - 예: 4m 이상)
-        if distance > 400:
-            return None
-            
-        return distance
-
-    except Exception as e:
-        print("[PI] Distance calc error:", e)
-        return None
-
-# =========================
-# TCP 프로토콜 함수
-# =========================
-def recvall(conn, n):
-    data = b""
-    while len(data) < n:
-        chunk = conn.recv(n - len(data))
-        if not chunk:
-            return None
-        data += chunk
-    return data
-
-def recv_msg(conn):
-    header = recvall(conn, 5)
-    if header is None:
-        return None, None
-    mtype, length = struct.unpack("!BI", header)
-    payload = recvall(conn, length)
-    if payload is None:
-        return None, None
-    return mtype, payload
-
-def send_msg(conn, mtype, payload: bytes):
-    conn.sendall(struct.pack("!BI", mtype, len(payload)) + payload)
+def setup_sensor():
+    if SENSOR_SIMULATED:
+        backend = SimulatedBackend()
+    else:
+        backend = GpioBackend(TRIG_PIN, ECHO_PIN)
+    # 샘플마다 알림 엔진이 바로 판단 + 전송 묶음에 추가 (센서 스레드 안에서)
+    s = UltrasonicSensor(backend, hz=SENSOR_HZ, on_sample=on_sensor_sample).start()
+    print("[PI] GPIO & Sensor Ready")
+    return s
+
+# 연결이 바뀌어도 학습한 링크 상태는 유지
+adaptive = AdaptiveController(quality=JPEG_QUALITY, fps=SEND_FPS)
+sensor = None   # UltrasonicSensor (main 에서 시작)
+sensor_batch = SensorBatch()   # 다음 전송까지 모인 샘플 (끊긴 동안 것도 재접속 후 보냄)
+sensor_batching = True   # 서버가 proto 4 미만이면 False (묶음을 안 꺼내므로 쌓지도 않음, 끊기면 다시 True)
+current_tx = None   # 지금 연결의 Sender (알림 보고용, 끊겨 있으면 None)
+alerts = None       # AlertEngine (아래 setup_alerts 로 생성, 센서는 그 뒤에 시작)
+
+def on_sensor_sample(reading):
+    alerts.on_sample(reading)
+    if sensor_batching:
+        sensor_batch.add("ultrasonic_cm", reading["cm"], reading["ts"])
+
+def report_alert(payload):
+    tx = current_tx
+    if tx is None:
+        raise OSError("not connected")
+    tx.send(TYPE_CMD, payload)
+
+def setup_alerts():
+    actuators = [LogActuator()]
+    if BUZZER_PIN is not None:
+        actuators.append(BuzzerActuator(BUZZER_PIN))
+    if ALERT_TTS:
+        actuators.append(TtsActuator())
+    return AlertEngine(actuators, report=report_alert)
+
+alerts = setup_alerts()
 
 # =========================
 # CMD 수신 루프 (서버 -> Pi)
 # =========================
-def cmd_recv_loop(conn):
+link_lost_ts = None   # 연결 끊긴 시각 (재접속 후 WELCOME 까지 걸린 시간 로그용)
+
+def cmd_recv_loop(conn, tx):
+    global link_lost_ts, sensor_batching
+    reader = MsgReader(conn, 64 * 1024)
     while True:
-        mtype, payload = recv_msg(conn)
+        try:
+            mtype, payload = reader.recv_msg()
+        except socket.timeout:
+            print(f"[PI] nothing from server for {HEARTBEAT_TIMEOUT}s, reconnecting")
+            break
+        except OSError as e:
+            print("[PI] recv error:", e)
+            break
         if mtype is None:
             print("[PI] server disconnected (recv)")
             break
 
         if mtype == TYPE_CMD:
             try:
-                text = payload.decode("utf-8", errors="replace")
+                text = bytes(payload).decode("utf-8", errors="replace")
+                obj = json.loads(text)
+
+                # 생존 확인용 (받은 것 자체로 타임아웃이 연장됨)
+                if obj.get("cmd") == "PING":
+                    continue
+
+                # 서버가 주기적으로 보내는 링크 상태 (로그 생략)
+                if obj.get("cmd") == "FEEDBACK":
+                    adaptive.on_feedback(obj)
+                    continue
+
+                # 서버 시계 맞추기: 받자마자 내 시각을 붙여 되돌려줌 (로그 생략)
+                if obj.get("cmd") == "TIME":
+                    reply = {"cmd": "TIME", "t0": obj.get("t0"), "t1": time.time()}
+                    tx.send(TYPE_CMD, json.dumps(reply).encode("utf-8"))
+                    continue
+
+                # 서버가 고해상도로 보고 싶은 영역 (ttl 안에 다시 안 오면 저절로 꺼짐, 연장은 로그 생략)
+                if obj.get("cmd") == "ROI":
+                    if roi_requests.update(obj):
+                        print("[PI] ROI on:", text)
+                    continue
+
                 print("[PI] CMD IN:", text)
 
-                obj = json.loads(text)
+                # 서버가 받을 수 있는 프로토콜 (2: seq + 캡처 시각, 3: IMAGE 조각 전송)
+                if obj.get("cmd") == "WELCOME":
+                    tx.proto = int(obj.get("proto", 1))
+                    sensor_batching = tx.proto >= 4
+                    if not sensor_batching:
+                        sensor_batch.clear()   # 옛 서버: 최신 필터값 JSON 만 보냄
+                    if obj.get("udp_port"):
+                        # 영상만 UDP 로 (SENSOR / CMD 는 이 TCP 연결 그대로)
+                        tx.udp = UdpFrameSender.connect(SERVER_IP, int(obj["udp_port"]), int(obj["udp_token"]))
+                        print(f"[PI] video over UDP :{obj['udp_port']}")
+                    if link_lost_ts is not None:
+                        print(f"[PI] recovered in {time.monotonic() - link_lost_ts:.1f}s"
+                              f" (resumed={obj.get('resumed')})")
+                        link_lost_ts = None
+
                 if obj.get("cmd") == "ALERT":
-                    p = obj.get("payload", {})
-                    msg = p.get("message", "경고")
-                    print("[PI][ALERT]", msg)
-                    # 💡 여기에 부저나 진동 모터 코드를 추가하면 좋습니다.
+                    # 로컬에서 방금 같은 알림을 울렸으면 무시 (중복 방지)
+                    if not alerts.on_server_alert(obj.get("payload", {})):
+                        print("[PI][ALERT] duplicate, skipped")
 
             except Exception as e:
                 print("[PI] CMD parse error:", e)
@@ -130,21 +166,37 @@ def cmd_recv_loop(conn):
 # =========================
 # 센서 전송 루프 (초음파 적용)
 # =========================
-def sensor_send_loop(conn):
+def sensor_send_loop(tx):
+    n = 0
     while True:
         try:
-            # ✅ 실제 거리 측정
-            dist = get_distance()
-            
-            # (디버깅용) 터미널에 출력
-            # if dist: print(f"Distance: {dist}cm")
-
-            data = {
-                "ultrasonic_cm": dist,  # 측정값 넣기
-                "ts": time.time()
-            }
-            msg = json.dumps(data, ensure_ascii=False).encode("utf-8")
-            send_msg(conn, TYPE_SENSOR, msg)
+            if tx.proto >= 4:
+                # 서버가 바이너리 묶음을 앎: 지난 전송 뒤로 측정한 샘플 전부 (샘플당 9B)
+                msg = sensor_batch.pack()
+                if msg is not None:
+                    try:
+                        tx.send(TYPE_SENSOR, msg)
+                    except Exception:
+                        sensor_batch.restore()   # 끊겼으면 다음 연결에서 다시
+                        raise
+            else:
+                # ✅ 센서 스레드가 측정해 둔 최신 필터값 (여기서는 기다리지 않음)
+                r = sensor.latest()
+
+                # (디버깅용) 터미널에 출력
+                # if r["cm"]: print(f"Distance: {r['cm']}cm")
+
+                data = {
+                    "ultrasonic_cm": r["cm"],  # 측정값 넣기
+                    "ts": r["ts"] or time.time()
+                }
+                msg = json.dumps(data, ensure_ascii=False).encode("utf-8")
+                tx.send(TYPE_SENSOR, msg)
+
+            # 가끔 센서 통계 (샘플당 CPU 비용, 타임아웃/이상치 수)
+            n += 1
+            if n % 60 == 0:
+                print("[PI] sensor stats:", sensor.stats(), "alerts:", alerts.stats())
         
         except Exception as e:
             print("[PI] sensor send error:", e)
@@ -153,69 +205,81 @@ def sensor_send_loop(conn):
         time.sleep(SENSOR_INTERVAL)
 
 # =========================
-# 카메라 전송 루프 (GStreamer)
+# 카메라 (GStreamer) - 시작할 때 한 번 열고 재접속해도 계속 사용
 # =========================
-def camera_send_loop(conn):
-    cap = None
+def open_camera():
     print("[PI] 📸 GStreamer 파이프라인으로 카메라 연결 시도 중...")
+    # libcamerasrc 가 CAMERA_FORMAT 으로 바로 내보냄 (videoconvert 없음)
+    return GStreamerBackend(CAMERA_SIZE, SEND_FPS, fmt=CAMERA_FORMAT, full_size=CAMERA_FULL_SIZE)
 
-    gst_str = (
-        "libcamerasrc ! "
-        "video/x-raw, width=640, height=480, framerate=15/1 ! "
-        "videoconvert ! "
-        "appsink"
-    )
+# 열기 실패 / 프레임 읽기 실패는 CameraSource 가 알아서 닫고 다시 연다
+camera = CameraSource(open_camera, "libcamerasrc")
 
-    cap = cv2.VideoCapture(gst_str, cv2.CAP_GSTREAMER)
+# 서버가 요청한 ROI (연결이 바뀌어도 ttl 까지는 유지 - 서버가 곧 다시 연장함)
+roi_requests = RoiRequests()
 
-    if cap.isOpened():
-        print("[PI] ✅ GStreamer 카메라 연결 성공!")
-    else:
-        print("[PI] ❌ 카메라 연결 실패 (GStreamer 모듈 확인 필요)")
-        return
+# =========================
+# 카메라 전송 루프 (연결마다)
+# =========================
+def camera_send_loop(tx):
+    # capture / encode(x N) / send 를 단계별 스레드로 (느린 전송이 캡처를 막지 않음)
+    # 캡처는 camera 가 계속 돌리고 있으므로 여기선 최신 프레임에 붙기만 함
+    pipe = CameraPipeline(tx, camera.reader(), fps=SEND_FPS, quality=JPEG_QUALITY, fmt=CAMERA_FORMAT,
+                          controller=adaptive if ADAPTIVE else None,
+                          motion=MotionGate() if MOTION_GATE else None,
+                          roi=roi_requests if CAMERA_FULL_SIZE else None)
+    pipe.run()
 
-    encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), int(JPEG_QUALITY)]
-   
+# =========================
+# 생존 신호 (서버가 반쯤 끊긴 연결을 빨리 알아채게)
+# =========================
+def heartbeat_loop(tx):
     while True:
-        ret, frame = cap.read()
-        if not ret:
-            print("[PI] 프레임 읽기 실패 (잠시 대기)")
-            time.sleep(1)
-            continue
-           
+        time.sleep(HEARTBEAT_INTERVAL)
         try:
-            _, jpg = cv2.imencode(".jpg", frame, encode_param)
-            send_msg(conn, TYPE_IMAGE, jpg.tobytes())
-        except Exception as e:
-            print("[PI] 전송 중 에러:", e)
+            tx.send(TYPE_CMD, b'{"cmd":"PING"}')
+        except OSError:
             break
-           
-        time.sleep(0.01)
-
-    cap.release()
 
 # =========================
 # main
 # =========================
 def main():
-    # ✅ 프로그램 시작 시 GPIO 설정
-    setup_gpio()
+    global sensor, current_tx, link_lost_ts, sensor_batching
+    # ✅ 프로그램 시작 시 GPIO/센서 설정
+    sensor = setup_sensor()
+    # 카메라도 연결과 상관없이 먼저 켜 둠 (재접속하자마자 첫 프레임이 나감)
+    camera.start()
 
+    backoff = Backoff(RECONNECT_BASE, RECONNECT_MAX)
     while True:
         try:
             print(f"[PI] connecting to {SERVER_IP}:{SERVER_PORT} ...")
-            conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            conn.connect((SERVER_IP, SERVER_PORT))
+            conn = socket.create_connection((SERVER_IP, SERVER_PORT), timeout=CONNECT_TIMEOUT)
+            conn.settimeout(HEARTBEAT_TIMEOUT)   # recv/send 가 이만큼 막히면 끊긴 연결
             conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            set_keepalive(conn)
             print("[PI] connected!")
-
-            t_cmd = threading.Thread(target=cmd_recv_loop, args=(conn,), daemon=True)
-            t_sen = threading.Thread(target=sensor_send_loop, args=(conn,), daemon=True)
-            t_cam = threading.Thread(target=camera_send_loop, args=(conn,), daemon=True)
+            backoff.reset()
+
+            # 접속하자마자 장치 등록 (서버가 device_id 별 room 으로 분리)
+            # 세 스레드가 한 연결을 같이 쓰므로 송신은 Sender 하나로
+            # (소켓은 Sender 스레드만 씀: CMD 응답 > 센서 > 영상 순으로, 영상은 조각내서)
+            tx = Sender(conn)
+            current_tx = tx
+            hello = {"cmd": "HELLO", "device": DEVICE_ID, "proto": PROTO_VERSION, "session": SESSION_ID,
+                     "udp": UDP_VIDEO, "roi": CAMERA_FULL_SIZE is not None}
+            tx.send(TYPE_CMD, json.dumps(hello).encode("utf-8"))
+
+            t_cmd = threading.Thread(target=cmd_recv_loop, args=(conn, tx), daemon=True)
+            t_sen = threading.Thread(target=sensor_send_loop, args=(tx,), daemon=True)
+            t_cam = threading.Thread(target=camera_send_loop, args=(tx,), daemon=True)
+            t_hb = threading.Thread(target=heartbeat_loop, args=(tx,), daemon=True)
 
             t_cmd.start()
             t_sen.start()
             t_cam.start()
+            t_hb.start()
 
             while t_cmd.is_alive() and t_cam.is_alive():
                 time.sleep(1)
@@ -223,16 +287,22 @@ def main():
         except Exception as e:
             print("[PI] connect/run error:", e)
 
+        current_tx = None
+        sensor_batching = True   # 다음 서버가 proto 4 일 수도 있으니 끊긴 동안엔 쌓아 둠
         try:
             conn.close()
+            tx.close()   # 막혀 있던 send() 들도 에러로 풀림
         except:
             pass
 
-        print("[PI] retry in 2 sec...")
-        time.sleep(2)
+        if link_lost_ts is None:
+            link_lost_ts = time.monotonic()
+        delay = backoff.next()
+        print(f"[PI] retry in {delay:.1f} sec...")
+        time.sleep(delay)
     
     # 프로그램 종료 시 GPIO 정리 (무한루프라 도달하진 않지만 관례상)
-    GPIO.cleanup()
+    sensor.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
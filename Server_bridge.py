@@ -1,195 +1,1733 @@
 import eventlet
-eventlet.monkey_patch()  # ✅ 웹소켓/이벤트루프 안정화(중요)
+if __name__ == "__main__":
+    # ✅ 웹소켓/이벤트루프 안정화(중요). 서버로 실행할 때만:
+    #   spawn 워커(detector / ingest)는 이 파일을 __mp_main__ 으로 다시 import 함 → 워커는 패치 / 서버 객체 생성 없이
+    eventlet.monkey_patch()
+from eventlet import tpool
 
-import socket, struct, threading, json, base64, time
-from flask import Flask, send_from_directory
+import atexit, os, random, socket, threading, json, base64, time
+from collections import deque
+from flask import Blueprint, Flask, Response, request, send_from_directory
 from flask_socketio import SocketIO
 
+from protocol import (TYPE_SENSOR, TYPE_IMAGE, TYPE_CMD, TYPE_ROI, PROTO_VERSION, UDP_HEADER, UDP_HEADER_SIZE,
+                      FrameReassembler, MsgReader, send_msg, set_keepalive, unpack_sensor_batch, unpack_roi)
+from metrics import Histogram, render
+from tsdb import SensorStore
+from recorder import EventRecorder
+from ingest import IngestPool, RemoteConn
+
 # =========================
 # 설정
 # =========================
 TCP_HOST = "0.0.0.0"
-TCP_PORT = 6000
+TCP_PORT = int(os.environ.get("BRIDGE_TCP_PORT", "6000"))
+
+# UDP 영상 (선택): HELLO 에 "udp": true 를 보낸 Pi 는 IMAGE 를 이 포트로 (SENSOR/CMD 는 TCP)
+UDP_ENABLED = True
+UDP_PORT = int(os.environ.get("BRIDGE_UDP_PORT", "6001"))
+UDP_FRAME_DEADLINE = 0.25     # 조각이 이 시간 안에 다 안 모이면 그 프레임은 버림 (재전송 안 기다림)
+
+# Pi 수신을 워커 프로세스로 (ingest.py). 0 이면 예전처럼 이 프로세스 안에서 (Windows 는 0 만)
+#   워커가 TCP 를 받아 JPEG 를 공유 메모리 링에 쓰고, 여기선 링에서 읽어 fan-out 만 함
+#   → 수신/파싱이 웹 루프의 GIL 을 안 먹음. 장치가 많으면 코어 수 - 1 정도
+INGEST_WORKERS = int(os.environ.get("BRIDGE_INGEST_WORKERS", "0"))
 
 WEB_HOST = "0.0.0.0"
-WEB_PORT = 8000
-
-TYPE_SENSOR = 1
-TYPE_IMAGE  = 2
-TYPE_CMD    = 3
-
-app = Flask(__name__, static_folder=".")
-socketio = SocketIO(
-    app,
-    cors_allowed_origins="*",
-    async_mode="eventlet",
-    max_http_buffer_size=50 * 1024 * 1024,  # ✅ 큰 base64 프레임 버퍼(중요)
-)
-
-pi_conn = None
-pi_lock = threading.Lock()
-last_frame_ts = 0.0
-last_sensor_ts = 0.0
-
-def recvall(conn, n):
-    data = b""
-    while len(data) < n:
-        chunk = conn.recv(n - len(data))
-        if not chunk:
+WEB_PORT = int(os.environ.get("BRIDGE_WEB_PORT", "8000"))
+
+# 브라우저로 프레임 보내는 방식
+#   "binary" : JPEG bytes 를 Socket.IO 바이너리 첨부로 그대로 (base64 인코딩 없음, 33% 작음)
+#   "base64" : 기존 방식 (base64 문자열) - 구형 페이지 호환용 fallback
+FRAME_MODE = "binary"
+
+# 서버측 객체 인식 (선택) - OpenCV DNN 모델 파일이 있어야 켜짐
+#   예: ssd_mobilenet_v3_large_coco (frozen_inference_graph.pb + .pbtxt)
+#   라벨 파일은 한 줄에 하나, 줄 번호 = 모델 class id
+DETECT_ENABLED = False
+DETECT_MODEL = "models/frozen_inference_graph.pb"
+DETECT_CONFIG = "models/ssd_mobilenet_v3_large_coco.pbtxt"
+DETECT_LABELS = "models/coco_labels.txt"
+DETECT_WORKERS = 2            # 워커 프로세스 수 (코어 수 이하)
+DETECT_INPUT_SIZE = 320
+DETECT_CONF_MIN = 0.55
+DETECT_ALERT_LABELS = {       # 이 라벨이 잡히면 Pi 로 바로 ALERT
+    "cell phone": "휴대폰이 감지되었습니다",
+}
+
+# 고해상도 ROI: HELLO 에 "roi": true 를 보낸 Pi (센서 원본 해상도로 찍는 카메라) 에게
+#   CMD ROI 로 영역을 요청하면 그 부분만 원본 해상도로 잘라 TYPE_ROI 로 따로 보냄 (본 영상 640x480 은 그대로)
+#   ttl 안에 다시 요청 안 하면 Pi 가 알아서 끔. 받은 크롭은 브라우저 roi_frame / /roi.jpg / 서버 인식으로
+ROI_ENABLED = True
+ROI_TTL = 5.0                # 자동 ROI 유지 시간 (물체가 계속 잡히면 ROI_AUTO_RENEW_SEC 마다 연장)
+ROI_MANUAL_TTL = 30.0        # 브라우저에서 고른 ROI
+ROI_FPS = 2                  # ROI 하나당 크롭 전송 상한 (Pi 쪽 ROI_MAX_FPS 로 한 번 더 제한)
+ROI_QUALITY = 85
+ROI_AUTO = True              # 본 프레임에서 작게 잡힌 물체 주변을 자동으로 요청 (서버 인식이 켜져 있을 때)
+ROI_AUTO_MAX_AREA = 0.02     # 박스 넓이가 프레임의 이 비율 이하면 '작은 물체'
+ROI_AUTO_MARGIN = 1.0        # 박스 크기 대비 사방 여유 (1.0 = 박스 3배 크기 영역)
+ROI_AUTO_MIN_SIZE = 0.15     # ROI 한 변 최소 (프레임 비율)
+ROI_AUTO_RENEW_SEC = 2.0     # 자동 ROI 갱신 요청 간격
+ROI_ID_AUTO = 1              # 장치마다 자동 / 브라우저 ROI 하나씩 (새 요청이 이전 것을 대체)
+ROI_ID_MANUAL = 2
+
+# Pi 로 링크 상태 FEEDBACK 보내는 주기(초) - Pi 의 품질/FPS 자동 조절용
+FEEDBACK_INTERVAL = 1.0
+
+# 뷰어가 구독할 때 고를 수 있는 작은 버전 (모바일 썸네일 등)
+#   width: 가로 픽셀 (비율 유지), quality: JPEG 품질. "full" 은 Pi 가 보낸 원본 그대로
+#   구독자가 있을 때만 프레임마다 한 번 만들고(워커 스레드), 다음 프레임 오면 버림
+RENDITIONS = {
+    "thumb": {"width": 160, "quality": 60},
+    "low": {"width": 320, "quality": 45},
+}
+
+# 뷰어가 프레임 ack 를 이 시간 안에 안 보내면 유실로 보고 다음 프레임 전송
+FRAME_ACK_TIMEOUT = 2.0
+
+# HTTP 영상 (NVR / 벽 디스플레이용): /snapshot.jpg, /stream.mjpeg
+#   둘 다 fan-out 이 들고 있는 최신 JPEG bytes 를 그대로 씀 (base64 / 요청별 복사 없음)
+MJPEG_MAX_FPS = 15           # 스트림 하나당 상한 (?fps= 로 더 낮출 수 있음)
+MJPEG_IDLE_RESEND = 10.0     # 새 프레임이 이만큼 없으면 같은 프레임을 다시 보냄 (끊긴 클라이언트 정리용)
+MJPEG_SNDBUF = 64 * 1024     # 스트림 소켓 송신 버퍼 (JPEG 몇 장) - 크면 느린 클라이언트 몫이 커널에 쌓여 건너뛰기가 안 됨
+MJPEG_BOUNDARY = "frame"
+BOOT_ID = "%08x" % random.getrandbits(32)   # ETag 에 섞음 (서버 재시작 후 같은 번호가 304 로 나가지 않게)
+
+# 알림 합치기: 같은 장치 + 같은 type 은 이 시간 안에 Pi 로 한 번만 보냄
+#   (탭 여러 개 / 서버 인식 / Pi 로컬 보고가 같은 걸 잡아도 액추에이터는 한 번)
+ALERT_COALESCE_SEC = 3.0
+ALERT_CLEAR_SEC = 5.0         # 이 시간 동안 같은 알림 보고가 없으면 cleared
+
+# Pi 로 나가는 CMD 큐 길이 (넘치면 오래된 것부터 버림 - 웹 루프는 절대 안 막힘)
+OUTBOX_MAX = 64
+
+# Pi 연결 생존 확인: HEARTBEAT_INTERVAL 마다 PING, HEARTBEAT_TIMEOUT 동안 아무것도 안 오면 끊음
+#   (반쯤 끊긴 Wi-Fi 연결을 몇 분이 아니라 몇 초 안에 정리 → 장치가 바로 다시 붙을 수 있음)
+HEARTBEAT_INTERVAL = 2.0
+HEARTBEAT_TIMEOUT = 6.0
+
+# Pi 시계 오프셋 측정 (TIME 왕복) 주기 / 최근 몇 개 중 RTT 최소값을 쓸지
+CLOCK_SYNC_INTERVAL = 10.0
+CLOCK_SYNC_SAMPLES = 8
+
+# 프레임/센서마다 print 하지 않고 이 주기로 장치별 요약만 찍음
+LOG_SAMPLE_SEC = 10.0
+
+# 알림 전후 녹화 (recorder.py): 알림 RECORD_PRE_SEC 전부터 마지막 알림 RECORD_POST_SEC 뒤까지
+#   recordings/<device>/ 에 세그먼트 (.mjpg + .idx + .json), /recordings 에서 목록 / 재생
+RECORD_ENABLED = True
+RECORD_DIR = "recordings"
+RECORD_PRE_SEC = 10.0
+RECORD_POST_SEC = 20.0
+RECORD_MAX_SEGMENT_SEC = 300.0   # 알림이 계속 와도 세그먼트 하나는 이 길이까지 (넘으면 새 파일)
+RECORD_FLUSH_SEC = 0.5           # 녹화 큐를 디스크로 쓰는 주기
+RECORD_RETENTION_DAYS = 7
+RECORD_MAX_MB = 2000             # 전체 용량 상한 (넘으면 오래된 세그먼트부터 지움)
+
+# 라우트 / 이벤트 핸들러는 여기에 등록만 하고, Flask 앱에 붙이는 건 main() 에서
+web = Blueprint("web", __name__)
+socketio = SocketIO()
+
+# =========================
+# 프레임 한 장 + 작은 버전 (rendition)
+# =========================
+def jpeg_size(jpeg):
+    """SOF 마커에서 (width, height) - 디코드 없이. 못 찾으면 None"""
+    i, n = 2, len(jpeg)
+    while i + 9 < n:
+        if jpeg[i] != 0xFF:
             return None
-        data += chunk
-    return data
+        marker = jpeg[i + 1]
+        seg = (jpeg[i + 2] << 8) | jpeg[i + 3]
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            return (jpeg[i + 7] << 8) | jpeg[i + 8], (jpeg[i + 5] << 8) | jpeg[i + 6]
+        i += 2 + seg
+    return None
+
+def make_rendition(jpeg, width, quality):
+    """tpool 워커(OS 스레드)에서 실행: 축소 디코드 → resize → JPEG. 실패하면 None"""
+    import cv2
+    import numpy as np
 
-def recv_msg(conn):
-    header = recvall(conn, 5)  # 1B type + 4B length
-    if header is None:
-        return None, None
-    mtype, length = struct.unpack("!BI", header)
-    payload = recvall(conn, length)
-    if payload is None:
-        return None, None
-    return mtype, payload
+    size = jpeg_size(jpeg)
+    flag = cv2.IMREAD_COLOR
+    if size is not None:
+        # libjpeg 가 1/2, 1/4, 1/8 로 바로 디코드 (전체 디코드 후 줄이는 것보다 훨씬 쌈)
+        for factor, reduced in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                                (2, cv2.IMREAD_REDUCED_COLOR_2)):
+            if size[0] // factor >= width:
+                flag = reduced
+                break
+    frame = cv2.imdecode(np.frombuffer(jpeg, np.uint8), flag)
+    if frame is None:
+        return None
+    h, w = frame.shape[:2]
+    if w > width:
+        frame = cv2.resize(frame, (width, max(1, h * width // w)), interpolation=cv2.INTER_AREA)
+    ok, out = cv2.imencode(".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+    return out.tobytes() if ok else None
 
-def send_msg(conn, mtype, payload: bytes):
-    conn.sendall(struct.pack("!BI", mtype, len(payload)) + payload)
+class Frame:
+    """
+    fan-out 되는 프레임 한 장. 뷰어 슬롯들이 같은 객체를 공유하고,
+    rendition 은 처음 필요한 뷰어가 만들고 나머지는 기다렸다가 같이 씀.
+    새 프레임이 오면 슬롯에서 빠지면서 rendition 도 같이 사라짐 (따로 캐시 정리 없음)
+    """
+    __slots__ = ("payload", "jpeg", "cap_ts", "lock", "renditions")
 
-def tcp_pi_thread():
-    global pi_conn, last_frame_ts, last_sensor_ts
+    def __init__(self, payload, jpeg, cap_ts=None):
+        self.payload = payload      # "full" 로 emit 할 것 (binary: JPEG bytes, base64 모드: 문자열)
+        self.jpeg = jpeg            # rendition 원본 (JPEG 아니면 None)
+        self.cap_ts = cap_ts        # Pi 캡처 시각 (서버 시계, 모르면 None)
+        self.lock = threading.Lock()
+        self.renditions = {}        # name -> [Event, data]
 
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    s.bind((TCP_HOST, TCP_PORT))
-    s.listen(1)
-    print(f"[TCP] waiting Pi on {TCP_PORT}...")
+    def ready(self, name):
+        """바로 보낼 수 있으면 데이터, 만들어야 하면 None"""
+        if name not in RENDITIONS or self.jpeg is None:
+            return self.payload
+        slot = self.renditions.get(name)
+        if slot is not None and slot[0].is_set():
+            return slot[1]
+        return None
 
-    conn, addr = s.accept()
-    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-    print("[TCP] Pi connected:", addr)
+    def render(self, name):
+        """
+        rendition 을 만들거나 (다른 뷰어가 만드는 중이면) 기다림. 그린 스레드에서 호출
+        (data, 내가 만들었는지)
+        """
+        with self.lock:
+            slot = self.renditions.get(name)
+            owner = slot is None
+            if owner:
+                slot = self.renditions[name] = [threading.Event(), None]
+        if not owner:
+            slot[0].wait()
+            return slot[1], False
 
-    with pi_lock:
-        pi_conn = conn
+        spec = RENDITIONS[name]
+        try:
+            data = tpool.execute(make_rendition, self.jpeg, spec["width"], spec["quality"])
+        except Exception as e:
+            print(f"[WEB] rendition {name} failed:", e)
+            data = None
+        if data is None:
+            data = self.payload   # 못 만들면 원본이라도
+        elif FRAME_MODE != "binary":
+            data = base64.b64encode(data).decode("ascii")
+        slot[1] = data
+        slot[0].set()
+        return data, True
 
-    try:
+# =========================
+# 프레임 fan-out (뷰어별 최신 프레임 1장 + backpressure)
+# =========================
+class FrameFanout:
+    """
+    뷰어(sid)마다 '최신 프레임 1장' 슬롯만 둔다.
+    이전 프레임 ack 가 와야 다음 프레임을 보내고,
+    그 사이 새 프레임이 오면 슬롯을 덮어쓴다(= 오래된 프레임 drop).
+    느린 뷰어는 자기 프레임만 건너뛰고, 다른 뷰어/스트림은 안 느려짐.
+    """
+
+    def __init__(self, ack_timeout=FRAME_ACK_TIMEOUT):
+        self.ack_timeout = ack_timeout
+        self.lock = threading.Lock()
+        self.new_frame = threading.Condition(self.lock)   # /stream.mjpeg 가 다음 프레임을 기다림
+        self.viewers = {}
+        self.latest = None          # 마지막 Frame (/snapshot.jpg, /stream.mjpeg 가 그대로 씀)
+        self.version = 0            # publish 마다 +1 (ETag / 스트림이 건너뛴 수)
+        self.ack_latency = Histogram()       # emit → 뷰어 ack (브라우저는 그린 뒤 ack)
+        self.display_latency = Histogram()   # Pi 캡처 → 뷰어 ack (capture 시각 아는 프레임만)
+        self.rendered = dict.fromkeys(RENDITIONS, 0)   # 실제로 만든 rendition 수
+
+    def add(self, sid, rendition="full"):
+        with self.lock:
+            self.viewers[sid] = {
+                "rendition": rendition,
+                "pending": None,      # 아직 못 보낸 최신 Frame
+                "inflight_ts": 0.0,   # 보내고 ack 기다리는 중이면 보낸 시각
+                "inflight_cap": None, # 보낸 프레임의 캡처 시각 (서버 시계)
+                "sent": 0,
+                "bytes": 0,
+                "acked": 0,
+                "dropped": 0,         # 덮어써진(건너뛴) 프레임 수
+                "timeouts": 0,
+            }
+
+    def remove(self, sid):
+        with self.lock:
+            self.viewers.pop(sid, None)
+
+    def publish(self, frame):
+        """frame: Frame (같은 객체를 모든 뷰어가 공유, 뷰어별 복사 없음)"""
+        ready = []
+        with self.lock:
+            self.latest = frame
+            self.version += 1
+            self.new_frame.notify_all()
+            for sid, v in self.viewers.items():
+                if v["pending"] is not None:
+                    v["dropped"] += 1
+                v["pending"] = frame
+                if not v["inflight_ts"]:
+                    ready.append(sid)
+        for sid in ready:
+            self._send_next(sid)
+
+    def _send_next(self, sid):
+        with self.lock:
+            v = self.viewers.get(sid)
+            if v is None or v["pending"] is None or v["inflight_ts"]:
+                return
+            frame = v["pending"]
+            name = v["rendition"]
+            v["pending"] = None
+            v["inflight_cap"] = frame.cap_ts
+            v["inflight_ts"] = time.time()
+            v["sent"] += 1
+        data = frame.ready(name)
+        if data is None:
+            # 아직 안 만든 rendition → 워커에서 만들고 보냄 (Pi 수신 스레드는 안 막음)
+            socketio.start_background_task(self._render_and_emit, sid, frame, name)
+        else:
+            self._emit(sid, data)
+
+    def _render_and_emit(self, sid, frame, name):
+        data, made = frame.render(name)
+        if made:
+            self.rendered[name] += 1
+        self._emit(sid, data)
+
+    def _emit(self, sid, data):
+        with self.lock:
+            v = self.viewers.get(sid)
+            if v is not None:
+                v["bytes"] += len(data)
+        socketio.emit("frame", data, to=sid, callback=lambda *_: self._on_ack(sid))
+
+    def _on_ack(self, sid):
+        now = time.time()
+        with self.lock:
+            v = self.viewers.get(sid)
+            if v is None or not v["inflight_ts"]:
+                return   # 이미 timeout 처리된 늦은 ack
+            sent_ts, cap_ts = v["inflight_ts"], v["inflight_cap"]
+            v["inflight_ts"] = 0.0
+            v["acked"] += 1
+        self.ack_latency.observe(now - sent_ts)
+        if cap_ts is not None:
+            self.display_latency.observe(max(0.0, now - cap_ts))
+        self._send_next(sid)
+
+    def check_timeouts(self):
+        """ack 안 오는 뷰어(구버전 페이지, 끊긴 탭)가 영원히 막히지 않게"""
+        now = time.time()
+        expired = []
+        with self.lock:
+            for sid, v in self.viewers.items():
+                if v["inflight_ts"] and now - v["inflight_ts"] > self.ack_timeout:
+                    v["inflight_ts"] = 0.0
+                    v["timeouts"] += 1
+                    expired.append(sid)
+        for sid in expired:
+            self._send_next(sid)
+
+    def stats(self):
+        with self.lock:
+            return {
+                sid: {k: v[k] for k in ("rendition", "sent", "bytes", "acked", "dropped", "timeouts")}
+                for sid, v in self.viewers.items()
+            }
+
+    def wait_newer(self, version, timeout):
+        """version 보다 새 프레임이 올 때까지 (최대 timeout 초) → (Frame, version)"""
+        with self.new_frame:
+            if self.version == version:
+                self.new_frame.wait(timeout)
+            return self.latest, self.version
+
+    def totals(self):
+        """(sent, dropped) 전체 뷰어 합계"""
+        with self.lock:
+            return (sum(v["sent"] for v in self.viewers.values()),
+                    sum(v["dropped"] for v in self.viewers.values()))
+
+# =========================
+# Pi 시계 오프셋 (NTP 방식 한 번 왕복)
+# =========================
+class ClockSync:
+    """
+    서버가 {"cmd":"TIME","t0":서버시각} 을 보내면 Pi 는 {"t0", "t1":Pi시각} 으로 바로 답한다.
+    받은 시각 t3 에서 rtt = t3 - t0, offset = t1 - (t0 + t3) / 2  (Pi 시계 - 서버 시계).
+    최근 샘플 중 RTT 가 가장 짧은 것 = 큐잉 영향이 가장 적은 것을 쓴다.
+    """
+
+    def __init__(self, samples=CLOCK_SYNC_SAMPLES):
+        self.samples = samples
+        self.history = []     # [(rtt, offset)]
+        self.offset = None
+        self.rtt = None
+
+    def request(self):
+        return json.dumps({"cmd": "TIME", "t0": time.time()}).encode("utf-8")
+
+    def on_reply(self, obj, t3):
+        try:
+            t0, t1 = float(obj["t0"]), float(obj["t1"])
+        except (KeyError, TypeError, ValueError):
+            return
+        rtt = t3 - t0
+        if rtt < 0:
+            return
+        self.history.append((rtt, t1 - (t0 + t3) / 2.0))
+        del self.history[:-self.samples]
+        self.rtt, self.offset = min(self.history)
+
+    def to_server(self, pi_ts):
+        """Pi 시계 시각 → 서버 시계 (오프셋 모르면 None)"""
+        if pi_ts is None or self.offset is None:
+            return None
+        return pi_ts - self.offset
+
+# =========================
+# Pi 장치 레지스트리 (device_id -> PiDevice)
+# =========================
+class PiDevice:
+    """
+    Pi 한 대의 상태. 연결이 끊겨도 객체는 남겨둬서
+    같은 device_id 로 재접속하면 뷰어 구독/통계가 그대로 이어진다.
+    """
+
+    def __init__(self, device_id):
+        self.device_id = device_id
+        self.room = "dev:" + device_id      # Socket.IO room (sensor 등 브로드캐스트용)
+        self.fanout = FrameFanout()         # 이 장치를 보는 뷰어들
+        self.conn = None
+        self.addr = None
+        self.out_cond = threading.Condition()   # conn / outbox 보호
+        self.outbox = deque()       # Pi 로 보낼 (mtype, payload) - writer 스레드가 비움
+        self.out_sent = 0
+        self.out_dropped = 0
+        self.connected_ts = 0.0
+        self.last_frame_ts = 0.0
+        self.last_sensor_ts = 0.0
+        self.frames = 0
+        self.bytes_in = 0
+        self.next_meta = None       # 다음 IMAGE 에 붙는 FRAME_META (변화 영역 등)
+        self.last_meta = None
+        self.static_frames = 0      # 변화 없이 키프레임으로만 온 프레임
+        self.feedback_prev = None   # (ts, frames, bytes_in, sent, dropped)
+
+        # protocol v2 (seq + 캡처 시각) 를 쓰는 Pi 일 때만 채워짐
+        self.proto = 1
+        self.session = None         # Pi 프로세스 세션 (같은 세션 재접속이면 상태 이어감)
+        self.reconnects = 0
+        self.disconnected_ts = 0.0
+        self.clock = ClockSync()
+        self.last_seq = None
+        self.lost = 0               # seq 가 건너뛴 만큼 (Pi 쪽 drop + 전송 중 유실)
+        self.sensors = 0
+        self.pi_alerts = 0          # Pi 로컬 알림 엔진이 울리고 보고한 수
+        self.udp_token = None       # 지금 연결이 UDP 영상을 쓰면 그 token
+        self.udp = FrameReassembler(UDP_FRAME_DEADLINE)
+        self.udp_prev = (0, 0)      # FEEDBACK 구간 손실률용 (frags_received, frags_lost)
+        self.log_prev = None        # (ts, frames, bytes_in, lost, sensors)
+        self.http = dict.fromkeys(("snapshots", "not_modified", "snapshot_bytes", "streams_active",
+                                   "streams", "stream_frames", "stream_skipped", "stream_bytes"), 0)
+        self.roi_capable = False    # HELLO 에 roi: true + proto 5 이상
+        self.rois = {}              # 요청 중인 ROI id -> {"rect", "source", "expires"}
+        self.roi_latest = {}        # ROI id -> (JPEG, rect, 캡처 시각, seq) 마지막으로 받은 크롭
+        self.roi_auto_ts = 0.0
+        self.roi_stats = dict.fromkeys(("requests", "frames", "bytes"), 0)
+        self.capture_latency = Histogram()   # Pi 캡처 → 서버 수신
+        self.process_latency = Histogram()   # 서버 수신 → fan-out 완료
+
+    def on_seq(self, seq):
+        if seq is None:
+            return
+        if self.last_seq is not None:
+            if seq > self.last_seq + 1:
+                self.lost += seq - self.last_seq - 1
+            elif seq <= self.last_seq:
+                self.last_seq = None   # Pi 파이프라인 재시작 → 처음부터
+        self.last_seq = seq
+
+    def send(self, mtype, payload):
+        """큐에 넣고 바로 리턴 (소켓 I/O 는 writer_loop). 연결 없으면 False"""
+        with self.out_cond:
+            if self.conn is None:
+                return False
+            if len(self.outbox) >= OUTBOX_MAX:
+                self.outbox.popleft()
+                self.out_dropped += 1
+            self.outbox.append((mtype, payload))
+            self.out_cond.notify()
+        return True
+
+    def writer_loop(self, conn):
+        """연결 하나당 하나. conn 이 바뀌거나 끊기면 끝남"""
         while True:
-            mtype, payload = recv_msg(conn)
-            if mtype is None:
-                print("[TCP] Pi disconnected")
-                break
+            with self.out_cond:
+                while self.conn is conn and not self.outbox:
+                    self.out_cond.wait()
+                if self.conn is not conn:
+                    return
+                mtype, payload = self.outbox.popleft()
+            try:
+                send_msg(conn, mtype, payload)
+                self.out_sent += 1
+            except OSError as e:
+                print(f"[CMD] send to {self.device_id} failed:", e)
+                try:
+                    conn.close()   # 수신 스레드도 끊김을 알게
+                except OSError:
+                    pass
+                return
 
-            if mtype == TYPE_SENSOR:
-                last_sensor_ts = time.time()
-                msg = payload.decode("utf-8", errors="replace")
-                print("[TCP] SENSOR IN:", msg[:120])
-                socketio.emit("sensor", msg)
+    def set_conn(self, conn, addr=None):
+        with self.out_cond:
+            self.conn = conn
+            self.addr = addr
+            if conn is not None:
+                self.outbox.clear()   # 예전 연결용으로 쌓인 것 (FEEDBACK 등)은 의미 없음
+            self.out_cond.notify_all()
 
-            elif mtype == TYPE_IMAGE:
-                last_frame_ts = time.time()
-                n = len(payload)
-                print("[TCP] IMAGE IN bytes =", n)
+    def status(self):
+        now = time.time()
+        return {
+            "connected": self.conn is not None,
+            "addr": None if self.addr is None else f"{self.addr[0]}:{self.addr[1]}",
+            "proto": self.proto,
+            "reconnects": self.reconnects,
+            "frames": self.frames,
+            "lost": self.lost,
+            "udp": None if self.udp_token is None else self.udp.stats(),
+            "pi_alerts": self.pi_alerts,
+            "outbox": {"queued": len(self.outbox), "sent": self.out_sent, "dropped": self.out_dropped},
+            "static_frames": self.static_frames,
+            "clock_offset_ms": None if self.clock.offset is None else round(self.clock.offset * 1000, 1),
+            "clock_rtt_ms": None if self.clock.rtt is None else round(self.clock.rtt * 1000, 1),
+            "last_meta": self.last_meta,
+            "last_frame_age_sec": None if self.last_frame_ts == 0 else round(now - self.last_frame_ts, 2),
+            "last_sensor_age_sec": None if self.last_sensor_ts == 0 else round(now - self.last_sensor_ts, 2),
+            "viewers": self.fanout.stats(),
+            "http": dict(self.http),
+            "roi": self.roi_status(),
+        }
 
-                # ✅ 1) JPEG 바이너리인지 먼저 확인 (JPEG 매직: FF D8 ... FF D9)
-                is_jpeg_bytes = (n >= 4 and payload[:2] == b"\xff\xd8")
+    def roi_status(self):
+        if not self.roi_capable and not self.roi_stats["frames"]:
+            return None
+        now = time.time()
+        for roi_id in [k for k, r in self.rois.items() if r["expires"] <= now]:
+            del self.rois[roi_id]
+        return {"capable": self.roi_capable,
+                "active": {roi_id: {"rect": r["rect"], "source": r["source"],
+                                    "ttl_sec": round(r["expires"] - now, 1)} for roi_id, r in self.rois.items()},
+                **self.roi_stats}
 
-                b64 = None
+devices = {}
+devices_lock = threading.Lock()
+udp_devices = {}     # UDP token -> PiDevice (devices_lock)
+sensor_store = None   # SensorStore: 장치/채널별 센서 이력 (메모리 고정 링, /sensor/history) - main 에서 생성
 
-                if is_jpeg_bytes:
-                    # payload가 진짜 JPEG bytes면: 그대로 base64로
-                    b64 = base64.b64encode(payload).decode("ascii")
+def get_device(device_id):
+    """Pi 가 등록될 때만 (없으면 만듦). 브라우저 / 인식 결과 쪽은 find_device"""
+    with devices_lock:
+        dev = devices.get(device_id)
+        if dev is None:
+            dev = devices[device_id] = PiDevice(device_id)
+        return dev
 
-                    # (디버그) 가끔 파일로 저장해서 깨졌는지 확인 가능
-                    # with open("debug.jpg", "wb") as f:
-                    #     f.write(payload)
+def find_device(device_id):
+    with devices_lock:
+        return devices.get(device_id)
 
+# =========================
+# 알림 디스패처 (브라우저 / 서버 인식 / Pi 로컬 → Pi)
+# =========================
+class AlertDispatcher:
+    """
+    (device_id, type) 별 상태: raised → (ALERT_CLEAR_SEC 동안 보고 없음) → cleared.
+    raised 인 동안 같은 알림은 ALERT_COALESCE_SEC 에 한 번만 Pi 로 보내고 나머지는 suppressed.
+    Pi 가 직접 울리고 보고한 것(source="pi")은 되돌려 보내지 않고 시각만 기록.
+    상태가 바뀔 때 브라우저에 alert_state 이벤트.
+    """
+
+    def __init__(self, coalesce_sec=ALERT_COALESCE_SEC, clear_sec=ALERT_CLEAR_SEC):
+        self.coalesce_sec = coalesce_sec
+        self.clear_sec = clear_sec
+        self.lock = threading.Lock()
+        self.active = {}   # (device_id, type) -> 상태 dict
+        self.counts = {}   # device_id -> {raised, cleared, delivered, suppressed, dropped}
+
+    def _count(self, device_id):
+        c = self.counts.get(device_id)
+        if c is None:
+            c = self.counts[device_id] = dict.fromkeys(
+                ("raised", "cleared", "delivered", "suppressed", "dropped"), 0)
+        return c
+
+    def submit(self, dev, data, source):
+        data = dict(data or {})
+        data.setdefault("source", source)
+        atype = str(data.get("type") or "alert")
+        key = (dev.device_id, atype)
+        now = time.time()
+        with self.lock:
+            c = self._count(dev.device_id)
+            st = self.active.get(key)
+            raised = st is None
+            if raised:
+                st = self.active[key] = {"type": atype, "since": now, "sent_ts": 0.0, "reports": 0}
+                c["raised"] += 1
+            st["last_ts"] = now
+            st["reports"] += 1
+            st["message"] = data.get("message")
+            if source == "pi":
+                st["sent_ts"] = now   # Pi 는 이미 울렸음
+                deliver = False
+            elif now - st["sent_ts"] < self.coalesce_sec:
+                c["suppressed"] += 1
+                deliver = False
+            else:
+                st["sent_ts"] = now
+                deliver = True
+            state = dict(st, device=dev.device_id, state="raised")
+
+        if raised:
+            socketio.emit("alert_state", state, to=dev.room)
+        if recorder is not None:
+            recorder.trigger(dev.device_id, atype, now)   # 같은 알림이 계속 오면 녹화 연장
+        if not deliver:
+            return False
+
+        cmd = json.dumps({"cmd": "ALERT", "payload": data}, ensure_ascii=False).encode("utf-8")
+        ok = dev.send(TYPE_CMD, cmd)
+        with self.lock:
+            self._count(dev.device_id)["delivered" if ok else "dropped"] += 1
+        if ok:
+            print(f"[CMD] ALERT -> {dev.device_id}", data)
+        else:
+            print(f"[CMD] {dev.device_id} not connected, drop alert")
+        return ok
+
+    def sweep(self):
+        now = time.time()
+        cleared = []
+        with self.lock:
+            for key, st in list(self.active.items()):
+                if now - st["last_ts"] >= self.clear_sec:
+                    del self.active[key]
+                    self._count(key[0])["cleared"] += 1
+                    cleared.append(dict(st, device=key[0], state="cleared"))
+        for st in cleared:
+            socketio.emit("alert_state", st, to="dev:" + st["device"])
+
+    def stats(self):
+        with self.lock:
+            return {
+                "active": [dict(st, device=k[0]) for k, st in self.active.items()],
+                "counts": {d: dict(c) for d, c in self.counts.items()},
+            }
+
+alert_dispatcher = None   # AlertDispatcher (main 에서 생성)
+
+def alert_sweep_loop():
+    while True:
+        socketio.sleep(1.0)
+        alert_dispatcher.sweep()
+
+# =========================
+# 알림 전후 녹화
+# =========================
+recorder = None   # EventRecorder (RECORD_ENABLED 면 main 에서 생성)
+
+def record_loop():
+    """녹화 큐 → 디스크, 보관 기간/용량 정리 (파일 I/O 는 tpool OS 스레드에서 - 웹 루프 안 막힘)"""
+    last_retention = 0.0
+    while True:
+        socketio.sleep(RECORD_FLUSH_SEC)
+        recorder.tick()
+        try:
+            tpool.execute(recorder.flush)
+            if time.time() - last_retention >= 60.0:
+                last_retention = time.time()
+                tpool.execute(recorder.enforce_retention)
+        except Exception as e:
+            print("[REC] write error:", e)
+
+def read_recording_frame(segment_id, t=None, i=None):
+    """tpool 에서: 세그먼트 시작부터 t 초 (또는 i 번째) 프레임 → (jpeg bytes, ts, index, count). 없으면 None"""
+    reader = recorder.open(segment_id)
+    if reader is None or not len(reader):
+        return None
+    try:
+        idx = reader.find(reader.timestamps()[0] + t) if i is None else min(max(i, 0), len(reader) - 1)
+        ts, view = reader.frame(idx)
+        jpeg = bytes(view)   # HTTP 응답용 (mmap 에서 그 프레임만)
+        view.release()
+        return jpeg, ts, idx, len(reader)
+    finally:
+        reader.close()
+
+def read_recording_index(segment_id):
+    reader = recorder.open(segment_id)
+    if reader is None:
+        return None
+    try:
+        return [round(float(x), 3) for x in reader.timestamps()]
+    finally:
+        reader.close()
+
+def fanout_timeout_loop():
+    while True:
+        socketio.sleep(FRAME_ACK_TIMEOUT / 2)
+        with devices_lock:
+            devs = list(devices.values())
+        for dev in devs:
+            dev.fanout.check_timeouts()
+
+# =========================
+# 서버측 객체 인식 결과 처리
+# =========================
+detector = None   # DetectorPool (DETECT_ENABLED 일 때만)
+
+def on_detection(device_id, results, info):
+    dev = find_device(device_id)
+    if dev is None:
+        return
+    roi = info.get("roi")
+    if roi is not None:
+        # ROI 크롭에서 찾은 것 → 본 화면 0~1 좌표로 (브라우저가 같은 캔버스에 그림)
+        results = roi_results_to_frame(results, roi["rect"], info.get("size"))
+    socketio.emit("detection", {"device": device_id, "results": results, **info}, to=dev.room)
+    if roi is None:
+        auto_roi(dev, results, info.get("size"))
+
+    # 같은 라벨이 프레임마다 잡혀도 디스패처가 합쳐서 Pi 로는 한 번
+    for r in results:
+        message = DETECT_ALERT_LABELS.get(r["label"])
+        if message and r["confidence"] >= DETECT_CONF_MIN:
+            alert_dispatcher.submit(dev, {"type": r["label"], "confidence": r["confidence"],
+                                          "message": message}, "server")
+
+def start_detector():
+    global detector
+    for path in (DETECT_MODEL, DETECT_CONFIG):
+        if not os.path.exists(path):
+            print("[DETECT] model file not found, detection off:", path)
+            return
+    from detector import DetectorPool
+    detector = DetectorPool(
+        DETECT_MODEL, DETECT_CONFIG,
+        DETECT_LABELS if os.path.exists(DETECT_LABELS) else None,
+        on_detection,
+        workers=DETECT_WORKERS,
+        input_size=DETECT_INPUT_SIZE,
+        conf_min=DETECT_CONF_MIN,
+    )
+    print(f"[DETECT] started ({DETECT_WORKERS} workers)")
+
+# =========================
+# 고해상도 ROI (서버 -> Pi CMD ROI, Pi -> 서버 TYPE_ROI)
+# =========================
+def request_roi(dev, rect, roi_id, ttl=ROI_TTL, source="server"):
+    """
+    dev 에 rect=[x, y, w, h](0~1) 영역을 원본 해상도로 ttl 초 동안 요청 (같은 id 면 갱신/연장).
+    ttl=0 이면 끔. Pi 가 ROI 를 못 하거나 연결이 없으면 False
+    """
+    if not ROI_ENABLED or not dev.roi_capable:
+        return False
+    cmd = {"cmd": "ROI", "id": roi_id, "ttl": ttl}
+    if ttl > 0:
+        x, y, w, h = (min(max(float(v), 0.0), 1.0) for v in rect)
+        rect = [round(x, 4), round(y, 4), round(min(w, 1.0 - x), 4), round(min(h, 1.0 - y), 4)]
+        if rect[2] <= 0 or rect[3] <= 0:
+            return False
+        cmd.update(rect=rect, fps=ROI_FPS, quality=ROI_QUALITY)
+    if not dev.send(TYPE_CMD, json.dumps(cmd).encode("utf-8")):
+        return False
+    dev.roi_stats["requests"] += 1
+    if ttl > 0:
+        new = roi_id not in dev.rois
+        dev.rois[roi_id] = {"rect": rect, "source": source, "expires": time.time() + ttl}
+        if new:
+            print(f"[CMD] {dev.device_id}: ROI {roi_id} {rect} ({source})")
+    else:
+        dev.rois.pop(roi_id, None)
+    return True
+
+def auto_roi(dev, results, size):
+    """본 프레임에서 작게 잡힌 물체 (멀리 있는 휴대폰 등) 주변을 고해상도로. 계속 잡히는 동안만 연장"""
+    if not ROI_AUTO or not dev.roi_capable or not size:
+        return
+    fw, fh = size
+    small = [r for r in results if r["box"][2] * r["box"][3] <= ROI_AUTO_MAX_AREA * fw * fh]
+    now = time.time()
+    if not small or now - dev.roi_auto_ts < ROI_AUTO_RENEW_SEC:
+        return
+    best = max(small, key=lambda r: r["confidence"])
+    x, y, w, h = best["box"]
+    rw = min(1.0, max(w / fw * (1 + 2 * ROI_AUTO_MARGIN), ROI_AUTO_MIN_SIZE))
+    rh = min(1.0, max(h / fh * (1 + 2 * ROI_AUTO_MARGIN), ROI_AUTO_MIN_SIZE))
+    cx, cy = (x + w / 2) / fw, (y + h / 2) / fh
+    rect = [min(max(cx - rw / 2, 0.0), 1.0 - rw), min(max(cy - rh / 2, 0.0), 1.0 - rh), rw, rh]
+    if request_roi(dev, rect, ROI_ID_AUTO, ROI_TTL, "auto:" + best["label"]):
+        dev.roi_auto_ts = now
+
+def roi_results_to_frame(results, rect, size):
+    """크롭 픽셀 좌표 박스 → 본 화면 0~1 좌표 (norm=True)"""
+    if not size:
+        return []
+    cw, ch = size
+    rx, ry, rw, rh = rect
+    out = []
+    for r in results:
+        x, y, w, h = r["box"]
+        box = [rx + x / cw * rw, ry + y / ch * rh, w / cw * rw, h / ch * rh]
+        out.append(dict(r, box=[round(v, 4) for v in box], norm=True))
+    return out
+
+# =========================
+# 링크 FEEDBACK (서버 -> Pi)
+# =========================
+def send_feedback(dev):
+    now = time.time()
+    sent, dropped = dev.fanout.totals()
+    cur = (now, dev.frames, dev.bytes_in, sent, dropped)
+    prev, dev.feedback_prev = dev.feedback_prev, cur
+    if prev is None or dev.conn is None:
+        return
+
+    dt = max(now - prev[0], 1e-3)
+    d_sent, d_dropped = sent - prev[3], dropped - prev[4]
+    fb = {
+        "cmd": "FEEDBACK",
+        "rx_fps": round((dev.frames - prev[1]) / dt, 2),
+        "rx_kbps": round((dev.bytes_in - prev[2]) * 8 / 1000 / dt),
+        # 뷰어 쪽에서 못 따라가 버린 비율 (참고용)
+        "viewer_drop_ratio": round(d_dropped / (d_sent + d_dropped), 3) if d_sent + d_dropped else 0.0,
+    }
+    if dev.udp_token is not None:
+        # 이번 구간 UDP 조각 손실률 (Pi 가 로그/조절에 씀)
+        got, lost = dev.udp.frags_received, dev.udp.frags_lost
+        d_got, d_lost = got - dev.udp_prev[0], lost - dev.udp_prev[1]
+        dev.udp_prev = (got, lost)
+        fb["udp_loss"] = round(d_lost / (d_got + d_lost), 4) if d_got + d_lost else 0.0
+    try:
+        dev.send(TYPE_CMD, json.dumps(fb).encode("utf-8"))
+    except Exception as e:
+        print(f"[CMD] feedback to {dev.device_id} failed:", e)
+
+def feedback_loop():
+    while True:
+        socketio.sleep(FEEDBACK_INTERVAL)
+        with devices_lock:
+            devs = list(devices.values())
+        for dev in devs:
+            send_feedback(dev)
+
+# =========================
+# 시계 동기 / 샘플링 로그
+# =========================
+def send_time_request(dev):
+    if dev.proto < 2 or dev.conn is None:
+        return
+    try:
+        dev.send(TYPE_CMD, dev.clock.request())
+    except Exception as e:
+        print(f"[CMD] time sync to {dev.device_id} failed:", e)
+
+def heartbeat_loop():
+    ping = json.dumps({"cmd": "PING"}).encode("utf-8")
+    while True:
+        socketio.sleep(HEARTBEAT_INTERVAL)
+        with devices_lock:
+            devs = list(devices.values())
+        for dev in devs:
+            if dev.proto >= 2:   # 구버전 Pi 는 PING 을 몰라서 매번 로그를 찍음
+                dev.send(TYPE_CMD, ping)
+
+def clock_sync_loop():
+    while True:
+        socketio.sleep(CLOCK_SYNC_INTERVAL)
+        with devices_lock:
+            devs = list(devices.values())
+        for dev in devs:
+            send_time_request(dev)
+
+def log_sample_loop():
+    """프레임마다 찍던 IMAGE IN / SENSOR IN 대신 주기 요약"""
+    while True:
+        socketio.sleep(LOG_SAMPLE_SEC)
+        now = time.time()
+        with devices_lock:
+            devs = list(devices.values())
+        for dev in devs:
+            cur = (now, dev.frames, dev.bytes_in, dev.lost, dev.sensors)
+            prev, dev.log_prev = dev.log_prev, cur
+            if prev is None or dev.conn is None or cur[1:] == prev[1:]:
+                continue
+            dt = max(now - prev[0], 1e-3)
+            p50 = dev.fanout.display_latency.quantile(0.5)
+            udp = f"udp frame loss {dev.udp.stats()['frame_loss'] * 100:.1f}%, " if dev.udp_token else ""
+            print(f"[TCP] {dev.device_id}: {(cur[1] - prev[1]) / dt:.1f} fps, "
+                  f"{(cur[2] - prev[2]) * 8 / 1000 / dt:.0f} kbps, "
+                  f"lost {cur[3] - prev[3]}, sensor {(cur[4] - prev[4]) / dt:.1f}/s, {udp}"
+                  f"display p50 <= {'-' if p50 is None else f'{p50 * 1000:.0f}ms'}")
+
+def parse_hello(mtype, payload):
+    """
+    Pi 가 접속 직후 보내는 등록 메시지
+      {"cmd":"HELLO","device":"pi-livingroom","proto":5,"session":"...","udp":true,"roi":true}
+    HELLO 가 아니면 (None, 1, None, False, False),
+    맞으면 (device_id, proto 버전, session, UDP 영상 요청, 고해상도 ROI 가능)
+    """
+    if mtype != TYPE_CMD:
+        return None, 1, None, False, False
+    try:
+        obj = json.loads(bytes(payload).decode("utf-8"))
+    except Exception:
+        return None, 1, None, False, False
+    if not isinstance(obj, dict) or obj.get("cmd") != "HELLO":
+        return None, 1, None, False, False
+    device_id = str(obj.get("device") or "").strip()
+    try:
+        proto = int(obj.get("proto") or 1)
+    except (TypeError, ValueError):
+        proto = 1
+    return device_id or None, proto, obj.get("session"), bool(obj.get("udp")), bool(obj.get("roi"))
+
+def handle_pi_msg(dev, mtype, payload, seq=None, ts=None):
+    """seq / ts: v2 헤더의 Pi 시퀀스 번호 / 캡처 시각 (v1 이면 None)"""
+    if mtype == TYPE_SENSOR:
+        now = time.time()
+        dev.last_sensor_ts = now
+        dev.sensors += 1
+        records = unpack_sensor_batch(payload)
+        if records is None:
+            # 예전 형식: JSON 한 개 {"ultrasonic_cm": 87.2, "ts": ...} → 숫자 필드는 이력에도 저장
+            msg = bytes(payload).decode("utf-8", errors="replace")
+            try:
+                obj = json.loads(msg)
+            except ValueError:
+                obj = None
+            if isinstance(obj, dict):
+                ts = obj.get("ts") if isinstance(obj.get("ts"), (int, float)) else None
+                records = [(k, ts, v) for k, v in obj.items()
+                           if k != "ts" and isinstance(v, (int, float)) and not isinstance(v, bool)]
+            socketio.emit("sensor", msg, to=dev.room)
+        elif records:
+            # 묶음: 브라우저에는 채널별 최신 값만 (예전과 같은 JSON 모양)
+            latest = {ch: round(v, 2) for ch, _, v in records}
+            latest["ts"] = records[-1][1]
+            latest["batch"] = len(records)
+            socketio.emit("sensor", json.dumps(latest), to=dev.room)
+        for ch, ts, v in records or ():
+            # Pi 시계 → 서버 시계. 오프셋을 아직 모르면 받은 시각
+            #   (Pi 시각을 그대로 넣으면 Pi 시계가 앞설 때 Series.add 가 이후 샘플을 전부 그 미래 시각에 붙임)
+            server_ts = dev.clock.to_server(ts)
+            if server_ts is None:
+                server_ts = now
+            sensor_store.add(dev.device_id, ch, server_ts, v)
+
+    elif mtype == TYPE_IMAGE:
+        t_recv = time.monotonic()
+        dev.last_frame_ts = time.time()
+        dev.frames += 1
+        n = len(payload)
+        dev.bytes_in += n
+        dev.on_seq(seq)
+        cap_ts = dev.clock.to_server(ts)
+        if cap_ts is not None:
+            dev.capture_latency.observe(max(0.0, dev.last_frame_ts - cap_ts))
+
+        # Pi 가 바로 앞에 보낸 FRAME_META (없으면 움직임 정보 모름 = 변화 있다고 봄)
+        #   UDP 영상이면 메타(TCP)와 순서가 어긋날 수 있어서 seq 가 맞을 때만
+        meta, dev.next_meta = dev.next_meta, None
+        if meta is not None and seq is not None and meta.get("seq", seq) != seq:
+            meta = None
+        dev.last_meta = meta
+        changed = meta is None or meta.get("roi") is not None
+        if not changed:
+            dev.static_frames += 1
+
+        # ✅ 1) JPEG 바이너리인지 먼저 확인 (JPEG 매직: FF D8 ... FF D9)
+        is_jpeg_bytes = (n >= 4 and payload[:2] == b"\xff\xd8")
+
+        jpeg = None   # 원본 JPEG bytes (binary 전송/서버 인식용)
+        b64 = None    # base64 모드일 때만
+
+        if is_jpeg_bytes:
+            # payload가 진짜 JPEG bytes면: binary 는 그대로, base64 모드면 인코딩
+            jpeg = bytes(payload)  # reader 버퍼는 재사용되므로 여기서 한 번만 복사
+            if FRAME_MODE != "binary":
+                b64 = base64.b64encode(jpeg).decode("ascii")
+
+            # (디버그) 가끔 파일로 저장해서 깨졌는지 확인 가능
+            # with open("debug.jpg", "wb") as f:
+            #     f.write(payload)
+
+        else:
+            # ✅ 2) JPEG가 아니면 "이미 base64 텍스트"로 왔을 가능성
+            # payload를 문자열로 보고, 그걸 base64로 디코드해 JPEG인지 검증
+            try:
+                text = bytes(payload).decode("ascii", errors="ignore").strip()
+
+                # dataURL 형태로 올 수도 있으니 앞부분 제거
+                if text.startswith("data:image"):
+                    # "data:image/jpeg;base64,xxxx" 에서 xxxx만 뽑기
+                    comma = text.find(",")
+                    if comma != -1:
+                        text = text[comma+1:].strip()
+
+                # base64 검증 디코드 (validate는 padding/문자 이상하면 에러)
+                raw = base64.b64decode(text, validate=True)
+
+                if len(raw) >= 2 and raw[:2] == b"\xff\xd8":
+                    # ✅ payload가 "base64 문자열"이 맞음
+                    #    binary 모드면 디코드한 JPEG 를, 아니면 문자열 그대로 보냄
+                    jpeg = raw
+                    if FRAME_MODE != "binary":
+                        b64 = text
+
+                    # (디버그) 필요하면 원본 저장
+                    # with open("debug_from_b64.jpg", "wb") as f:
+                    #     f.write(raw)
                 else:
-                    # ✅ 2) JPEG가 아니면 "이미 base64 텍스트"로 왔을 가능성
-                    # payload를 문자열로 보고, 그걸 base64로 디코드해 JPEG인지 검증
-                    try:
-                        s = payload.decode("ascii", errors="ignore").strip()
-
-                        # dataURL 형태로 올 수도 있으니 앞부분 제거
-                        if s.startswith("data:image"):
-                            # "data:image/jpeg;base64,xxxx" 에서 xxxx만 뽑기
-                            comma = s.find(",")
-                            if comma != -1:
-                                s = s[comma+1:].strip()
-
-                        # base64 검증 디코드 (validate는 padding/문자 이상하면 에러)
-                        raw = base64.b64decode(s, validate=True)
-
-                        if len(raw) >= 2 and raw[:2] == b"\xff\xd8":
-                            # ✅ payload가 "base64 문자열"이 맞음 → 그대로 브라우저로 보내면 됨
-                            b64 = s
-
-                            # (디버그) 필요하면 원본 저장
-                            # with open("debug_from_b64.jpg", "wb") as f:
-                            #     f.write(raw)
-                        else:
-                            print("[TCP] IMAGE payload is not JPEG (decoded head:", raw[:4], ")")
-
-                    except Exception as e:
-                        print("[TCP] IMAGE payload not jpeg-bytes and not valid base64:", e)
-
-                # ✅ 최종 emit
-                if b64:
-                    socketio.emit("frame", b64)
-                else:
-                    print("[TCP] drop frame (cannot convert to b64)")
+                    print("[TCP] IMAGE payload is not JPEG (decoded head:", raw[:4], ")")
+
+            except Exception as e:
+                print("[TCP] IMAGE payload not jpeg-bytes and not valid base64:", e)
+
+        # ✅ 최종 emit (binary 는 브라우저에서 ArrayBuffer 로 받음)
+        if b64:
+            dev.fanout.publish(Frame(b64, jpeg, cap_ts))
+        elif jpeg:
+            dev.fanout.publish(Frame(jpeg, jpeg, cap_ts))
+        else:
+            print("[TCP] drop frame (not a JPEG)")
+
+        # 알림 전후 녹화용 링 (JPEG bytes 참조만 - 복사 없음)
+        if jpeg and recorder is not None:
+            recorder.add(dev.device_id, jpeg, cap_ts or dev.last_frame_ts)
+
+        # 서버측 인식 (풀이 바쁘거나, 변화 없는 키프레임이면 건너뜀)
+        if jpeg and detector is not None and changed:
+            detector.submit(dev.device_id, jpeg)
+        dev.process_latency.observe(time.monotonic() - t_recv)
+
+    elif mtype == TYPE_ROI:
+        # 서버가 요청한 영역의 원본 해상도 크롭 (seq 는 ROI 전용 번호, ts 는 잘라낸 프레임 캡처 시각)
+        parsed = unpack_roi(payload)
+        if parsed is None:
+            print(f"[TCP] drop ROI from {dev.device_id} (bad payload)")
+            return
+        roi_id, rect, view = parsed
+        jpeg = bytes(view)
+        cap_ts = dev.clock.to_server(ts)
+        dev.roi_latest[roi_id] = (jpeg, rect, cap_ts or time.time(), seq)
+        dev.roi_stats["frames"] += 1
+        dev.roi_stats["bytes"] += len(jpeg)
+        socketio.emit("roi_frame", {"device": dev.device_id, "id": roi_id, "rect": rect, "seq": seq,
+                                    "jpeg": jpeg}, to=dev.room)
+        if detector is not None:
+            # 본 프레임과 따로 1장씩 (크롭이 본 영상 인식 순서를 밀어내지 않게)
+            detector.submit(dev.device_id, jpeg, channel="roi", extra={"roi": {"id": roi_id, "rect": rect}})
+
+    elif mtype == TYPE_CMD:
+        # Pi -> Server로 CMD 올 수도 있음(로그용)
+        try:
+            obj = json.loads(bytes(payload).decode("utf-8"))
+        except Exception:
+            obj = None
+
+        if isinstance(obj, dict) and obj.get("cmd") == "FRAME_META":
+            # 매 프레임 오는 메타 → 로그 생략
+            obj.pop("cmd")
+            dev.next_meta = obj
+            return
+
+        if isinstance(obj, dict) and obj.get("cmd") == "PING":
+            return   # 생존 신호 (받은 것만으로 recv timeout 이 연장됨)
 
+        if isinstance(obj, dict) and obj.get("cmd") == "TIME":
+            dev.clock.on_reply(obj, time.time())
+            return
+
+        if isinstance(obj, dict) and obj.get("cmd") == "ALERT_EVENT":
+            # Pi 가 로컬 규칙으로 이미 울린 알림 → 브라우저에 표시만
+            obj.pop("cmd")
+            obj["device"] = dev.device_id
+            dev.pi_alerts += 1
+            print(f"[TCP] ALERT FROM PI ({dev.device_id}): {obj.get('type')} "
+                  f"\"{obj.get('message')}\" latency={obj.get('latency_ms')}ms")
+            socketio.emit("pi_alert", obj, to=dev.room)
+            alert_dispatcher.submit(dev, obj, "pi")   # 곧 올 브라우저/서버 중복 알림 억제
+            return
+
+        print(f"[TCP] CMD FROM PI ({dev.device_id}):", bytes(payload[:200]))
+
+def register_pi(conn, addr, mtype, payload):
+    """
+    연결의 첫 메시지로 장치 등록. HELLO 면 그 device_id 로, 아니면(구버전 Pi) IP 로
+    conn: 소켓 또는 ingest.RemoteConn (send_msg / close 만 씀)
+    """
+    device_id, proto, session, want_udp, roi_capable = parse_hello(mtype, payload)
+    first = None
+    if device_id is None:
+        device_id = addr[0]
+        first = (mtype, payload)
+
+    dev = get_device(device_id)
+    old = dev.conn
+    now = time.time()
+    # 같은 세션이면 (Wi-Fi 잠깐 끊김) 시계 오프셋 / seq 를 이어감 → 끊긴 동안 못 받은 것도 lost 로 잡힘
+    resumed = session is not None and session == dev.session
+    down_sec = round(now - dev.disconnected_ts, 2) if resumed and dev.disconnected_ts else None
+    if not resumed:
+        dev.clock = ClockSync()
+        dev.last_seq = None
+    if dev.connected_ts:
+        dev.reconnects += 1
+    dev.session = session
+    dev.connected_ts = now
+    dev.proto = min(proto, PROTO_VERSION)
+    dev.roi_capable = roi_capable and dev.proto >= 5
+    dev.set_conn(conn, addr)
+    set_udp(dev, want_udp and UDP_ENABLED and dev.proto >= 2)
+    threading.Thread(target=dev.writer_loop, args=(conn,), daemon=True).start()
+    if old is not None:
+        # 같은 ID 로 새로 붙으면 예전 연결은 정리 (half-open 연결 등)
+        print(f"[TCP] {device_id}: replacing old connection")
+        try:
+            old.close()
+        except OSError:
+            pass
+    print(f"[TCP] Pi registered: {device_id} {addr} proto={dev.proto}" + (" roi" if dev.roi_capable else "")
+          + (f" (resumed after {down_sec}s)" if resumed else ""))
+    attach_waiting(dev)   # 이 장치를 먼저 고르고 기다리던 탭
+
+    if dev.proto >= 2:
+        # v2 헤더 써도 된다고 알려주고, 시계 오프셋 바로 한 번 측정
+        welcome = {"cmd": "WELCOME", "proto": dev.proto, "resumed": resumed, "down_sec": down_sec}
+        if dev.udp_token is not None:
+            welcome.update(udp_port=UDP_PORT, udp_token=dev.udp_token)
+        dev.send(TYPE_CMD, json.dumps(welcome).encode("utf-8"))
+        send_time_request(dev)
+
+    if first is not None:
+        handle_pi_msg(dev, *first)
+    return dev
+
+def unregister_pi(dev, conn):
+    with dev.out_cond:
+        gone = dev.conn is conn     # 새 연결이 이미 붙었으면 그쪽 상태는 그대로
+        if gone:
+            dev.conn = None
+            dev.disconnected_ts = time.time()
+            dev.out_cond.notify_all()   # writer_loop 종료
+    if gone:
+        set_udp(dev, False)
+
+def pi_conn_thread(conn, addr):
+    """Pi 연결 하나 전담 (장치마다 스레드 하나)"""
+    reader = MsgReader(conn)  # payload 는 다음 recv_msg 전까지만 유효한 memoryview
+    dev = None
+    conn.settimeout(HEARTBEAT_TIMEOUT)   # Pi 는 최소 HEARTBEAT_INTERVAL 마다 뭔가 보냄
+    try:
+        mtype, payload = reader.recv_msg()
+        if mtype is None:
+            return
+        dev = register_pi(conn, addr, mtype, payload)
 
-            elif mtype == TYPE_CMD:
-                # Pi -> Server로 CMD 올 수도 있음(로그용)
-                print("[TCP] CMD FROM PI:", payload[:200])
+        while True:
+            mtype, payload = reader.recv_msg()
+            if mtype is None:
+                print(f"[TCP] Pi disconnected: {dev.device_id}")
+                break
+            handle_pi_msg(dev, mtype, payload, reader.seq, reader.ts)
 
+    except socket.timeout:
+        print(f"[TCP] {addr}: nothing received for {HEARTBEAT_TIMEOUT}s, dropping connection")
     except Exception as e:
-        print("[TCP] error:", e)
+        print("[TCP] error:", addr, e)
     finally:
-        with pi_lock:
-            pi_conn = None
+        if dev is not None:
+            unregister_pi(dev, conn)
         try:
             conn.close()
         except:
             pass
-        s.close()
 
-@app.route("/")
+# =========================
+# UDP 영상 수신
+# =========================
+def set_udp(dev, enabled):
+    """연결마다 새 token (예전 연결의 늦은 조각이 섞이지 않게)"""
+    with devices_lock:
+        if dev.udp_token is not None:
+            udp_devices.pop(dev.udp_token, None)
+            dev.udp_token = None
+        dev.udp.reset()
+        if enabled:
+            token = random.getrandbits(32)
+            while token in udp_devices:
+                token = random.getrandbits(32)
+            dev.udp_token = token
+            udp_devices[token] = dev
+
+def udp_thread():
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024 * 1024)   # 프레임 몇 장 분량
+    s.bind((TCP_HOST, UDP_PORT))
+    s.settimeout(UDP_FRAME_DEADLINE / 2)   # 조용할 때도 deadline 지난 프레임 정리
+    print(f"[UDP] waiting video on {UDP_PORT}...")
+
+    buf = bytearray(65536)
+    view = memoryview(buf)
+    last_expire = time.monotonic()
+    while True:
+        try:
+            n, addr = s.recvfrom_into(buf)
+        except socket.timeout:
+            n = 0
+        except Exception as e:
+            print("[UDP] recv error:", e)
+            time.sleep(0.1)
+            continue
+
+        now = time.monotonic()
+        if n >= UDP_HEADER_SIZE:
+            token, seq, ts_us, index, count = UDP_HEADER.unpack_from(buf)
+            with devices_lock:
+                dev = udp_devices.get(token)
+            # token + 보낸 IP 가 그 장치의 TCP 연결과 같아야 받음
+            if dev is not None and dev.addr is not None and addr[0] == dev.addr[0]:
+                done = dev.udp.add(seq, ts_us, index, count, view[UDP_HEADER_SIZE:n], now)
+                if done is not None:
+                    payload, ts = done
+                    handle_pi_msg(dev, TYPE_IMAGE, payload, seq, ts)
+
+        if now - last_expire >= UDP_FRAME_DEADLINE / 2:
+            last_expire = now
+            with devices_lock:
+                devs = list(udp_devices.values())
+            for dev in devs:
+                dev.udp.expire(now)
+
+def tcp_accept_thread():
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    s.bind((TCP_HOST, TCP_PORT))
+    s.listen(64)
+    print(f"[TCP] waiting Pi on {TCP_PORT}...")
+
+    while True:
+        try:
+            conn, addr = s.accept()
+        except Exception as e:
+            print("[TCP] accept error:", e)
+            time.sleep(0.5)
+            continue
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        set_keepalive(conn)
+        print("[TCP] Pi connected:", addr)
+        threading.Thread(target=pi_conn_thread, args=(conn, addr), daemon=True).start()
+
+# =========================
+# 워커 프로세스 수신 (INGEST_WORKERS > 0)
+# =========================
+ingest = None
+
+def ingest_loop(worker):
+    """워커 하나의 이벤트 → 예전 pi_conn_thread 와 같은 처리 (연결 상태는 cid 별로)"""
+    ring = ingest.ring
+    conns = {}    # cid -> [RemoteConn, PiDevice 또는 None]
+    while True:
+        ev = worker.recv()
+        if ev is None:
+            print(f"[INGEST] worker {worker.index} exited")
+            for rc, dev in conns.values():
+                if dev is not None:
+                    unregister_pi(dev, rc)
+            return
+        kind, cid = ev[0], ev[1]
+        if kind == "open":
+            print("[TCP] Pi connected:", ev[2], f"(worker {worker.index})")
+            conns[cid] = [RemoteConn(worker, cid, ev[2]), None]
+            continue
+        entry = conns.get(cid)
+        if entry is None:
+            continue
+        rc, dev = entry
+        try:
+            if kind == "frame":
+                _, _, lane, slot, gen, seq, ts = ev
+                jpeg = ring.read(lane, slot, gen)   # Socket.IO 로 보낼 bytes 로 한 번만 복사
+                if jpeg is None:
+                    ingest.overwritten += 1     # 읽기 전에 워커가 한 바퀴 돌아 덮어씀 → 버림
+                    continue
+                if dev is None:
+                    entry[1] = register_pi(rc, rc.addr, TYPE_IMAGE, jpeg)
+                else:
+                    handle_pi_msg(dev, TYPE_IMAGE, jpeg, seq, ts)
+            elif kind == "msg":
+                _, _, mtype, payload, seq, ts = ev
+                if dev is None:
+                    entry[1] = register_pi(rc, rc.addr, mtype, payload)
+                else:
+                    handle_pi_msg(dev, mtype, payload, seq, ts)
+            elif kind == "bad":
+                print("[TCP] drop frame (not a JPEG)")
+            elif kind == "closed":
+                del conns[cid]
+                reason = ev[2]
+                if reason == "timeout":
+                    print(f"[TCP] {rc.addr}: nothing received for {HEARTBEAT_TIMEOUT}s, dropping connection")
+                elif dev is not None:
+                    print(f"[TCP] Pi disconnected: {dev.device_id}" + ("" if reason == "closed" else f" ({reason})"))
+                if dev is not None:
+                    unregister_pi(dev, rc)
+        except Exception as e:
+            print("[TCP] error:", rc.addr, e)
+
+def start_ingest():
+    global ingest
+    ingest = IngestPool(TCP_HOST, TCP_PORT, INGEST_WORKERS, HEARTBEAT_TIMEOUT)
+    atexit.register(ingest.shutdown)   # 공유 메모리 정리
+    for w in ingest.workers:
+        threading.Thread(target=ingest_loop, args=(w,), daemon=True).start()
+    print(f"[TCP] waiting Pi on {TCP_PORT}... ({INGEST_WORKERS} ingest workers)")
+
+@web.route("/")
 def root():
     return send_from_directory(".", "index.html")
 
-@app.route("/health")
+@web.route("/health")
 def health():
+    with devices_lock:
+        devs = list(devices.values())
     return {
-        "pi_connected": pi_conn is not None,
-        "last_frame_age_sec": None if last_frame_ts == 0 else round(time.time() - last_frame_ts, 2),
-        "last_sensor_age_sec": None if last_sensor_ts == 0 else round(time.time() - last_sensor_ts, 2),
+        "pi_connected": any(dev.conn is not None for dev in devs),
+        "frame_mode": FRAME_MODE,
+        "devices": {dev.device_id: dev.status() for dev in devs},
+        "detect": None if detector is None else detector.stats(),
+        "ingest": None if ingest is None else ingest.stats(),
+        "sensor_store": sensor_store.stats(),
+        "recorder": None if recorder is None else recorder.stats(),
+        "alerts": alert_dispatcher.stats(),
     }
 
+def http_frame_device(device_id):
+    """device 를 안 주면 프레임이 있는 장치가 하나뿐일 때 그 장치. (dev, 오류 응답)"""
+    with devices_lock:
+        if device_id:
+            dev = devices.get(device_id)
+            return (dev, None) if dev is not None else (None, ({"error": f"unknown device '{device_id}'"}, 404))
+        live = [d for d in devices.values() if d.fanout.latest is not None]
+    if len(live) == 1:
+        return live[0], None
+    return None, ({"error": "device parameter required", "devices": sorted(d.device_id for d in live)}, 400)
+
+@web.route("/snapshot.jpg")
+def snapshot():
+    """
+    /snapshot.jpg?device=pi-livingroom → 최신 프레임 JPEG
+    ETag = 프레임 번호: 폴링하는 쪽이 If-None-Match 를 보내면 안 바뀐 동안 304 (본문 없음)
+    """
+    dev, err = http_frame_device(request.args.get("device"))
+    if err:
+        return err
+    with dev.fanout.lock:
+        frame, version = dev.fanout.latest, dev.fanout.version
+    if frame is None or frame.jpeg is None:
+        return {"error": "no frame yet"}, 404
+    etag = f"{BOOT_ID}-{version}"
+    headers = {"ETag": f'"{etag}"', "Cache-Control": "no-cache"}
+    if frame.cap_ts is not None:
+        # 캡처 시각을 모르는 프레임 (헤더에 시각이 없는 옛 장치) 이면 빈 값 대신 헤더를 빼 둠
+        headers["X-Frame-Age"] = f"{max(0.0, time.time() - frame.cap_ts):.3f}"
+    if etag in request.if_none_match:
+        dev.http["not_modified"] += 1
+        return Response(status=304, headers=headers)
+    dev.http["snapshots"] += 1
+    dev.http["snapshot_bytes"] += len(frame.jpeg)
+    return Response(frame.jpeg, mimetype="image/jpeg", headers=headers)
+
+@web.route("/stream.mjpeg")
+def stream_mjpeg():
+    """
+    /stream.mjpeg?device=pi-livingroom&fps=5 → multipart/x-mixed-replace (브라우저 <img>, VLC, NVR)
+    클라이언트가 느리면 쓰는 동안 온 프레임은 건너뛰고 다음엔 그때의 최신 프레임을 보냄
+    (뷰어별 큐 없음 - 밀려도 메모리가 안 늘고 지연도 안 쌓임)
+    """
+    dev, err = http_frame_device(request.args.get("device"))
+    if err:
+        return err
+    try:
+        fps = min(float(request.args.get("fps") or MJPEG_MAX_FPS), MJPEG_MAX_FPS)
+    except ValueError:
+        return {"error": "fps must be a number"}, 400
+    interval = 1.0 / fps if fps > 0 else 1.0 / MJPEG_MAX_FPS
+    sock = getattr(request.environ.get("eventlet.input"), "_sock", None)
+    if sock is not None:
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, MJPEG_SNDBUF)
+        except OSError:
+            pass
+    boundary = f"--{MJPEG_BOUNDARY}\r\n".encode("ascii")
+
+    def generate():
+        fanout = dev.fanout
+        stats = dev.http
+        stats["streams"] += 1
+        stats["streams_active"] += 1
+        version = 0
+        next_ts = 0.0
+        try:
+            while True:
+                frame, newest = fanout.wait_newer(version, MJPEG_IDLE_RESEND)
+                if frame is None or frame.jpeg is None:
+                    continue
+                if version and newest > version + 1:
+                    stats["stream_skipped"] += newest - version - 1
+                version = newest
+                jpeg = frame.jpeg
+                # 헤더 / 본문을 따로 yield → JPEG bytes 를 이어붙이느라 복사하지 않음
+                yield boundary
+                yield (f"Content-Type: image/jpeg\r\nContent-Length: {len(jpeg)}\r\n\r\n").encode("ascii")
+                yield jpeg
+                yield b"\r\n"
+                stats["stream_frames"] += 1
+                stats["stream_bytes"] += len(jpeg)
+                # fps 상한: 기다리는 동안 온 프레임은 다음 바퀴에서 건너뜀
+                now = time.monotonic()
+                next_ts = max(next_ts + interval, now)
+                socketio.sleep(next_ts - now)
+        finally:
+            stats["streams_active"] -= 1
+
+    return Response(generate(), mimetype=f"multipart/x-mixed-replace; boundary={MJPEG_BOUNDARY}",
+                    headers={"Cache-Control": "no-cache, private", "X-Accel-Buffering": "no"})
+
+@web.route("/sensor/history")
+def sensor_history():
+    """
+    /sensor/history?device=pi-livingroom&from=-3600&to=&step=10&channel=ultrasonic_cm
+      from / to : epoch 초. 0 이하면 지금 기준 상대값 (기본 from=-3600, to=지금)
+      step      : bucket 초 (기본 범위/500, bucket 이 tsdb.MAX_POINTS 를 넘지 않게 늘어남)
+      channel   : 쉼표로 여러 개 (없으면 전부)
+    bucket 마다 min / max / mean / count (샘플 없는 bucket 은 빠짐)
+    """
+    device_id = request.args.get("device", "")
+    if not sensor_store.channels(device_id):
+        return {"error": f"no sensor history for device '{device_id}'"}, 404
+    now = time.time()
+    try:
+        t0 = float(request.args.get("from") or -3600)
+        t1 = float(request.args.get("to") or 0)
+        step = float(request.args.get("step") or 0) or None
+    except ValueError:
+        return {"error": "from / to / step must be numbers"}, 400
+    t0 = now + t0 if t0 <= 0 else t0
+    t1 = now + t1 if t1 <= 0 else t1
+    if t1 <= t0:
+        return {"error": "to must be after from"}, 400
+    channels = [c for c in (request.args.get("channel") or "").split(",") if c]
+    step, series = sensor_store.query(device_id, t0, t1, step, channels)
+    return {"device": device_id, "from": round(t0, 3), "to": round(t1, 3), "step": round(step, 3),
+            "channels": series}
+
+@web.route("/recordings")
+def recordings():
+    """/recordings?device=pi-livingroom → 세그먼트 목록 (최신 것부터)"""
+    if recorder is None:
+        return {"error": "recording disabled"}, 404
+    return {"recordings": tpool.execute(recorder.list, request.args.get("device") or None)}
+
+@web.route("/recordings/<device>/<name>")
+def recording_index(device, name):
+    """세그먼트 프레임 시각 목록 (재생 UI 의 탐색 막대용)"""
+    ts = None if recorder is None else tpool.execute(read_recording_index, f"{device}/{name}")
+    if ts is None:
+        return {"error": "no such recording"}, 404
+    return {"id": f"{device}/{name}", "frames": len(ts), "ts": ts}
+
+@web.route("/recordings/<device>/<name>/frame.jpg")
+def recording_frame(device, name):
+    """?t=세그먼트 시작부터 초 (그 시각에 보이던 프레임) 또는 ?i=프레임 번호"""
+    try:
+        t = float(request.args.get("t") or 0)
+        i = int(request.args["i"]) if "i" in request.args else None
+    except ValueError:
+        return {"error": "t / i must be numbers"}, 400
+    found = None if recorder is None else tpool.execute(read_recording_frame, f"{device}/{name}", t, i)
+    if found is None:
+        return {"error": "no such recording"}, 404
+    jpeg, ts, idx, count = found
+    return Response(jpeg, mimetype="image/jpeg",
+                    headers={"X-Frame-Ts": f"{ts:.3f}", "X-Frame-Index": str(idx), "X-Frame-Count": str(count),
+                             "Cache-Control": "max-age=3600"})
+
+@web.route("/roi.jpg")
+def roi_jpeg():
+    """/roi.jpg?device=pi-livingroom&id=1 → 그 ROI 의 마지막 고해상도 크롭 (id 없으면 가장 최근 것)"""
+    dev, err = http_frame_device(request.args.get("device"))
+    if err:
+        return err
+    latest = dict(dev.roi_latest)
+    if request.args.get("id"):
+        try:
+            item = latest.get(int(request.args["id"]))
+        except ValueError:
+            return {"error": "bad id"}, 400
+    else:
+        item = max(latest.values(), key=lambda v: v[2], default=None)
+    if item is None:
+        return {"error": "no roi frame yet"}, 404
+    jpeg, rect, cap_ts, _ = item
+    return Response(jpeg, mimetype="image/jpeg",
+                    headers={"X-ROI-Rect": ",".join(map(str, rect)), "Cache-Control": "no-cache",
+                             "X-Frame-Age": f"{max(0.0, time.time() - cap_ts):.3f}"})
+
+@web.route("/metrics")
+def metrics():
+    """Prometheus 스크랩용 (텍스트 포맷)"""
+    with devices_lock:
+        devs = list(devices.values())
+    by_dev = [({"device": d.device_id}, d) for d in devs]
+    viewer_totals = [(lab, d.fanout.stats().values()) for lab, d in by_dev]
+
+    def stage_samples():
+        for lab, d in by_dev:
+            for stage, hist in (("capture_to_server", d.capture_latency),
+                                ("server_process", d.process_latency),
+                                ("emit_to_ack", d.fanout.ack_latency),
+                                ("capture_to_display", d.fanout.display_latency)):
+                yield dict(lab, stage=stage), hist
+
+    body = "".join((
+        render("bridge_device_connected", "gauge", "Pi TCP connection is up",
+               [(lab, int(d.conn is not None)) for lab, d in by_dev]),
+        render("bridge_reconnects_total", "counter", "Times the Pi connected again after its first connection",
+               [(lab, d.reconnects) for lab, d in by_dev]),
+        render("bridge_frames_received_total", "counter", "IMAGE messages received from the Pi",
+               [(lab, d.frames) for lab, d in by_dev]),
+        render("bridge_frames_lost_total", "counter", "Frames missing from the Pi sequence (v2 only)",
+               [(lab, d.lost) for lab, d in by_dev]),
+        render("bridge_udp_fragments_received_total", "counter", "UDP video fragments received",
+               [(lab, d.udp.frags_received) for lab, d in by_dev]),
+        render("bridge_udp_fragments_lost_total", "counter", "UDP video fragments missing from dropped frames",
+               [(lab, d.udp.frags_lost) for lab, d in by_dev]),
+        render("bridge_udp_frames_dropped_total", "counter", "UDP frames dropped as incomplete or superseded",
+               [(lab, d.udp.dropped) for lab, d in by_dev]),
+        render("bridge_bytes_received_total", "counter", "IMAGE payload bytes received from the Pi",
+               [(lab, d.bytes_in) for lab, d in by_dev]),
+        render("bridge_sensor_messages_total", "counter", "SENSOR messages received from the Pi",
+               [(lab, d.sensors) for lab, d in by_dev]),
+        render("bridge_viewers", "gauge", "Viewers subscribed to the device",
+               [(lab, len(vs)) for lab, vs in viewer_totals]),
+        render("bridge_viewer_frames_sent_total", "counter", "Frames emitted to current viewers",
+               [(lab, sum(v["sent"] for v in vs)) for lab, vs in viewer_totals]),
+        render("bridge_viewer_frames_dropped_total", "counter", "Frames skipped for slow current viewers",
+               [(lab, sum(v["dropped"] for v in vs)) for lab, vs in viewer_totals]),
+        render("bridge_viewer_bytes_sent_total", "counter", "Frame bytes emitted to current viewers",
+               [(lab, sum(v["bytes"] for v in vs)) for lab, vs in viewer_totals]),
+        render("bridge_renditions_total", "counter", "Renditions encoded on demand",
+               [(dict(lab, rendition=name), n) for lab, d in by_dev for name, n in d.fanout.rendered.items()]),
+        render("bridge_viewer_ack_timeouts_total", "counter", "Frame acks that never arrived",
+               [(lab, sum(v["timeouts"] for v in vs)) for lab, vs in viewer_totals]),
+        render("bridge_alerts_total", "counter", "Alerts by outcome (delivered to the Pi queue, suppressed as duplicate, ...)",
+               [({"device": dev_id, "outcome": k}, v)
+                for dev_id, c in alert_dispatcher.stats()["counts"].items() for k, v in c.items()]),
+        render("bridge_ingest_frames_overwritten_total", "counter",
+               "Frames overwritten in the shared ring before the web process read them",
+               [] if ingest is None else [({}, ingest.overwritten)]),
+        render("bridge_http_connections", "gauge", "Open /stream.mjpeg connections",
+               [(lab, d.http["streams_active"]) for lab, d in by_dev]),
+        render("bridge_http_requests_total", "counter", "HTTP video requests by kind",
+               [(dict(lab, kind=kind), d.http[key]) for lab, d in by_dev
+                for kind, key in (("snapshot", "snapshots"), ("snapshot_not_modified", "not_modified"),
+                                  ("stream", "streams"))]),
+        render("bridge_http_bytes_total", "counter", "JPEG bytes served over HTTP",
+               [(dict(lab, kind=kind), d.http[key]) for lab, d in by_dev
+                for kind, key in (("snapshot", "snapshot_bytes"), ("stream", "stream_bytes"))]),
+        render("bridge_http_stream_frames_skipped_total", "counter", "Frames skipped for slow MJPEG readers",
+               [(lab, d.http["stream_skipped"]) for lab, d in by_dev]),
+        render("bridge_roi_requests_total", "counter", "ROI commands sent to the Pi (new, renewed or cleared)",
+               [(lab, d.roi_stats["requests"]) for lab, d in by_dev]),
+        render("bridge_roi_frames_total", "counter", "High-resolution ROI crops received from the Pi",
+               [(lab, d.roi_stats["frames"]) for lab, d in by_dev]),
+        render("bridge_roi_bytes_total", "counter", "ROI crop JPEG bytes received from the Pi",
+               [(lab, d.roi_stats["bytes"]) for lab, d in by_dev]),
+        render("bridge_pi_outbox_dropped_total", "counter", "Commands dropped because the Pi send queue was full",
+               [(lab, d.out_dropped) for lab, d in by_dev]),
+        render("bridge_clock_offset_seconds", "gauge", "Pi clock minus server clock",
+               [(lab, d.clock.offset) for lab, d in by_dev]),
+        render("bridge_clock_rtt_seconds", "gauge", "Round trip of the sample used for the offset",
+               [(lab, d.clock.rtt) for lab, d in by_dev]),
+        render("bridge_frame_latency_seconds", "histogram", "Per-stage frame latency",
+               list(stage_samples())),
+    ))
+    return Response(body, mimetype="text/plain; version=0.0.4")
+
+# =========================
+# 브라우저 (Socket.IO)
+# =========================
+viewer_device = {}    # sid -> 구독 중인 device_id
+viewer_waiting = {}   # sid -> (device_id, rendition): 아직 등록 안 된 장치를 고른 탭 (탭당 하나)
+
+def subscribe(sid, device_id, rendition="full"):
+    """
+    등록된 장치만 구독. 모르는 ID 면 PiDevice 를 만들지 않고 대기
+    (브라우저가 보낸 아무 ID 로 레지스트리 / metrics 가 늘지 않게). 그 Pi 가 붙으면 attach_waiting 이 연결
+    """
+    if rendition not in RENDITIONS:
+        rendition = "full"
+    dev = find_device(device_id)
+    if dev is not None and viewer_device.get(sid) == device_id:
+        dev.fanout.add(sid, rendition)   # rendition 만 바꿈
+        return True
+    unsubscribe(sid)
+    if dev is None:
+        viewer_waiting[sid] = (device_id, rendition)
+        print(f"[WEB] {sid} waiting for unknown device {device_id}")
+        return False
+
+    viewer_device[sid] = device_id
+    socketio.server.enter_room(sid, dev.room, namespace="/")
+    dev.fanout.add(sid, rendition)
+    print(f"[WEB] {sid} subscribed {device_id} ({rendition})")
+    return True
+
+def unsubscribe(sid):
+    viewer_waiting.pop(sid, None)
+    dev = find_device(viewer_device.pop(sid, None))
+    if dev is not None:
+        dev.fanout.remove(sid)
+        socketio.server.leave_room(sid, dev.room, namespace="/")
+
+def attach_waiting(dev):
+    for sid, (device_id, rendition) in list(viewer_waiting.items()):
+        if device_id == dev.device_id:
+            subscribe(sid, device_id, rendition)
+
 @socketio.on("connect")
 def on_connect():
-    print("[WEB] browser connected")
+    print("[WEB] browser connected", request.sid)
+    # io({ query: { device, rendition } }) 로 접속하면 바로 구독
+    device_id = request.args.get("device")
+    if device_id:
+        subscribe(request.sid, device_id, request.args.get("rendition") or "full")
 
 @socketio.on("disconnect")
 def on_disconnect():
-    print("[WEB] browser disconnected")
+    unsubscribe(request.sid)
+    print("[WEB] browser disconnected", request.sid)
+
+@socketio.on("subscribe")
+def on_subscribe(data=None):
+    """data 예: { device:'pi-livingroom', rendition:'thumb' }  (rendition: full / thumb / low)"""
+    if data is None:
+        data = {}
+    if not isinstance(data, dict):
+        return {"ok": False, "error": "bad payload"}
+    device_id = str(data.get("device") or "").strip()
+    if device_id:
+        return {"ok": subscribe(request.sid, device_id, str(data.get("rendition") or "full"))}
 
 @socketio.on("alert")
-def on_alert(data):
+def on_alert(data=None):
     """
-    브라우저(ml5)에서 탐지 -> 서버 -> Pi로 전달
-    data 예: { type:'person', confidence:0.78, message:'사람이 앞에 있습니다' }
+    브라우저(tfjs 워커)에서 탐지 -> 서버 -> Pi로 전달
+    data 예: { device:'pi-livingroom', type:'person', confidence:0.78, message:'사람이 앞에 있습니다' }
+    device 가 없으면 그 탭이 보고 있는 장치로 보낸다.
+    탭마다 같은 걸 보내도 디스패처가 합치고, Pi 전송은 큐에 넣기만 함 (여기서 안 막힘)
     """
-    cmd = json.dumps({"cmd": "ALERT", "payload": data}, ensure_ascii=False).encode("utf-8")
-    with pi_lock:
-        if not pi_conn:
-            print("[CMD] Pi not connected, drop alert")
-            return
-        try:
-            send_msg(pi_conn, TYPE_CMD, cmd)
-            print("[CMD] ALERT -> Pi", data)
-        except Exception as e:
-            print("[CMD] send to Pi failed:", e)
+    if data is None:
+        data = {}
+    if not isinstance(data, dict):
+        print("[CMD] bad alert payload, drop:", type(data).__name__)
+        return
+    device_id = data.get("device") or viewer_device.get(request.sid)
+    with devices_lock:
+        dev = devices.get(device_id)
+    if dev is None:
+        print("[CMD] unknown device, drop alert:", device_id)
+        return
 
-if __name__ == "__main__":
-    threading.Thread(target=tcp_pi_thread, daemon=True).start()
+    alert_dispatcher.submit(dev, data, "browser")
+
+@socketio.on("roi")
+def on_roi(data=None):
+    """
+    브라우저에서 고른 영역을 고해상도로
+    data 예: { device:'pi-livingroom', rect:[0.4, 0.3, 0.2, 0.2] }  (0~1 비율, rect 가 없으면 끔)
+    장치마다 브라우저 ROI 는 하나 (새로 고르면 이전 것을 대체), ROI_MANUAL_TTL 뒤 저절로 꺼짐
+    """
+    if data is None:
+        data = {}
+    if not isinstance(data, dict):
+        return {"ok": False, "error": "bad payload"}
+    device_id = data.get("device") or viewer_device.get(request.sid)
+    with devices_lock:
+        dev = devices.get(device_id)
+    if dev is None or not dev.roi_capable:
+        return {"ok": False, "error": "device does not support roi"}
+    rect = data.get("rect")
+    try:
+        if rect:
+            ok = request_roi(dev, [float(v) for v in rect][:4], ROI_ID_MANUAL, ROI_MANUAL_TTL, "browser")
+        else:
+            ok = request_roi(dev, None, ROI_ID_MANUAL, 0, "browser")
+    except (TypeError, ValueError):
+        return {"ok": False, "error": "bad rect"}
+    return {"ok": ok}
+
+def main():
+    """
+    서버 시작. 무거운 객체 생성 / 스레드 / 소켓은 전부 여기서
+    (이 파일은 import 만으로는 아무것도 안 만듦 - spawn 워커가 다시 import 해도 무해)
+    """
+    global sensor_store, alert_dispatcher, recorder
+    app = Flask(__name__, static_folder=".")
+    app.register_blueprint(web)
+    socketio.init_app(
+        app,
+        cors_allowed_origins="*",
+        async_mode="eventlet",
+        max_http_buffer_size=1 * 1024 * 1024,  # 브라우저 -> 서버 수신 제한 (alert 등 작은 메시지뿐)
+    )
+    sensor_store = SensorStore()
+    alert_dispatcher = AlertDispatcher()
+    if RECORD_ENABLED:
+        recorder = EventRecorder(RECORD_DIR, RECORD_PRE_SEC, RECORD_POST_SEC, RECORD_MAX_SEGMENT_SEC,
+                                 retention_sec=RECORD_RETENTION_DAYS * 86400,
+                                 max_bytes=RECORD_MAX_MB * 1024 * 1024)
+
+    if INGEST_WORKERS > 0:
+        start_ingest()
+    else:
+        threading.Thread(target=tcp_accept_thread, daemon=True).start()
+    if UDP_ENABLED:
+        threading.Thread(target=udp_thread, daemon=True).start()
+    socketio.start_background_task(fanout_timeout_loop)
+    socketio.start_background_task(feedback_loop)
+    socketio.start_background_task(clock_sync_loop)
+    socketio.start_background_task(heartbeat_loop)
+    socketio.start_background_task(log_sample_loop)
+    socketio.start_background_task(alert_sweep_loop)
+    if recorder is not None:
+        socketio.start_background_task(record_loop)
+    if DETECT_ENABLED:
+        start_detector()
     print(f"[WEB] open http://localhost:{WEB_PORT}")
     print(f"[WEB] health http://localhost:{WEB_PORT}/health")
+    print(f"[WEB] metrics http://localhost:{WEB_PORT}/metrics")
     socketio.run(app, host=WEB_HOST, port=WEB_PORT)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import threading, time
+
+# =========================
+# 전송 품질 자동 조절 (Pi)
+#   send 시간(sendall 이 막힌 시간) + 서버 FEEDBACK 을 보고
+#   JPEG 품질 / 해상도 / FPS 를 범위 안에서 올리고 내린다.
+# =========================
+TARGET_SEND_MS = 80          # 프레임 한 장 전송 목표 시간 (이보다 길면 링크 포화)
+QUALITY_MIN, QUALITY_MAX = 35, 85
+FPS_MIN, FPS_MAX = 3, 15
+SCALES = (1.0, 0.75, 0.5)    # 원본 대비 해상도 배율 (앞쪽이 고화질)
+UPDATE_INTERVAL = 1.0        # 조절 주기(초)
+HOLD_INTERVALS = 1           # 조절 후 효과 볼 때까지 대기할 주기 수
+EWMA_ALPHA = 0.3
+FAST_UP_RATIO = 0.25         # send 시간이 목표의 이 비율도 안 되면 두 단계씩 올림 (막혔다 풀린 뒤 빨리 회복)
+
+class AdaptiveController:
+    """
+    pipeline 은 quality / scale / fps 를 읽기만 하고,
+    on_send() / on_feedback() 로 측정값을 넣어준다.
+
+    내릴 때:  quality → 해상도 → fps   (화질부터 양보, 움직임은 최대한 유지)
+    올릴 때:  fps → 해상도 → quality
+    올리는 건 전송 시간이 목표보다 한참 짧고 서버도 다 받고 있을 때만.
+    내릴 때처럼 여유가 아주 크면 두 단계씩 (두 번째는 fps 말고 해상도/품질, 품질도 내릴 때만큼 10씩),
+    그때는 HOLD 없이 다음 주기에 바로 또 본다 (막혔다 풀린 링크에서 몇 초 안에 원래 화질로).
+    fps 는 지금 fps 도 못 내고 있으면 안 올림 (카메라/인코더가 병목이면 올려 봐야 버려질 뿐)
+    """
+
+    def __init__(self, quality=70, fps=10, target_send_ms=TARGET_SEND_MS,
+                 quality_range=(QUALITY_MIN, QUALITY_MAX), fps_range=(FPS_MIN, FPS_MAX),
+                 scales=SCALES):
+        self.lock = threading.Lock()
+        self.target_ms = target_send_ms
+        self.qmin, self.qmax = quality_range
+        self.fmin, self.fmax = fps_range
+        self.scales = scales
+
+        self.quality = max(self.qmin, min(self.qmax, quality))
+        self.fps = max(self.fmin, min(self.fmax, fps))
+        self.scale_idx = 0
+
+        self.send_ms = None          # EWMA
+        self.send_started = None     # 지금 막혀 있는 send 의 시작 시각 (없으면 None)
+        self.throughput = None       # EWMA bytes/sec (sendall 기준)
+        self.sent_frames = 0         # 이번 주기 전송 수
+        self.server_rx_fps = None    # 서버 FEEDBACK
+        self.viewer_drop_ratio = 0.0
+        self.udp_loss = None         # UDP 영상일 때 서버가 본 조각 손실률
+
+        self.last_update = time.monotonic()
+        self.hold = 0
+        self.changes = 0
+
+    @property
+    def scale(self):
+        return self.scales[self.scale_idx]
+
+    # ---- 측정값 입력 ----
+    def begin_send(self):
+        with self.lock:
+            self.send_started = time.monotonic()
+
+    def on_send(self, nbytes, send_sec):
+        with self.lock:
+            self.send_started = None
+            ms = send_sec * 1000.0
+            self.send_ms = ms if self.send_ms is None else \
+                self.send_ms + EWMA_ALPHA * (ms - self.send_ms)
+            bps = nbytes / max(send_sec, 1e-4)
+            self.throughput = bps if self.throughput is None else \
+                self.throughput + EWMA_ALPHA * (bps - self.throughput)
+            self.sent_frames += 1
+        self.update()
+
+    def on_feedback(self, obj):
+        """서버 FEEDBACK: {"cmd":"FEEDBACK","rx_fps":9.8,"rx_kbps":410,"viewer_drop_ratio":0.1,"udp_loss":0.02}"""
+        with self.lock:
+            if obj.get("rx_fps") is not None:
+                self.server_rx_fps = float(obj["rx_fps"])
+            self.viewer_drop_ratio = float(obj.get("viewer_drop_ratio") or 0.0)
+            if obj.get("udp_loss") is not None:
+                self.udp_loss = float(obj["udp_loss"])
+
+    # ---- 조절 ----
+    def update(self, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            elapsed = now - self.last_update
+            if elapsed < UPDATE_INTERVAL or self.send_ms is None:
+                return False
+            sent_fps = self.sent_frames / elapsed
+            self.sent_frames = 0
+            self.last_update = now
+            # 링크가 막혀 send 가 안 끝나면 EWMA 는 옛 값 그대로 → 진행 중인 send 시간도 같이 봄
+            send_ms = self.send_ms
+            if self.send_started is not None:
+                send_ms = max(send_ms, (now - self.send_started) * 1000.0)
+
+            if self.hold > 0:
+                self.hold -= 1
+                return False
+
+            # 서버가 우리가 보낸 것보다 확실히 덜 받으면 어딘가 쌓이는 중
+            backlog = (self.server_rx_fps is not None
+                       and sent_fps > 1.0
+                       and self.server_rx_fps < sent_fps * 0.8)
+
+            hold = HOLD_INTERVALS
+            if send_ms > self.target_ms * 2:
+                # 한참 넘으면 두 단계씩 (느린 링크에서 빨리 빠져나오게)
+                changed = self._step_down()
+                changed = self._step_down() or changed
+            elif send_ms > self.target_ms * 1.2 or backlog:
+                changed = self._step_down()
+            elif send_ms < self.target_ms * FAST_UP_RATIO:
+                # 한참 여유 있으면 두 단계씩 - 두 번째는 방금 올린 fps 를 아직 못 봤으니 해상도/품질만
+                changed = self._step_up(fps_ok=sent_fps >= self.fps * 0.8, q_step=10)
+                changed = self._step_up(fps_ok=False, q_step=10) or changed
+                hold = 0   # 올려도 목표의 절반 안쪽 → 효과 기다리지 않고 다음 주기에 또 봄
+            elif send_ms < self.target_ms * 0.5:
+                changed = self._step_up(fps_ok=sent_fps >= self.fps * 0.8)
+            else:
+                changed = False
+
+            if changed:
+                self.hold = hold
+                self.changes += 1
+            return changed
+
+    def _step_down(self):
+        if self.quality > self.qmin:
+            self.quality = max(self.qmin, self.quality - 10)
+        elif self.scale_idx < len(self.scales) - 1:
+            self.scale_idx += 1
+        elif self.fps > self.fmin:
+            self.fps = max(self.fmin, self.fps - 2)
+        else:
+            return False
+        return True
+
+    def _step_up(self, fps_ok=True, q_step=5):
+        if self.fps < self.fmax and fps_ok:
+            self.fps = min(self.fmax, self.fps + 1)
+        elif self.scale_idx > 0:
+            self.scale_idx -= 1
+        elif self.quality < self.qmax:
+            self.quality = min(self.qmax, self.quality + q_step)
+        else:
+            return False
+        return True
+
+    def state(self):
+        with self.lock:
+            return {
+                "quality": self.quality,
+                "scale": self.scale,
+                "fps": self.fps,
+                "send_ms": None if self.send_ms is None else round(self.send_ms, 1),
+                "kbps": None if self.throughput is None else round(self.throughput * 8 / 1000),
+                "server_rx_fps": self.server_rx_fps,
+                "udp_loss": self.udp_loss,
+                "changes": self.changes,
+            }
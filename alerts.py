@@ -0,0 +1,196 @@
+import json, shutil, subprocess, threading, time
+
+# =========================
+# Pi 로컬 알림 엔진
+#   센서 샘플마다 규칙을 돌려서 서버 왕복 없이 바로 부저/TTS 를 울린다.
+#   울린 알림은 서버로 보고(ALERT_EVENT)하고, 서버가 나중에 같은 ALERT 를
+#   보내오면 DEDUPE_SEC 안에서는 다시 울리지 않는다.
+# =========================
+PROXIMITY_CM = 50.0          # 이보다 가까우면 경고
+PROXIMITY_CLEAR_CM = 70.0    # 이보다 멀어져야 해제 (경계에서 깜빡이지 않게)
+PROXIMITY_CONFIRM = 2        # 연속 몇 샘플 가까워야 울릴지 (튀는 값 무시)
+REPEAT_SEC = 5.0             # 계속 가까이 있으면 이 간격으로 다시 울림
+DEDUPE_SEC = 3.0             # 같은 type 알림은 이 시간 안에 한 번만 울림 (로컬/서버 합쳐서)
+
+# =========================
+# 액추에이터: fire(alert) 는 센서 스레드에서 불리므로 바로 리턴해야 함
+#   alert = {"type", "message", "level", "source", "ts", ...}
+# =========================
+class LogActuator:
+    def fire(self, alert):
+        print(f"[PI][ALERT] ({alert['source']}) {alert['message']}")
+
+class BuzzerActuator:
+    """GPIO 부저 (active buzzer 기준). 울리는 시간은 타이머로 끄므로 막히지 않음"""
+
+    def __init__(self, pin, beep_sec=0.3):
+        import RPi.GPIO as GPIO
+        self.GPIO = GPIO
+        self.pin = pin
+        self.beep_sec = beep_sec
+        self.timer = None
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setup(pin, GPIO.OUT, initial=False)
+
+    def fire(self, alert):
+        sec = self.beep_sec * (2 if alert.get("level") == "danger" else 1)
+        self.GPIO.output(self.pin, True)
+        if self.timer:
+            self.timer.cancel()
+        self.timer = threading.Timer(sec, self.GPIO.output, (self.pin, False))
+        self.timer.daemon = True
+        self.timer.start()
+
+class TtsActuator:
+    """espeak-ng / espeak 로 읽어줌. 이전 문장이 아직 나오는 중이면 끊고 새 문장"""
+
+    def __init__(self, voice="ko", command=None):
+        self.command = command or shutil.which("espeak-ng") or shutil.which("espeak")
+        self.voice = voice
+        self.proc = None
+        if self.command is None:
+            print("[PI][ALERT] espeak not found, TTS off")
+
+    def fire(self, alert):
+        if self.command is None:
+            return
+        if self.proc is not None and self.proc.poll() is None:
+            self.proc.terminate()
+        self.proc = subprocess.Popen([self.command, "-v", self.voice, alert["message"]],
+                                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+# =========================
+# 규칙
+# =========================
+class ProximityRule:
+    """초음파 거리 임계값 + 히스테리시스. check(reading) → alert dict 또는 None"""
+
+    def __init__(self, near_cm=PROXIMITY_CM, clear_cm=PROXIMITY_CLEAR_CM,
+                 confirm=PROXIMITY_CONFIRM, repeat_sec=REPEAT_SEC):
+        self.near_cm = near_cm
+        self.clear_cm = clear_cm
+        self.confirm = confirm
+        self.repeat_sec = repeat_sec
+        self.hits = 0
+        self.active = False
+        self.last_fire = 0.0
+
+    def check(self, reading):
+        cm = reading.get("cm")
+        if cm is None:
+            return None
+        if cm >= self.clear_cm:
+            self.hits = 0
+            self.active = False
+            return None
+        if cm >= self.near_cm:
+            self.hits = 0
+            return None
+
+        self.hits += 1
+        now = time.monotonic()
+        if self.hits < self.confirm:
+            return None
+        if self.active and now - self.last_fire < self.repeat_sec:
+            return None
+        self.active = True
+        self.last_fire = now
+        return {
+            "type": "proximity",
+            "message": f"앞에 장애물이 있습니다 ({cm:.0f}cm)",
+            "level": "danger" if cm < self.near_cm / 2 else "warning",
+            "cm": cm,
+        }
+
+class AlertEngine:
+    """
+    on_sample(reading) 를 UltrasonicSensor(on_sample=...) 에 연결하면 샘플마다 규칙 평가.
+    on_detection() 은 Pi 에서 로컬 인식기를 돌릴 때 결과를 넣는 곳 (labels 에 있는 것만 알림).
+    on_server_alert() 는 cmd_recv_loop 의 ALERT 를 넘기는 곳 (로컬에서 방금 울렸으면 무시).
+    report(event) 를 주면 울린 알림을 별도 스레드에서 서버로 보고 (센서 스레드 안 막음).
+    """
+
+    def __init__(self, actuators=None, rules=None, report=None, labels=None, dedupe_sec=DEDUPE_SEC):
+        self.actuators = actuators if actuators is not None else [LogActuator()]
+        self.rules = rules if rules is not None else [ProximityRule()]
+        self.report = report
+        self.labels = labels or {}     # 로컬 인식 라벨 -> 메시지
+        self.dedupe_sec = dedupe_sec
+
+        self.lock = threading.Lock()
+        self.last_fired = {}           # type -> monotonic
+        self.fired = 0
+        self.deduped = 0
+        self.lat_n = 0
+        self.lat_sum = 0.0
+        self.lat_max = 0.0
+
+    def on_sample(self, reading):
+        for rule in self.rules:
+            alert = rule.check(reading)
+            if alert is not None:
+                self._fire(dict(alert, source="pi"), reading["ts"])
+
+    def on_detection(self, label, confidence, ts=None):
+        message = self.labels.get(label)
+        if message:
+            self._fire({"type": label, "message": message, "level": "warning",
+                        "confidence": round(confidence, 2), "source": "pi"},
+                       ts or time.time())
+
+    def on_server_alert(self, payload):
+        """서버 ALERT payload. 실제로 울렸으면 True"""
+        alert = {
+            "type": str(payload.get("type") or "server"),
+            "message": payload.get("message") or "경고",
+            "level": payload.get("level") or "warning",
+            "source": payload.get("source") or "server",
+        }
+        return self._fire(alert, None)
+
+    def _fire(self, alert, sample_ts):
+        now = time.monotonic()
+        with self.lock:
+            last = self.last_fired.get(alert["type"])
+            if last is not None and now - last < self.dedupe_sec:
+                self.deduped += 1
+                return False
+            self.last_fired[alert["type"]] = now
+
+        for act in self.actuators:
+            try:
+                act.fire(alert)
+            except Exception as e:
+                print("[PI][ALERT] actuator error:", type(act).__name__, e)
+
+        fired_ts = time.time()
+        with self.lock:
+            self.fired += 1
+            if sample_ts is not None:
+                # 센서 측정 시각 → 액추에이터 호출 끝난 시각
+                latency = fired_ts - sample_ts
+                self.lat_n += 1
+                self.lat_sum += latency
+                self.lat_max = max(self.lat_max, latency)
+
+        if self.report is not None and alert["source"] == "pi":
+            event = dict(alert, cmd="ALERT_EVENT", ts=fired_ts)
+            if sample_ts is not None:
+                event["latency_ms"] = round((fired_ts - sample_ts) * 1000, 1)
+            threading.Thread(target=self._report, args=(event,), daemon=True).start()
+        return True
+
+    def _report(self, event):
+        try:
+            self.report(json.dumps(event, ensure_ascii=False).encode("utf-8"))
+        except Exception as e:
+            print("[PI][ALERT] report failed:", e)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "fired": self.fired,
+                "deduped": self.deduped,
+                "latency_ms_avg": round(self.lat_sum / self.lat_n * 1000, 1) if self.lat_n else None,
+                "latency_ms_max": round(self.lat_max * 1000, 1) if self.lat_n else None,
+            }
@@ -0,0 +1,247 @@
+"""
+품질 자동 조절 시뮬레이션 (카메라/Pi 없이 로컬에서 실행)
+
+  python bench_adaptive.py --phases 2000,400,3000 --phase-sec 10
+
+가짜 서버가 대역폭을 제한하며(kbps 단계별로 바뀜) 받고,
+1초마다 FEEDBACK 을 돌려보낸다. CameraPipeline + AdaptiveController 가
+품질/해상도/FPS 를 어떻게 바꾸는지 1초 단위로 출력한다.
+
+단계마다 후반부(안정된 구간)를 검사하고 하나라도 실패하면 exit 1:
+  send_ms  전송 시간 EWMA 중앙값 <= 목표 x SEND_MS_SLACK
+  fps      서버가 받은 fps 중앙값 >= --min-fps
+  quality  링크가 느려진 단계는 (해상도, 품질) 이 내려가고, 빨라진 단계는 안 내려감
+  recover  빨라진 단계에서 send_ms 가 목표 x FAST_UP_RATIO 보다 짧으면
+           (해상도, 품질) 이 느려지기 전 단계 수준까지 그 단계 안에 돌아옴
+  + 전 구간: send_ms 가 목표를 넘는 동안 fps 를 올리면 실패
+"""
+import argparse, json, socket, statistics, sys, threading, time
+import cv2
+import numpy as np
+
+import pi_pipeline
+from adaptive import FAST_UP_RATIO, AdaptiveController
+from protocol import TYPE_CMD, TYPE_IMAGE, MsgReader, Sender, send_msg
+
+SEND_MS_SLACK = 1.5     # 안정 구간 send_ms 허용치 (목표 대비)
+
+def tcp_pair(bufsize):
+    srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    srv.bind(("127.0.0.1", 0))
+    srv.listen(1)
+    pi = socket.create_connection(srv.getsockname())
+    server, _ = srv.accept()
+    srv.close()
+    # 소켓 버퍼를 작게 → 링크가 느리면 sendall 이 실제로 막힌다 (Wi-Fi 처럼)
+    pi.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, bufsize)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, bufsize)
+    return pi, server
+
+class FakeCamera:
+    """움직이는 사각형 + 노이즈 (JPEG 크기가 품질/해상도에 따라 실제로 변하도록)"""
+
+    def __init__(self, w=640, h=480):
+        self.w, self.h = w, h
+        self.i = 0
+        yy, xx = np.mgrid[0:h, 0:w]
+        self.bg = np.dstack([(xx * 255 // w), (yy * 255 // h), ((xx + yy) * 127 // (w + h))]).astype(np.uint8)
+        self.rng = np.random.default_rng(0)
+
+    def read(self):
+        self.i += 1
+        frame = self.bg.copy()
+        x = (self.i * 7) % (self.w - 100)
+        cv2.rectangle(frame, (x, 180), (x + 100, 300), (255, 255, 255), -1)
+        noise = self.rng.integers(0, 24, frame.shape, dtype=np.uint8)
+        frame = cv2.add(frame, noise)
+        time.sleep(0.02)   # 카메라 캡처 시간 흉내
+        return frame
+
+class ThrottledServer:
+    """토큰 버킷으로 수신 속도를 제한하고 1초마다 FEEDBACK 을 보낸다"""
+
+    def __init__(self, conn, phases_kbps, phase_sec):
+        self.conn = conn
+        self.phases = phases_kbps
+        self.phase_sec = phase_sec
+        self.t0 = time.monotonic()
+        self.frames = 0
+        self.bytes = 0
+        self.stop = threading.Event()
+
+    def rate_kbps(self):
+        idx = int((time.monotonic() - self.t0) // self.phase_sec)
+        return self.phases[min(idx, len(self.phases) - 1)]
+
+    def recv_loop(self):
+        buf = bytearray(16 * 1024)
+        view = memoryview(buf)
+        tokens = 0.0
+        last = time.monotonic()
+        # MsgReader 에 '느린 소켓'을 끼워 넣기
+        outer = self
+
+        class Slow:
+            def recv_into(self, b):
+                nonlocal tokens, last
+                while True:
+                    now = time.monotonic()
+                    tokens = min(tokens + (now - last) * outer.rate_kbps() * 1000 / 8, 16 * 1024)
+                    last = now
+                    if tokens >= 1024:
+                        break
+                    time.sleep(0.002)
+                n = outer.conn.recv_into(b[:int(min(len(b), tokens))])
+                tokens -= n
+                return n
+
+        reader = MsgReader(Slow())
+        try:
+            while not self.stop.is_set():
+                mtype, payload = reader.recv_msg()
+                if mtype is None:
+                    break
+                if mtype == TYPE_IMAGE:
+                    self.frames += 1
+                    self.bytes += len(payload)
+        except OSError:
+            pass
+
+    def feedback_loop(self):
+        prev = (time.monotonic(), 0, 0)
+        while not self.stop.wait(1.0):
+            now = time.monotonic()
+            dt = now - prev[0]
+            fb = {
+                "cmd": "FEEDBACK",
+                "rx_fps": round((self.frames - prev[1]) / dt, 2),
+                "rx_kbps": round((self.bytes - prev[2]) * 8 / 1000 / dt),
+                "viewer_drop_ratio": 0.0,
+            }
+            prev = (now, self.frames, self.bytes)
+            try:
+                send_msg(self.conn, TYPE_CMD, json.dumps(fb).encode("utf-8"))
+            except OSError:
+                break
+
+def pi_cmd_loop(conn, controller):
+    """Pi 쪽 cmd_recv_loop 의 FEEDBACK 처리 부분만"""
+    reader = MsgReader(conn, 64 * 1024)
+    while True:
+        try:
+            mtype, payload = reader.recv_msg()
+        except OSError:
+            return
+        if mtype is None:
+            return
+        obj = json.loads(bytes(payload))
+        if obj.get("cmd") == "FEEDBACK":
+            controller.on_feedback(obj)
+
+def check_phases(samples, phases, phase_sec, target_ms, min_fps):
+    """samples: 1초마다 (t, rx_fps, state). 실패 메시지 목록"""
+    failures = []
+    prev_level = None
+    levels = []   # 단계별 마지막 (scale, quality)
+    for idx, kbps in enumerate(phases):
+        # 단계 후반부만 (조절이 끝난 뒤)
+        settled = [(fps, st) for t, fps, st in samples
+                   if idx * phase_sec + phase_sec / 2 <= t < (idx + 1) * phase_sec]
+        if not settled:
+            failures.append(f"phase {idx + 1} ({kbps}kbps): no samples")
+            levels.append(None)
+            continue
+        send_ms = statistics.median(st["send_ms"] or 0.0 for _, st in settled)
+        rx_fps = statistics.median(fps for fps, _ in settled)
+        level = (settled[-1][1]["scale"], settled[-1][1]["quality"])
+        checks = [("send_ms", send_ms <= target_ms * SEND_MS_SLACK, f"{send_ms:.1f}ms"),
+                  ("fps", rx_fps >= min_fps, f"{rx_fps:.1f}fps")]
+        if prev_level is not None and kbps != phases[idx - 1]:
+            ok = level < prev_level if kbps < phases[idx - 1] else level >= prev_level
+            checks.append(("quality", ok, f"scale,q {prev_level} -> {level}"))
+        if idx >= 2 and kbps > phases[idx - 1] and send_ms < target_ms * FAST_UP_RATIO:
+            # 링크가 한참 남으면 느려지기 전 (직전 단계보다 빨랐던 마지막 단계) 수준까지 회복해야 함
+            before = next((levels[i] for i in range(idx - 2, -1, -1)
+                           if phases[i] > phases[idx - 1] and levels[i] is not None), None)
+            if before is not None:
+                checks.append(("recover", level >= before, f"scale,q {level} vs {before}"))
+        prev_level = level
+        levels.append(level)
+        for name, ok, value in checks:
+            print(f"  phase {idx + 1} {kbps:>5}kbps  {name:<8} {value:<28} {'PASS' if ok else 'FAIL'}")
+            if not ok:
+                failures.append(f"phase {idx + 1} ({kbps}kbps) {name}: {value}")
+
+    for (_, _, a), (t, _, b) in zip(samples, samples[1:]):
+        if b["fps"] > a["fps"] and (a["send_ms"] or 0.0) > target_ms:
+            failures.append(f"t={t:.0f}s fps raised {a['fps']} -> {b['fps']} with send_ms {a['send_ms']}ms")
+    return failures
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--phases", default="2000,400,3000", help="단계별 링크 속도 kbps")
+    ap.add_argument("--phase-sec", type=float, default=10.0)
+    ap.add_argument("--target-ms", type=float, default=80.0, help="프레임 전송 목표 시간")
+    ap.add_argument("--min-fps", type=float, default=2.0, help="단계마다 서버가 받아야 하는 최소 fps")
+    ap.add_argument("--sockbuf", type=int, default=32 * 1024)
+    args = ap.parse_args()
+
+    phases = [int(x) for x in args.phases.split(",")]
+    pi, server_conn = tcp_pair(args.sockbuf)
+
+    server = ThrottledServer(server_conn, phases, args.phase_sec)
+    controller = AdaptiveController(quality=70, fps=10, target_send_ms=args.target_ms)
+    cam = FakeCamera()
+
+    pi_pipeline.STATS_INTERVAL = 1e9   # 파이프라인 자체 로그는 끔
+    tx = Sender(pi)
+    pipe = pi_pipeline.CameraPipeline(tx, cam.read, fps=10, quality=70, controller=controller)
+
+    threads = [threading.Thread(target=target, daemon=True)
+               for target in (server.recv_loop, server.feedback_loop, pipe.run)]
+    threads.append(threading.Thread(target=pi_cmd_loop, args=(pi, controller), daemon=True))
+    for t in threads:
+        t.start()
+
+    print(f"{'t':>4}{'link':>8}{'rx_fps':>8}{'rx_kbps':>9}{'q':>5}{'scale':>7}{'fps':>5}{'send_ms':>9}")
+    duration = args.phase_sec * len(phases)
+    samples = []
+    prev_frames, prev_bytes = 0, 0
+    t0 = time.monotonic()
+    next_ts = t0
+    while next_ts - t0 < duration:
+        next_ts += 1.0
+        time.sleep(max(0.0, next_ts - time.monotonic()))
+        st = controller.state()
+        frames, nbytes = server.frames, server.bytes
+        t = time.monotonic() - t0
+        samples.append((t - 0.5, frames - prev_frames, st))   # 지난 1초의 가운데
+        print(f"{t:>4.0f}{server.rate_kbps():>8}{frames - prev_frames:>8}"
+              f"{(nbytes - prev_bytes) * 8 // 1000:>9}{st['quality']:>5}{st['scale']:>7}"
+              f"{st['fps']:>5}{st['send_ms']!s:>9}")
+        prev_frames, prev_bytes = frames, nbytes
+
+    # 캡처/인코더 스레드를 먼저 멈추고 끝냄 (cv2 가 돌던 중에 인터프리터가 내려가면 abort)
+    server.stop.set()
+    pipe.stop.set()
+    tx.close()
+    for sock in (pi, server_conn):
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        sock.close()
+    for t in threads:
+        t.join(timeout=5.0)
+
+    print()
+    failures = check_phases(samples, phases, args.phase_sec, args.target_ms, args.min_fps)
+    if failures:
+        print("FAIL")
+        for f in failures:
+            print("  " + f)
+        sys.exit(1)
+    print("PASS")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+카메라 백엔드 / 인코딩 경로 벤치마크 (카메라 없이, FileReplayBackend 로)
+
+  python bench_camera.py --sec 5
+  python bench_camera.py --path sample.mp4 --fps 30 --quality 70
+
+같은 프레임을 형식별로 CameraSource → CameraPipeline(전송은 버림) 에 흘려서
+capture → JPEG 시간, 인코딩 시간, 처리 FPS, JPEG 크기를 비교한다.
+  bgr          : BGR 그대로 cv2.imencode
+  i420         : YUV420 평면 그대로 simplejpeg (없으면 BGR 변환 후 imencode 로 떨어짐)
+  rgb+cvtColor : 예전 camera_send.py 경로 (프레임마다 cvtColor 후 imencode)
+"""
+import argparse, threading, time
+import cv2
+
+import pi_pipeline
+from camera import FMT_BGR, FMT_I420, FileReplayBackend, encode_bgr
+from pi_pipeline import CameraPipeline, CameraSource
+
+class NullTx:
+    def __init__(self):
+        self.frames = 0
+        self.bytes = 0
+
+    def send(self, mtype, payload, seq=None, ts=None):
+        if mtype == pi_pipeline.TYPE_IMAGE:
+            self.frames += 1
+            self.bytes += len(memoryview(payload).cast("B"))
+
+def encode_rgb_convert(frame, quality):
+    return encode_bgr(cv2.cvtColor(frame, cv2.COLOR_RGB2BGR), quality)
+
+def run(name, fmt, encode, args):
+    source = CameraSource(lambda: FileReplayBackend(args.path, args.fps, fmt), name).start()
+    tx = NullTx()
+    pipe = CameraPipeline(tx, source.reader(), encode, fps=args.fps, quality=args.quality,
+                          encoders=args.encoders, fmt=fmt)
+    t = threading.Thread(target=pipe.run, daemon=True)
+    t.start()
+    time.sleep(args.warmup)
+    pipe.enc_stats.take()
+    pipe.cap_to_jpeg.take()
+    frames0, bytes0 = tx.frames, tx.bytes
+
+    time.sleep(args.sec)
+    n_enc, t_enc, _ = pipe.enc_stats.take()
+    n_c2j, t_c2j, max_c2j = pipe.cap_to_jpeg.take()
+    frames, nbytes = tx.frames - frames0, tx.bytes - bytes0
+    pipe.stop.set()
+    t.join(timeout=3)
+    source.close()
+
+    print(f"{name:<14}{frames / args.sec:>8.1f}{t_enc / max(n_enc, 1) * 1000:>10.2f}"
+          f"{t_c2j / max(n_c2j, 1) * 1000:>12.2f}{max_c2j * 1000:>10.1f}{nbytes // max(frames, 1):>10}")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--path", help="동영상 파일 또는 이미지 폴더 (없으면 합성 640x480)")
+    ap.add_argument("--fps", type=float, default=30)
+    ap.add_argument("--quality", type=int, default=70)
+    ap.add_argument("--encoders", type=int, default=pi_pipeline.ENCODER_THREADS)
+    ap.add_argument("--warmup", type=float, default=1.0)
+    ap.add_argument("--sec", type=float, default=5.0)
+    args = ap.parse_args()
+
+    pi_pipeline.STATS_INTERVAL = 1e9   # 파이프라인 자체 로그는 끔
+    print(f"{'path':<14}{'fps':>8}{'enc_ms':>10}{'cap->jpeg':>12}{'max_ms':>10}{'bytes':>10}")
+    run("bgr", FMT_BGR, None, args)
+    run("i420", FMT_I420, None, args)
+    run("rgb+cvtColor", FMT_BGR, encode_rgb_convert, args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""
+브리지 end-to-end 벤치마크 (Linux 한 대, 하드웨어 없이)
+
+  python bench_e2e.py --devices 4 --viewers 2 --fps 15 --duration 20
+
+  1) Server_bridge.py 를 하위 프로세스로 띄우고 (--no-server 면 이미 떠 있는 것 사용)
+  2) pi_sim.SimDevice 로 가짜 Pi N 대 접속
+  3) 장치마다 헤드리스 Socket.IO 뷰어 M 개 접속 (프레임마다 ack)
+  4) 측정 구간 동안 frames/sec, end-to-end 지연 p50/p90/p99, drop 비율,
+     서버 CPU/메모리(/proc) 출력
+
+지연 = 가짜 Pi 송신 시각(JPEG COM 태그) ~ 뷰어 수신 시각 (같은 머신이라 시계 공유)
+(--rendition thumb/low 는 서버가 다시 인코딩해서 태그가 없음 → 지연 대신 서버 /metrics 참고)
+
+손실 링크에서 TCP / UDP 영상 비교 (lossy_link relay 를 Pi 와 브리지 사이에 끼움)
+  python bench_e2e.py --loss 2 --delay 10
+  python bench_e2e.py --loss 2 --delay 10 --udp
+
+수신을 워커 프로세스로 나눴을 때 (web_cpu_pct = 웹 프로세스만, server_cpu_pct = 워커 포함)
+  python bench_e2e.py --devices 8 --viewers 1 --ingest-workers 2
+"""
+import argparse, json, os, subprocess, sys, threading, time, urllib.request
+
+import socketio
+
+import pi_sim
+from lossy_link import TcpImpairedRelay, UdpImpairedRelay
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# =========================
+# 헤드리스 뷰어
+# =========================
+class Viewer:
+    def __init__(self, url, device_id, rendition="full"):
+        self.device_id = device_id
+        self.lock = threading.Lock()
+        self.received = 0
+        self.latencies = []
+        self.recording = False
+        self.sio = socketio.Client(reconnection=False)
+        self.sio.on("frame", self._on_frame)
+        self.sio.connect(f"{url}?device={device_id}&rendition={rendition}", transports=["websocket"])
+
+    def _on_frame(self, data):
+        now = time.time()
+        if isinstance(data, (bytes, bytearray)):
+            tag = pi_sim.parse_tag(data)
+        else:
+            tag = None   # base64 모드는 지연 측정 안 함
+        with self.lock:
+            if self.recording:
+                self.received += 1
+                if tag is not None:
+                    self.latencies.append(now - tag[0])
+        return True   # ack → 서버가 다음 프레임 보냄
+
+    def reset(self, recording):
+        with self.lock:
+            self.received = 0
+            self.latencies = []
+            self.recording = recording
+
+    def close(self):
+        try:
+            self.sio.disconnect()
+        except Exception:
+            pass
+
+# =========================
+# 서버 프로세스 자원 (/proc)
+# =========================
+class ProcSampler:
+    def __init__(self, pid):
+        self.pid = pid
+        self.ticks = os.sysconf("SC_CLK_TCK")
+        self.rss_max = 0
+        self.rss_samples = []
+        self.stop = threading.Event()
+
+    def cpu_sec(self, pid=None):
+        with open(f"/proc/{pid or self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        # utime, stime (14, 15번째 필드; ")" 뒤에서 12, 13번째)
+        return (int(fields[11]) + int(fields[12])) / self.ticks
+
+    def children(self):
+        """브리지가 띄운 하위 프로세스 (ingest / 인식 워커)"""
+        pids = []
+        for task in os.listdir(f"/proc/{self.pid}/task"):
+            try:
+                with open(f"/proc/{self.pid}/task/{task}/children") as f:
+                    pids += [int(x) for x in f.read().split()]
+            except OSError:
+                pass
+        return pids
+
+    def cpu_sec_all(self):
+        """{pid: cpu 초} 브리지 + 하위 프로세스"""
+        out = {}
+        for pid in [self.pid] + self.children():
+            try:
+                out[pid] = self.cpu_sec(pid)
+            except OSError:
+                pass
+        return out
+
+    def rss_mb(self):
+        with open(f"/proc/{self.pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+        return 0.0
+
+    def loop(self):
+        while not self.stop.wait(0.5):
+            rss = self.rss_mb()
+            self.rss_samples.append(rss)
+            self.rss_max = max(self.rss_max, rss)
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    k = min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))
+    return values[k]
+
+def wait_http(url, timeout=15.0):
+    t0 = time.time()
+    while time.time() - t0 < timeout:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as r:
+                return json.loads(r.read())
+        except Exception:
+            time.sleep(0.2)
+    raise SystemExit(f"server not reachable: {url}")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--tcp-port", type=int, default=6000)
+    ap.add_argument("--web-port", type=int, default=8000)
+    ap.add_argument("--devices", type=int, default=2)
+    ap.add_argument("--viewers", type=int, default=2, help="장치당 뷰어 수")
+    ap.add_argument("--fps", type=float, default=15)
+    ap.add_argument("--size", default="640x480")
+    ap.add_argument("--quality", type=int, default=70)
+    ap.add_argument("--jpeg-dir")
+    ap.add_argument("--rendition", default="full", help="뷰어가 받을 버전 (full / thumb / low)")
+    ap.add_argument("--udp", action="store_true", help="가짜 Pi 가 영상을 UDP 로 보냄")
+    ap.add_argument("--udp-port", type=int, default=6001)
+    ap.add_argument("--loss", type=float, default=0.0, help="Pi→브리지 패킷 손실 %% (TCP 세그먼트 / UDP 데이터그램)")
+    ap.add_argument("--delay", type=float, default=0.0, help="편도 지연 ms")
+    ap.add_argument("--ingest-workers", type=int, default=0, help="브리지 INGEST_WORKERS (0 = 한 프로세스)")
+    ap.add_argument("--warmup", type=float, default=3.0)
+    ap.add_argument("--duration", type=float, default=15.0)
+    ap.add_argument("--no-server", action="store_true", help="이미 떠 있는 브리지 사용 (CPU/메모리 측정 안 함)")
+    ap.add_argument("--json", action="store_true", help="결과를 JSON 한 줄로")
+    args = ap.parse_args()
+
+    web = f"http://{args.host}:{args.web_port}"
+    server = None
+    devs, viewers = [], []
+    if not args.no_server:
+        # 브리지 로그는 측정과 무관하므로 버림 (단계별 지연은 /metrics 로 확인)
+        env = dict(os.environ, BRIDGE_INGEST_WORKERS=str(args.ingest_workers),
+                   BRIDGE_TCP_PORT=str(args.tcp_port), BRIDGE_UDP_PORT=str(args.udp_port),
+                   BRIDGE_WEB_PORT=str(args.web_port))
+        server = subprocess.Popen([sys.executable, "Server_bridge.py"], cwd=HERE, env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_http(web + "/health")
+
+        if args.jpeg_dir:
+            frames = pi_sim.load_frames(args.jpeg_dir)
+        else:
+            frames = pi_sim.make_frames(*pi_sim.parse_size(args.size), quality=args.quality)
+
+        tcp_port, udp_port = args.tcp_port, None
+        if args.loss or args.delay:
+            loss, delay = args.loss / 100.0, args.delay / 1000.0
+            tcp_relay = TcpImpairedRelay((args.host, args.tcp_port), loss, delay, seed=1)
+            udp_relay = UdpImpairedRelay((args.host, args.udp_port), loss, delay, seed=1)
+            tcp_port, udp_port = tcp_relay.port, udp_relay.port
+
+        devs += [pi_sim.SimDevice(f"bench-{i}", args.host, tcp_port, frames, args.fps,
+                                  udp=args.udp, udp_port=udp_port)
+                 for i in range(args.devices)]
+        for d in devs:
+            d.start()
+        time.sleep(0.5)
+
+        for d in devs:
+            for _ in range(args.viewers):
+                viewers.append(Viewer(web, d.device_id, args.rendition))   # 중간에 실패해도 finally 가 끊음
+
+        sampler = ProcSampler(server.pid) if server else None
+        time.sleep(args.warmup)
+
+        # ---- 측정 구간 ----
+        for v in viewers:
+            v.reset(True)
+        sent0 = {d.device_id: d.sent for d in devs}
+        if sampler:
+            cpu0 = sampler.cpu_sec_all()
+            threading.Thread(target=sampler.loop, daemon=True).start()
+        t0 = time.time()
+        time.sleep(args.duration)
+        elapsed = time.time() - t0
+        for v in viewers:
+            v.recording = False
+        sent = {d.device_id: d.sent - sent0[d.device_id] for d in devs}
+
+        result = {
+            "devices": args.devices,
+            "viewers_per_device": args.viewers,
+            "target_fps": args.fps,
+            "transport": "udp" if args.udp else "tcp",
+            "loss_pct": args.loss,
+            "delay_ms": args.delay,
+            "frame_bytes_avg": sum(map(len, frames)) // len(frames),
+            "sent_fps": round(sum(sent.values()) / elapsed, 1),
+            "delivered_fps": round(sum(v.received for v in viewers) / elapsed, 1),
+            "per_viewer_fps": round(sum(v.received for v in viewers) / elapsed / max(len(viewers), 1), 1),
+        }
+        expected = sum(sent[v.device_id] for v in viewers)
+        result["drop_rate"] = round(1.0 - sum(v.received for v in viewers) / expected, 3) if expected else None
+
+        lat = [x * 1000.0 for v in viewers for x in v.latencies]
+        for p in (50, 90, 99):
+            val = percentile(lat, p)
+            result[f"latency_p{p}_ms"] = None if val is None else round(val, 1)
+
+        if sampler:
+            sampler.stop.set()
+            cpu1 = sampler.cpu_sec_all()
+            # web = Socket.IO / fan-out 프로세스만, total = ingest 워커 포함
+            result["ingest_workers"] = args.ingest_workers
+            result["server_cpu_pct"] = round(sum(cpu1[p] - cpu0.get(p, 0.0) for p in cpu1) / elapsed * 100.0, 1)
+            result["web_cpu_pct"] = round((cpu1.get(server.pid, 0.0) - cpu0.get(server.pid, 0.0)) / elapsed * 100.0, 1)
+            result["server_rss_mb_max"] = round(sampler.rss_max, 1)
+
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print("[BENCH] end-to-end")
+            for k, val in result.items():
+                print(f"  {k:<20} {val}")
+    finally:
+        # Pi 를 먼저 멈추고 보내던 프레임이 다 도착한 뒤에 뷰어를 끊음
+        #   (바이너리 첨부를 받는 도중에 끊기면 socketio 클라이언트가 ValueError 를 찍음), 서버는 맨 마지막
+        for d in devs:
+            d.stop.set()
+        if viewers:
+            time.sleep(0.5)
+        for v in viewers:
+            v.close()
+        if server:
+            server.terminate()
+            try:
+                server.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                server.kill()
+
+if __name__ == "__main__":
+    main()
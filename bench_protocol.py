@@ -0,0 +1,159 @@
+"""
+프로토콜 마이크로 벤치마크 (하드웨어 없이 로컬에서 실행)
+
+  python bench_protocol.py --frames 2000 --size 50000
+
+로컬 TCP 연결(127.0.0.1) 위에서 기존 recvall/recv_msg/send_msg 와
+protocol.py 의 MsgReader/send_msg 를 비교한다.
+  - frames/sec, MB/s
+  - 프레임당 recv 호출 수
+  - 프레임당 임시 할당 바이트 (tracemalloc peak)
+"""
+import argparse, os, socket, struct, threading, time, tracemalloc
+
+import protocol
+
+# =========================
+# 기존 구현 (비교용 그대로 복사)
+# =========================
+def legacy_recvall(conn, n):
+    data = b""
+    while len(data) < n:
+        chunk = conn.recv(n - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+def legacy_recv_msg(conn):
+    header = legacy_recvall(conn, 5)
+    if header is None:
+        return None, None
+    mtype, length = struct.unpack("!BI", header)
+    payload = legacy_recvall(conn, length)
+    if payload is None:
+        return None, None
+    return mtype, payload
+
+def legacy_send_msg(conn, mtype, payload: bytes):
+    conn.sendall(struct.pack("!BI", mtype, len(payload)) + payload)
+
+# =========================
+# 보조
+# =========================
+def tcp_pair(rcvbuf=None):
+    srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    srv.bind(("127.0.0.1", 0))
+    srv.listen(1)
+    a = socket.create_connection(srv.getsockname())
+    b, _ = srv.accept()
+    srv.close()
+    for s in (a, b):
+        s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    if rcvbuf:
+        # 작은 수신 버퍼 → Wi-Fi 처럼 여러 조각으로 나뉘어 도착
+        b.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+    return a, b
+
+def sender(conn, send_fn, payload, frames):
+    try:
+        for _ in range(frames):
+            send_fn(conn, protocol.TYPE_IMAGE, payload)
+    finally:
+        conn.shutdown(socket.SHUT_WR)
+
+class CountingSocket:
+    """recv / recv_into 호출 횟수를 세는 얇은 래퍼"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.calls = 0
+
+    def recv(self, n):
+        self.calls += 1
+        return self.conn.recv(n)
+
+    def recv_into(self, buf):
+        self.calls += 1
+        return self.conn.recv_into(buf)
+
+def run(make_recv, send_fn, frames, size, rcvbuf):
+    payload = os.urandom(size)
+    a, b = tcp_pair(rcvbuf)
+    recv = make_recv(b)
+    t = threading.Thread(target=sender, args=(a, send_fn, payload, frames), daemon=True)
+
+    t0 = time.perf_counter()
+    t.start()
+    got = 0
+    nbytes = 0
+    while True:
+        mtype, data = recv()
+        if mtype is None:
+            break
+        got += 1
+        nbytes += len(data)
+    dt = time.perf_counter() - t0
+
+    t.join()
+    a.close()
+    b.close()
+    return got / dt, nbytes / dt / 1e6
+
+def measure_allocs(make_recv, send_fn, frames, size, rcvbuf):
+    """
+    프레임 하나 받는 동안의 tracemalloc peak (= 임시 할당 바이트)와
+    recv 호출 수를 잰다. 기존 recvall 은 recv 한 번마다
+    chunk + (data += chunk) 로 bytes 두 개를 새로 만든다.
+    """
+    payload = os.urandom(size)
+    a, b = tcp_pair(rcvbuf)
+    counting = CountingSocket(b)
+    recv = make_recv(counting)
+    t = threading.Thread(target=sender, args=(a, send_fn, payload, frames), daemon=True)
+
+    t.start()
+    tracemalloc.start()
+    got = 0
+    peak_total = 0
+    while True:
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        mtype, data = recv()
+        _, peak = tracemalloc.get_traced_memory()
+        if mtype is None:
+            break
+        got += 1
+        peak_total += peak - base
+        del data
+    tracemalloc.stop()
+
+    t.join()
+    a.close()
+    b.close()
+    got = max(got, 1)
+    return counting.calls / got, peak_total / got
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--frames", type=int, default=2000)
+    ap.add_argument("--size", type=int, default=50_000, help="프레임 크기(bytes), JPEG 30~60KB")
+    ap.add_argument("--rcvbuf", type=int, default=16 * 1024, help="수신 SO_RCVBUF (0=기본값)")
+    ap.add_argument("--alloc-frames", type=int, default=200, help="할당 측정용 프레임 수")
+    args = ap.parse_args()
+
+    cases = [
+        ("legacy recv_msg", legacy_send_msg, lambda c: (lambda: legacy_recv_msg(c))),
+        ("protocol.recv_msg", protocol.send_msg, lambda c: (lambda: protocol.recv_msg(c))),
+        ("protocol.MsgReader", protocol.send_msg, lambda c: protocol.MsgReader(c).recv_msg),
+    ]
+
+    print(f"[BENCH] frames={args.frames} size={args.size} rcvbuf={args.rcvbuf or 'default'}")
+    print(f"{'case':<22}{'fps':>10}{'MB/s':>10}{'recv/frame':>12}{'KB alloc/frame':>17}")
+    for name, send_fn, make_recv in cases:
+        fps, mbps = run(make_recv, send_fn, args.frames, args.size, args.rcvbuf)
+        calls, alloc = measure_allocs(make_recv, send_fn, args.alloc_frames, args.size, args.rcvbuf)
+        print(f"{name:<22}{fps:>10.0f}{mbps:>10.1f}{calls:>12.1f}{alloc / 1024:>17.1f}")
+
+if __name__ == "__main__":
+    main()
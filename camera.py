@@ -0,0 +1,341 @@
+import glob, os, time
+import cv2
+import numpy as np
+
+try:
+    import simplejpeg     # picamera2 가 의존하므로 Pi OS 에는 보통 있음 (libjpeg-turbo, YUV 평면 바로 인코딩)
+except ImportError:
+    simplejpeg = None
+
+# =========================
+# 카메라 백엔드
+#   전부 cv2.VideoCapture 모양: isOpened(), read() -> (ok, frame), release()
+#   → pi_pipeline.CameraSource(lambda: XxxBackend(...)) 에 그대로 넣음
+#   fmt 는 인코더가 바로 받는 형식으로 협상 (중간 색변환/복사 없음)
+#     "BGR"  : (h, w, 3)     cv2.imencode 그대로
+#     "I420" : (h*3/2, w)    Y/U/V 평면 그대로 JPEG 인코딩 (simplejpeg), 움직임 감지는 Y 평면만
+#              JPEG(JFIF) 은 full range(0~255) YCbCr 이므로 카메라에도 sYCC 로 요청해야 색이 맞음
+#
+#   full_size 를 주면 (서버 ROI 요청용) 센서에서 그 해상도로 받고 read() 는 size 로 줄인 프레임.
+#   want_full 이 켜져 있는 동안만 원본을 self.full 에 남김 (ROI 없을 땐 큰 버퍼를 안 들고 있음)
+# =========================
+FMT_BGR = "BGR"
+FMT_I420 = "I420"
+
+CAPTURE_SIZE = (640, 480)
+CAPTURE_FPS = 15
+
+class _FullRes:
+    """full_size 백엔드 공통: read() 결과를 size 로 줄이고 원본은 필요할 때만 self.full"""
+
+    def _init_full(self, size, full_size):
+        self.size = size
+        self.full_size = full_size
+        self.full = None
+        self.want_full = False
+
+    def _split(self, ok, frame):
+        if not ok or frame is None or self.full_size is None:
+            return ok, frame
+        self.full = frame if self.want_full else None
+        return ok, resize_to(frame, self.size, self.fmt)
+
+class Picamera2Backend(_FullRes):
+    """
+    Picamera2 "RGB888" 은 메모리상 B,G,R 순서 → OpenCV BGR 그대로 (cvtColor 필요 없음)
+    "YUV420" 은 ISP 가 만든 I420 평면 그대로 (RGB 변환 자체를 안 함, 크기도 절반)
+    full_size 면 main = full_size, lores = size 두 스트림 (축소는 ISP 가 해서 CPU 비용 없음).
+    lores 는 YUV420 만 되므로 이때 fmt 는 I420 고정
+    """
+
+    def __init__(self, size=CAPTURE_SIZE, fps=CAPTURE_FPS, fmt=FMT_I420, full_size=None):
+        from picamera2 import Picamera2
+        from libcamera import ColorSpace
+
+        self._init_full(size, full_size)
+        self.fmt = FMT_I420 if full_size else fmt
+        self.picam2 = Picamera2()
+        main = {"size": full_size or size, "format": "YUV420" if self.fmt == FMT_I420 else "RGB888"}
+        config = self.picam2.create_video_configuration(
+            main=main,
+            lores={"size": size, "format": "YUV420"} if full_size else None,
+            controls={"FrameRate": fps},
+            colour_space=ColorSpace.Sycc(),    # 영상 기본값(Rec709 limited range) 대신 JPEG 와 같은 full range
+        )
+        self.picam2.configure(config)
+        self.picam2.start()
+
+    def isOpened(self):
+        return True
+
+    def read(self):
+        if self.full_size is None:
+            return True, self.picam2.capture_array("main")
+        # 같은 요청(같은 순간)의 두 스트림. 큰 main 은 ROI 가 있을 때만 꺼냄
+        request = self.picam2.capture_request()
+        try:
+            self.full = request.make_array("main") if self.want_full else None
+            return True, request.make_array("lores")
+        finally:
+            request.release()
+
+    def release(self):
+        self.picam2.stop()
+        self.picam2.close()
+
+class GStreamerBackend(_FullRes):
+    """
+    libcamerasrc 에서 appsink 가 받는 형식(BGR / I420)을 caps 로 바로 요청 → videoconvert 없음.
+    appsink 는 최신 1장만 (drop=true max-buffers=1) - 밀린 프레임은 CameraSource 가 어차피 버림
+    full_size 면 그 크기로 받고 size 로 줄이는 건 read 에서 (appsink 하나라 스트림을 둘로 못 나눔)
+    """
+
+    def __init__(self, size=CAPTURE_SIZE, fps=CAPTURE_FPS, fmt=FMT_BGR, source="libcamerasrc", full_size=None):
+        self._init_full(size, full_size)
+        self.fmt = fmt
+        w, h = full_size or size
+        # I420 은 colorimetry 1:4:7:1 = sYCC (full range, BT.601) → JPEG 평면으로 바로 씀
+        caps = "I420, colorimetry=1:4:7:1" if fmt == FMT_I420 else "BGR"
+        self.pipeline = (
+            f"{source} ! "
+            f"video/x-raw, format={caps}, width={w}, height={h}, framerate={fps}/1 ! "
+            "appsink drop=true max-buffers=1 sync=false"
+        )
+        self.cap = cv2.VideoCapture(self.pipeline, cv2.CAP_GSTREAMER)
+        if fmt == FMT_I420:
+            # OpenCV 가 BGR 로 바꾸지 않고 I420 버퍼 그대로 돌려주게
+            self.cap.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def read(self):
+        return self._split(*self.cap.read())
+
+    def release(self):
+        self.cap.release()
+
+class V4L2Backend(_FullRes):
+    """
+    USB 웹캠 등. 드라이버가 주는 YUYV/MJPEG → BGR 은 OpenCV 가 read 안에서 한 번에 처리
+    (그 뒤로는 변환 없이 바로 인코딩). BUFFERSIZE=1 로 드라이버 큐에 옛 프레임이 안 쌓이게
+    full_size 는 size 와 가로세로 비율이 같은 모드로 (웹캠마다 지원 해상도가 다름)
+    """
+
+    def __init__(self, device=0, size=CAPTURE_SIZE, fps=CAPTURE_FPS, fourcc="MJPG", full_size=None):
+        self._init_full(size, full_size)
+        self.fmt = FMT_BGR
+        w, h = full_size or size
+        self.cap = cv2.VideoCapture(device, cv2.CAP_V4L2)
+        if fourcc:
+            self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fourcc))
+        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, w)
+        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, h)
+        self.cap.set(cv2.CAP_PROP_FPS, fps)
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def read(self):
+        return self._split(*self.cap.read())
+
+    def release(self):
+        self.cap.release()
+
+class FileReplayBackend(_FullRes):
+    """
+    카메라 없이 인코딩 경로 벤치마크용. path 가 폴더면 이미지들, 파일이면 동영상, None 이면 합성 프레임.
+    처음에 전부 디코딩(+ fmt 변환)해서 메모리에 들고 있으므로 read 에는 디코딩 비용이 없다.
+    fps=0 이면 속도 제한 없이 바로바로 돌려줌.
+    full_size 면 원본/축소 두 벌을 미리 만들어 둠 (ROI 테스트용, read 에 축소 비용 없음)
+    """
+
+    def __init__(self, path=None, fps=CAPTURE_FPS, fmt=FMT_BGR, size=None, loop=True, full_size=None):
+        self._init_full(size, full_size)
+        self.fmt = fmt
+        self.fps = fps
+        self.loop = loop
+        frames = self._load(path, full_size)
+        fulls = None
+        if full_size:
+            fulls = [cv2.resize(f, full_size, interpolation=cv2.INTER_AREA) for f in frames]
+            frames = fulls
+        if size:
+            frames = [cv2.resize(f, size, interpolation=cv2.INTER_AREA) for f in frames]
+        if fmt == FMT_I420:
+            frames = [bgr_to_i420(f) for f in frames]
+            fulls = fulls and [bgr_to_i420(f) for f in fulls]
+        self.frames = frames
+        self.fulls = fulls
+        self.i = 0
+        self.next_ts = time.monotonic()
+
+    @staticmethod
+    def _load(path, full_size=None):
+        if path is None:
+            return synthetic_frames(*(full_size or CAPTURE_SIZE))
+        if os.path.isdir(path):
+            files = sorted(f for ext in ("*.jpg", "*.jpeg", "*.png") for f in glob.glob(os.path.join(path, ext)))
+            return [f for f in map(cv2.imread, files) if f is not None]
+        cap = cv2.VideoCapture(path)
+        frames = []
+        while True:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            frames.append(frame)
+        cap.release()
+        return frames
+
+    def isOpened(self):
+        return bool(self.frames)
+
+    def read(self):
+        if self.i >= len(self.frames) and not self.loop:
+            return False, None
+        if self.fps:
+            self.next_ts += 1.0 / self.fps
+            delay = self.next_ts - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                self.next_ts = time.monotonic()
+        i = self.i % len(self.frames)
+        self.i += 1
+        if self.fulls:
+            self.full = self.fulls[i] if self.want_full else None
+        return True, self.frames[i]
+
+    def release(self):
+        pass
+
+def synthetic_frames(width, height, count=30):
+    """움직이는 사각형 + 노이즈 (JPEG 크기가 실제 영상과 비슷하게)"""
+    rng = np.random.default_rng(0)
+    yy, xx = np.mgrid[0:height, 0:width]
+    bg = np.dstack([xx * 255 // width, yy * 255 // height, (xx + yy) * 127 // (width + height)]).astype(np.uint8)
+    frames = []
+    for i in range(count):
+        frame = bg.copy()
+        x = int((width - width // 6) * i / count)
+        cv2.rectangle(frame, (x, height // 3), (x + width // 6, height * 2 // 3), (255, 255, 255), -1)
+        frames.append(cv2.add(frame, rng.integers(0, 16, frame.shape, dtype=np.uint8)))
+    return frames
+
+# =========================
+# 형식별 인코딩 / 축소 / 밝기 (전부 평면 view 로, 변환 없이)
+# =========================
+def i420_planes(frame):
+    """(h*3/2, w) I420 버퍼 → Y (h, w), U, V (h/2, w/2) view (복사 없음)"""
+    h = frame.shape[0] * 2 // 3
+    w = frame.shape[1]
+    q = h // 4
+    y = frame[:h]
+    u = frame[h:h + q].reshape(h // 2, w // 2)
+    v = frame[h + q:h + 2 * q].reshape(h // 2, w // 2)
+    return y, u, v
+
+def bgr_to_i420(frame):
+    """
+    full range (JFIF) I420. cv2 의 COLOR_BGR2YUV_I420 은 limited range 라
+    그대로 JPEG 평면으로 쓰면 색이 바램 → YCrCb(full range) 에서 평면을 직접 만든다
+    """
+    h, w = frame.shape[:2]
+    ycc = cv2.cvtColor(frame, cv2.COLOR_BGR2YCrCb)
+    out = np.empty((h * 3 // 2, w), np.uint8)
+    y, u, v = i420_planes(out)
+    y[:] = ycc[..., 0]
+    cv2.resize(ycc[..., 2], (w // 2, h // 2), dst=u, interpolation=cv2.INTER_AREA)
+    cv2.resize(ycc[..., 1], (w // 2, h // 2), dst=v, interpolation=cv2.INTER_AREA)
+    return out
+
+def luma(frame, fmt=FMT_BGR):
+    """움직임 감지용 흑백. I420 은 Y 평면 view 그대로"""
+    if fmt == FMT_I420:
+        return frame[:frame.shape[0] * 2 // 3]
+    return frame
+
+def resize_frame(frame, scale, fmt=FMT_BGR):
+    if fmt != FMT_I420:
+        return cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    y, u, v = i420_planes(frame)
+    # I420 은 가로/세로가 짝수여야 하고 U/V 는 정확히 절반
+    w = max(2, int(y.shape[1] * scale) // 4 * 4)
+    h = max(2, int(y.shape[0] * scale) // 4 * 4)
+    out = np.empty((h * 3 // 2, w), np.uint8)
+    oy, ou, ov = i420_planes(out)
+    cv2.resize(y, (w, h), dst=oy, interpolation=cv2.INTER_AREA)
+    cv2.resize(u, (w // 2, h // 2), dst=ou, interpolation=cv2.INTER_AREA)
+    cv2.resize(v, (w // 2, h // 2), dst=ov, interpolation=cv2.INTER_AREA)
+    return out
+
+def resize_to(frame, size, fmt=FMT_BGR):
+    """(w, h) 로 축소 (full_size → 전송 해상도). 이미 그 크기면 그대로"""
+    w, h = size
+    if fmt != FMT_I420:
+        if frame.shape[1] == w and frame.shape[0] == h:
+            return frame
+        return cv2.resize(frame, (w, h), interpolation=cv2.INTER_AREA)
+    y, u, v = i420_planes(frame)
+    if y.shape[1] == w and y.shape[0] == h:
+        return frame
+    out = np.empty((h * 3 // 2, w), np.uint8)
+    oy, ou, ov = i420_planes(out)
+    cv2.resize(y, (w, h), dst=oy, interpolation=cv2.INTER_AREA)
+    cv2.resize(u, (w // 2, h // 2), dst=ou, interpolation=cv2.INTER_AREA)
+    cv2.resize(v, (w // 2, h // 2), dst=ov, interpolation=cv2.INTER_AREA)
+    return out
+
+def crop_frame(frame, rect, fmt=FMT_BGR, max_side=None):
+    """
+    rect = [x, y, w, h] (0~1 비율) 영역만. max_side 보다 크면 긴 변을 거기 맞춰 줄임
+    (넓은 ROI 가 전체 프레임보다 무거워지지 않게). 너무 작으면 None
+    BGR 은 잘라낸 view 를 그대로 (인코더가 stride 를 앎), I420 은 짝수 좌표로 평면마다 잘라 새 버퍼
+    """
+    if fmt == FMT_I420:
+        y, u, v = i420_planes(frame)
+        fh, fw = y.shape
+    else:
+        fh, fw = frame.shape[:2]
+    x0 = int(max(0.0, min(1.0, rect[0])) * fw) // 4 * 4
+    y0 = int(max(0.0, min(1.0, rect[1])) * fh) // 4 * 4
+    x1 = min(fw, int((rect[0] + rect[2]) * fw)) // 4 * 4
+    y1 = min(fh, int((rect[1] + rect[3]) * fh)) // 4 * 4
+    if x1 - x0 < 16 or y1 - y0 < 16:
+        return None
+    if fmt != FMT_I420:
+        crop = frame[y0:y1, x0:x1]
+    else:
+        crop = np.empty(((y1 - y0) * 3 // 2, x1 - x0), np.uint8)
+        cy, cu, cv = i420_planes(crop)
+        cy[:] = y[y0:y1, x0:x1]
+        cu[:] = u[y0 // 2:y1 // 2, x0 // 2:x1 // 2]
+        cv[:] = v[y0 // 2:y1 // 2, x0 // 2:x1 // 2]
+    if max_side and max(x1 - x0, y1 - y0) > max_side:
+        scale = max_side / float(max(x1 - x0, y1 - y0))
+        crop = resize_to(crop, (int((x1 - x0) * scale) // 4 * 4, int((y1 - y0) * scale) // 4 * 4), fmt)
+    return crop
+
+def make_encoder(fmt=FMT_BGR):
+    """CameraPipeline(encode=...) 용 encode(frame, quality) -> JPEG 버퍼 또는 None"""
+    if fmt == FMT_I420:
+        if simplejpeg is not None:
+            def encode_i420(frame, quality):
+                y, u, v = i420_planes(frame)
+                return simplejpeg.encode_jpeg_yuv_planes(y, u, v, quality=int(quality), fastdct=True)
+            return encode_i420
+
+        print("[PI][CAM] simplejpeg not found, I420 frames are converted to BGR before encoding")
+
+        def encode_i420_fallback(frame, quality):
+            y, u, v = i420_planes(frame)
+            h, w = y.shape
+            ycc = cv2.merge([y, cv2.resize(v, (w, h)), cv2.resize(u, (w, h))])
+            return encode_bgr(cv2.cvtColor(ycc, cv2.COLOR_YCrCb2BGR), quality)
+        return encode_i420_fallback
+    return encode_bgr
+
+def encode_bgr(frame, quality):
+    ok, jpg = cv2.imencode(".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)])
+    return jpg if ok else None
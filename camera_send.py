@@ -1,60 +1,21 @@
-def camera_send_loop(conn):
+from pi_pipeline import CameraPipeline, CameraSource, MotionGate
+from camera import Picamera2Backend, FMT_I420
+
+# Picamera2 는 YUV420 그대로 받아서 평면째 JPEG 인코딩 (RGB 변환/cvtColor 없음)
+# 시작할 때 한 번: camera.start() → 재접속해도 Picamera2 를 다시 켜지 않음
+camera = CameraSource(lambda: Picamera2Backend((640, 480), SEND_FPS, fmt=FMT_I420), "Picamera2")
+
+def camera_send_loop(tx):
     """
     Picamera2 기반 카메라 프레임을 JPEG으로 인코딩하여
-    TCP로 서버에 지속 전송
+    TCP로 서버에 지속 전송 (capture / encode / send 단계 분리)
+    캡처는 camera 가 연결과 상관없이 계속 돌리고, 여기선 최신 프레임에 붙기만 함
     """
-    from picamera2 import Picamera2
-    import cv2
-    import time
-
-    print("[PI] starting Picamera2...")
-
-    picam2 = Picamera2()
-    config = picam2.create_video_configuration(
-        main={
-            "size": (640, 480),
-            "format": "RGB888"
-        }
-    )
-    picam2.configure(config)
-    picam2.start()
-
-    print("[PI] Picamera2 started")
-
-    frame_interval = 1.0 / float(SEND_FPS)
-    last_time = time.time()
-
-    encode_param = [
-        int(cv2.IMWRITE_JPEG_QUALITY),
-        int(JPEG_QUALITY)
-    ]
-
     try:
-        while True:
-            # 1️⃣ 프레임 캡처 (RGB)
-            frame = picam2.capture_array()
-
-            # 2️⃣ OpenCV용 BGR 변환
-            frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-
-            # 3️⃣ JPEG 인코딩
-            ok, jpg = cv2.imencode(".jpg", frame, encode_param)
-            if not ok:
-                continue
-
-            # 4️⃣ 서버로 전송
-            send_msg(conn, TYPE_IMAGE, jpg.tobytes())
-
-            # 5️⃣ FPS 제어
-            now = time.time()
-            dt = now - last_time
-            if dt < frame_interval:
-                time.sleep(frame_interval - dt)
-            last_time = time.time()
+        # 인코딩(I420 평면 그대로) / 전송 / FPS 제어는 파이프라인이 담당
+        CameraPipeline(tx, camera.reader(), fps=SEND_FPS, quality=JPEG_QUALITY, fmt=FMT_I420,
+                       controller=adaptive if ADAPTIVE else None,
+                       motion=MotionGate() if MOTION_GATE else None).run()
 
     except Exception as e:
         print("[PI] camera_send_loop error:", e)
-
-    finally:
-        picam2.stop()
-        print("[PI] Picamera2 stopped")
@@ -0,0 +1,138 @@
+import multiprocessing, threading, time
+from concurrent.futures import ProcessPoolExecutor
+
+# =========================
+# 서버측 객체 인식 (OpenCV DNN, 프로세스 풀)
+#   브라우저마다 ml5 돌리던 걸 서버에서 한 번만
+# =========================
+# 워커 프로세스 안에서만 쓰는 전역 (프로세스마다 모델 1개)
+_model = None
+_labels = []
+
+def _init_worker(model_path, config_path, labels_path, input_size):
+    global _model, _labels
+    import cv2
+    cv2.setNumThreads(1)  # 병렬은 프로세스 수로 (워커끼리 코어 뺏기 방지)
+
+    _model = cv2.dnn_DetectionModel(model_path, config_path)
+    _model.setInputSize(input_size, input_size)
+    _model.setInputScale(1.0 / 127.5)
+    _model.setInputMean((127.5, 127.5, 127.5))
+    _model.setInputSwapRB(True)
+
+    if labels_path:
+        with open(labels_path, encoding="utf-8") as f:
+            _labels = [line.strip() for line in f]
+
+def _detect_jpeg(jpeg, conf_min):
+    """워커 프로세스에서 실행: JPEG -> [{label, confidence, box}], 추론 ms, [w, h]"""
+    import cv2
+    import numpy as np
+
+    t0 = time.perf_counter()
+    frame = cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR)
+    if frame is None:
+        return [], 0.0, None
+
+    class_ids, confs, boxes = _model.detect(frame, confThreshold=conf_min)
+    results = []
+    for cid, conf, box in zip(np.array(class_ids).flatten(), np.array(confs).flatten(), boxes):
+        cid = int(cid)
+        # COCO SSD 라벨 파일은 보통 0번이 background → 모델 id 그대로 index
+        label = _labels[cid] if 0 <= cid < len(_labels) else str(cid)
+        x, y, w, h = (int(v) for v in box)
+        results.append({"label": label, "confidence": round(float(conf), 3), "box": [x, y, w, h]})
+    return results, (time.perf_counter() - t0) * 1000.0, [frame.shape[1], frame.shape[0]]
+
+class DetectorPool:
+    """
+    프로세스 풀에 프레임을 넘기고 결과는 on_result(key, results, info) 로 돌려준다.
+      - key(장치)마다 동시에 1장만 처리, 풀 전체는 workers 장까지
+        (channel 이 다르면 같은 장치라도 따로 1장 - 예: ROI 크롭이 본 영상 인식을 막지 않게)
+      - 바쁘면 새 프레임은 그냥 건너뜀 (큐에 안 쌓음 → 지연 안 늘어남)
+    info = {infer_ms, latency_ms, ts, size([w, h] 인식한 이미지 크기)} + submit 때 준 extra
+    """
+
+    def __init__(self, model_path, config_path, labels_path, on_result,
+                 workers=2, input_size=300, conf_min=0.5):
+        self.on_result = on_result
+        self.workers = workers
+        self.conf_min = conf_min
+
+        # spawn: eventlet 패치된 서버 프로세스를 fork 하지 않도록
+        #   (워커는 Server_bridge 를 __mp_main__ 으로 다시 import 하지만 그 import 는 패치 / 객체 생성 없음)
+        self.pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(model_path, config_path, labels_path, input_size),
+        )
+
+        self.lock = threading.Lock()
+        self.busy = set()            # 처리 중인 (key, channel)
+        self.submitted = 0
+        self.skipped = 0
+        self.completed = 0
+        self.errors = 0
+        self.infer_ms_total = 0.0
+        self.latency_ms_total = 0.0  # 제출 ~ 결과 (큐 대기 + IPC 포함)
+        self.started_ts = time.time()
+
+    def submit(self, key, jpeg, channel=None, extra=None):
+        """프레임 제출. 바빠서 건너뛰면 False"""
+        slot = (key, channel)
+        with self.lock:
+            if slot in self.busy or len(self.busy) >= self.workers:
+                self.skipped += 1
+                return False
+            self.busy.add(slot)
+            self.submitted += 1
+
+        t0 = time.time()
+        fut = self.pool.submit(_detect_jpeg, jpeg, self.conf_min)
+        fut.add_done_callback(lambda f: self._done(key, slot, t0, extra, f))
+        return True
+
+    def _done(self, key, slot, t0, extra, fut):
+        with self.lock:
+            self.busy.discard(slot)
+        try:
+            results, infer_ms, size = fut.result()
+        except Exception as e:
+            with self.lock:
+                self.errors += 1
+            print("[DETECT] worker error:", e)
+            return
+
+        latency_ms = (time.time() - t0) * 1000.0
+        with self.lock:
+            self.completed += 1
+            self.infer_ms_total += infer_ms
+            self.latency_ms_total += latency_ms
+
+        self.on_result(key, results, {
+            "infer_ms": round(infer_ms, 1),
+            "latency_ms": round(latency_ms, 1),
+            "ts": t0,
+            "size": size,
+            **(extra or {}),
+        })
+
+    def stats(self):
+        with self.lock:
+            n = max(self.completed, 1)
+            elapsed = max(time.time() - self.started_ts, 1e-6)
+            return {
+                "workers": self.workers,
+                "submitted": self.submitted,
+                "skipped": self.skipped,
+                "completed": self.completed,
+                "errors": self.errors,
+                "in_flight": len(self.busy),
+                "avg_infer_ms": round(self.infer_ms_total / n, 1),
+                "avg_latency_ms": round(self.latency_ms_total / n, 1),
+                "throughput_fps": round(self.completed / elapsed, 2),
+            }
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,294 @@
+import base64, itertools, multiprocessing, os, socket, struct, threading, time
+from multiprocessing import shared_memory
+
+from protocol import TYPE_IMAGE, MsgReader, set_keepalive
+
+# =========================
+# 멀티 프로세스 수신 (Server_bridge INGEST_WORKERS > 0 일 때)
+#   워커 프로세스들이 같은 TCP 포트를 SO_REUSEPORT 로 나눠 받고 (커널이 연결을 분배),
+#   IMAGE 는 공유 메모리 링에 써서 웹 프로세스에 (lane, slot, gen) 만 알려준다.
+#   SENSOR / CMD 같은 작은 메시지와 Pi 로 보낼 바이트만 파이프로 오간다.
+#
+#   링 = lane(연결 하나) x slot, slot = [8B gen][4B length][JPEG ...]
+#     lane 은 워커마다 lanes 개씩 나눠 가짐 → lane 하나에 쓰는 건 그 연결 스레드뿐
+#     gen 은 쓰는 중 홀수 / 다 쓰면 짝수. 웹 프로세스는 읽기 전후 gen 이 알림과 같을 때만 사용
+#     (느린 쪽이 slot 한 바퀴 뒤처져서 덮어쓰인 프레임은 버림)
+# =========================
+SLOT_HEADER = struct.Struct("QI")     # 같은 머신이라 native
+LANES_PER_WORKER = 16
+SLOTS_PER_LANE = 4
+SLOT_SIZE = 512 * 1024                # 이보다 큰 프레임은 파이프로 (드묾)
+
+class FrameRing:
+    def __init__(self, lanes, slots=SLOTS_PER_LANE, slot_size=SLOT_SIZE, name=None):
+        self.lanes = lanes
+        self.slots = slots
+        self.slot_size = slot_size
+        self.stride = SLOT_HEADER.size + slot_size
+        size = lanes * slots * self.stride
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self.shm.buf[:size] = bytes(size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+        self.buf = self.shm.buf
+        self.next_slot = [0] * lanes   # 쓰는 쪽(워커)만 사용
+
+    def _offset(self, lane, slot):
+        return (lane * self.slots + slot) * self.stride
+
+    def write(self, lane, payload):
+        """워커: lane 의 다음 slot 에 쓰고 (slot, gen). 너무 크면 None"""
+        n = len(payload)
+        if n > self.slot_size:
+            return None
+        slot = self.next_slot[lane]
+        self.next_slot[lane] = (slot + 1) % self.slots
+        off = self._offset(lane, slot)
+        gen, _ = SLOT_HEADER.unpack_from(self.buf, off)
+        SLOT_HEADER.pack_into(self.buf, off, gen + 1, n)          # 홀수 = 쓰는 중
+        start = off + SLOT_HEADER.size
+        self.buf[start:start + n] = payload
+        SLOT_HEADER.pack_into(self.buf, off, gen + 2, n)
+        return slot, gen + 2
+
+    def read(self, lane, slot, gen):
+        """
+        웹 프로세스: slot 을 bytes 로 (공유 메모리에서 바로, 파이프/pickle 거치지 않음)
+        알림 뒤 워커가 한 바퀴 돌아 덮어썼으면 (복사 전이든 도중이든) None
+        """
+        off = self._offset(lane, slot)
+        cur, n = SLOT_HEADER.unpack_from(self.buf, off)
+        if cur != gen:
+            return None
+        start = off + SLOT_HEADER.size
+        data = bytes(self.buf[start:start + n])
+        if SLOT_HEADER.unpack_from(self.buf, off)[0] != gen:
+            return None
+        return data
+
+    def close(self, unlink=False):
+        self.buf.release()
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+def normalize_image(payload):
+    """
+    워커에서 미리: JPEG bytes 면 그대로, base64 / dataURL 문자열이면 디코드한 JPEG (웹 프로세스 GIL 절약)
+    JPEG 가 아니면 None
+    """
+    if len(payload) >= 2 and payload[:2] == b"\xff\xd8":
+        return payload
+    try:
+        text = bytes(payload).decode("ascii", errors="ignore").strip()
+        if text.startswith("data:image"):
+            text = text[text.find(",") + 1:].strip()
+        raw = base64.b64decode(text, validate=True)
+    except Exception:
+        return None
+    return raw if raw[:2] == b"\xff\xd8" else None
+
+# =========================
+# 워커 프로세스
+# =========================
+class _PiConn:
+    def __init__(self, cid, sock, lane):
+        self.cid = cid
+        self.sock = sock
+        self.lane = lane
+        self.cond = threading.Condition()
+        self.out = []             # Pi 로 보낼 바이트 (웹 프로세스가 만든 메시지)
+        self.closed = False
+
+def _worker_main(index, host, port, ring_name, lanes, slots, slot_size, lane_base, pipe, timeout):
+    # 웹 프로세스(eventlet 패치)에서 만든 파이프는 non-blocking fd 로 넘어옴 → 패치 안 된 워커에선 blocking 으로
+    os.set_blocking(pipe.fileno(), True)
+    ring = FrameRing(lanes + lane_base, slots, slot_size, name=ring_name)
+    free_lanes = list(range(lane_base, lane_base + lanes))
+    conns = {}
+    lock = threading.Lock()               # conns / free_lanes / pipe 쓰기
+    ids = itertools.count(1)
+
+    def post(msg):
+        with lock:
+            pipe.send(msg)
+
+    def writer(pc):
+        """Pi 로 나가는 것 (웹 프로세스 CMD) - 느린 Pi 가 다른 연결을 막지 않게 연결마다"""
+        while True:
+            with pc.cond:
+                while not pc.out and not pc.closed:
+                    pc.cond.wait()
+                if pc.closed:
+                    return
+                data, pc.out = b"".join(pc.out), []
+            try:
+                pc.sock.sendall(data)
+            except OSError:
+                return
+
+    def serve(pc, addr):
+        reader = MsgReader(pc.sock)
+        reason = "closed"
+        try:
+            post(("open", pc.cid, addr))
+            while True:
+                mtype, payload = reader.recv_msg()
+                if mtype is None:
+                    break
+                if mtype == TYPE_IMAGE:
+                    jpeg = normalize_image(payload)
+                    if jpeg is None:
+                        post(("bad", pc.cid))
+                        continue
+                    written = None if pc.lane is None else ring.write(pc.lane, jpeg)
+                    if written is not None:
+                        post(("frame", pc.cid, pc.lane, written[0], written[1], reader.seq, reader.ts))
+                        continue
+                # 작은 메시지 (또는 링에 못 넣은 프레임) 는 파이프로
+                post(("msg", pc.cid, mtype, bytes(payload), reader.seq, reader.ts))
+        except socket.timeout:
+            reason = "timeout"
+        except Exception as e:
+            reason = f"error: {e}"
+        finally:
+            with pc.cond:
+                pc.closed = True
+                pc.cond.notify()
+            try:
+                pc.sock.close()
+            except OSError:
+                pass
+            with lock:
+                conns.pop(pc.cid, None)
+                if pc.lane is not None:
+                    free_lanes.append(pc.lane)
+            post(("closed", pc.cid, reason))
+
+    def accept_loop(listener):
+        while True:
+            try:
+                sock, addr = listener.accept()
+            except OSError as e:
+                print(f"[INGEST{index}] accept error:", e)
+                time.sleep(0.5)
+                continue
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            set_keepalive(sock)
+            sock.settimeout(timeout)
+            with lock:
+                lane = free_lanes.pop(0) if free_lanes else None   # 없으면 프레임도 파이프로
+                cid = (index << 32) | next(ids)
+                pc = conns[cid] = _PiConn(cid, sock, lane)
+            threading.Thread(target=writer, args=(pc,), daemon=True).start()
+            threading.Thread(target=serve, args=(pc, addr), daemon=True).start()
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)   # 워커들이 같은 포트를 나눠 받음
+    listener.bind((host, port))
+    listener.listen(64)
+    threading.Thread(target=accept_loop, args=(listener,), daemon=True).start()
+
+    # 웹 프로세스 → Pi: ("send", cid, bytes) / ("close", cid)
+    while True:
+        try:
+            msg = pipe.recv()
+        except (EOFError, OSError):
+            break            # 웹 프로세스 종료
+        with lock:
+            pc = conns.get(msg[1])
+        if pc is None:
+            continue
+        if msg[0] == "send":
+            with pc.cond:
+                pc.out.append(msg[2])
+                pc.cond.notify()
+        elif msg[0] == "close":
+            try:
+                pc.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+# =========================
+# 웹 프로세스 쪽
+# =========================
+class RemoteConn:
+    """
+    워커가 들고 있는 Pi 소켓 대리. protocol.send_msg(conn, ...) / close() 가 그대로 동작
+    (보낼 바이트를 파이프로 넘김 → 실제 sendall 은 워커의 연결별 writer 스레드)
+    """
+
+    def __init__(self, worker, cid, addr):
+        self.worker = worker
+        self.cid = cid
+        self.addr = addr
+
+    def sendmsg(self, buffers):
+        data = b"".join(bytes(b) for b in buffers)
+        self.worker.post(("send", self.cid, data))
+        return len(data)
+
+    def sendall(self, data):
+        self.worker.post(("send", self.cid, bytes(data)))
+
+    def close(self):
+        self.worker.post(("close", self.cid))
+
+class IngestWorker:
+    def __init__(self, index, process, pipe):
+        self.index = index
+        self.process = process
+        self.pipe = pipe
+        self.lock = threading.Lock()
+
+    def post(self, msg):
+        with self.lock:
+            try:
+                self.pipe.send(msg)
+            except (OSError, ValueError) as e:
+                print(f"[INGEST{self.index}] pipe send failed:", e)
+
+    def recv(self):
+        """워커 → 웹 이벤트 하나. 워커가 죽으면 None"""
+        try:
+            return self.pipe.recv()
+        except (EOFError, OSError):
+            return None
+
+class IngestPool:
+    """
+    워커 프로세스 workers 개 + 공유 링. 이벤트는 worker.recv() 로 받는다:
+      ("open", cid, addr)
+      ("msg", cid, mtype, payload, seq, ts)            SENSOR / CMD (+ 링에 못 넣은 IMAGE)
+      ("frame", cid, lane, slot, gen, seq, ts)         IMAGE → ring.read(lane, slot, gen)
+      ("bad", cid)                                     JPEG 도 base64 도 아닌 IMAGE
+      ("closed", cid, reason)
+    """
+
+    def __init__(self, host, port, workers, timeout, lanes=LANES_PER_WORKER,
+                 slots=SLOTS_PER_LANE, slot_size=SLOT_SIZE):
+        self.ring = FrameRing(workers * lanes, slots, slot_size)
+        self.overwritten = 0      # 읽기 전에 덮어쓰인 프레임 (웹 프로세스가 밀림)
+        ctx = multiprocessing.get_context("spawn")   # eventlet 패치된 서버 프로세스를 fork 하지 않도록
+        self.workers = []
+        for i in range(workers):
+            parent, child = ctx.Pipe()
+            p = ctx.Process(target=_worker_main, daemon=True, name=f"ingest-{i}",
+                            args=(i, host, port, self.ring.name, lanes, slots, slot_size,
+                                  i * lanes, child, timeout))
+            p.start()
+            child.close()
+            self.workers.append(IngestWorker(i, p, parent))
+
+    def stats(self):
+        return {"workers": len(self.workers),
+                "alive": sum(w.process.is_alive() for w in self.workers),
+                "overwritten": self.overwritten}
+
+    def shutdown(self):
+        for w in self.workers:
+            w.process.terminate()
+        self.ring.close(unlink=True)
@@ -0,0 +1,134 @@
+"""
+localhost 에서 Wi-Fi 손실 / 지연 흉내 (tc netem 없이, root 권한 없이)
+
+  TcpImpairedRelay : 받은 바이트를 1448B(MSS) 세그먼트로 보고, 세그먼트마다 loss 확률로 '잃어버림'
+                     → 재전송될 때까지(rto) 그 세그먼트와 뒤의 모든 바이트가 같이 멈춤 (head-of-line)
+  UdpImpairedRelay : 데이터그램마다 loss 확률로 버림, 나머지는 delay 뒤 전달
+
+bench_e2e.py --loss 2 --delay 20 [--udp] 에서 씀.
+"""
+import heapq, random, socket, threading, time
+
+MSS = 1448
+TCP_RTO = 0.2        # Linux TCP_RTO_MIN (빠른 재전송이 되는 경우는 이보다 짧음)
+
+class _Pacer:
+    """(release 시각, 데이터) 를 시각 순으로 내보내는 스레드 하나"""
+
+    def __init__(self, send):
+        self.send = send
+        self.cond = threading.Condition()
+        self.heap = []
+        self.n = 0
+        self.closed = False
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def put(self, release, data):
+        with self.cond:
+            self.n += 1
+            heapq.heappush(self.heap, (release, self.n, data))
+            self.cond.notify()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+
+    def _loop(self):
+        while True:
+            with self.cond:
+                while not self.closed and not self.heap:
+                    self.cond.wait()
+                if self.closed:
+                    return
+                release, _, data = self.heap[0]
+                delay = release - time.monotonic()
+                if delay > 0:
+                    self.cond.wait(delay)
+                    continue
+                heapq.heappop(self.heap)
+            try:
+                self.send(data)
+            except OSError:
+                return
+
+class TcpImpairedRelay:
+    def __init__(self, target, loss=0.0, delay=0.0, rto=TCP_RTO, seed=None):
+        self.target = target
+        self.loss = loss
+        self.delay = delay
+        self.rto = rto
+        self.rng = random.Random(seed)
+        self.stalls = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(16)
+        self.port = self.sock.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self.sock.accept()
+                server = socket.create_connection(self.target)
+            except OSError:
+                return
+            for s in (client, server):
+                s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self._pipe, args=(client, server), daemon=True).start()
+            threading.Thread(target=self._pipe, args=(server, client), daemon=True).start()
+
+    def _pipe(self, src, dst):
+        pacer = _Pacer(dst.sendall)
+        last = 0.0      # 순서 보장: 앞 세그먼트보다 먼저 나갈 수 없음
+        try:
+            while True:
+                data = src.recv(64 * 1024)
+                if not data:
+                    break
+                now = time.monotonic()
+                for i in range(0, len(data), MSS):
+                    release = now + self.delay
+                    if self.rng.random() < self.loss:
+                        release += self.rto + self.delay * 2   # 재전송: RTO + 왕복 한 번
+                        self.stalls += 1
+                    last = max(last, release)
+                    pacer.put(last, data[i:i + MSS])
+        except OSError:
+            pass
+        finally:
+            # 남은 것까지 다 보내고 닫히도록 조금 기다렸다 닫음
+            time.sleep(max(0.0, last - time.monotonic()) + 0.05)
+            pacer.close()
+            for s in (src, dst):
+                try:
+                    s.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+class UdpImpairedRelay:
+    def __init__(self, target, loss=0.0, delay=0.0, seed=None):
+        self.target = target
+        self.loss = loss
+        self.delay = delay
+        self.rng = random.Random(seed)
+        self.dropped = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.port = self.sock.getsockname()[1]
+        self.out = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.out.connect(target)
+        self.pacer = _Pacer(self.out.send)
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def _loop(self):
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except OSError:
+                return
+            if self.rng.random() < self.loss:
+                self.dropped += 1
+                continue
+            self.pacer.put(time.monotonic() + self.delay, data)
@@ -0,0 +1,79 @@
+import bisect, threading
+
+# =========================
+# Prometheus 텍스트 포맷 메트릭 (라이브러리 없이 /metrics 용)
+#   https://prometheus.io/docs/instrumenting/exposition_formats/
+# =========================
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)   # 초
+
+class Histogram:
+    """누적 버킷 히스토그램. observe() 는 핫패스에서 불리므로 bisect 한 번 + 덧셈뿐"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.counts = [0] * (len(self.buckets) + 1)   # 마지막 칸 = +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        """(누적 버킷 [(le, n)], sum, count)"""
+        with self.lock:
+            counts, total, n = list(self.counts), self.sum, self.count
+        out, acc = [], 0
+        for le, c in zip(self.buckets + (float("inf"),), counts):
+            acc += c
+            out.append((le, acc))
+        return out, total, n
+
+    def quantile(self, q):
+        """버킷 경계 기준 대략값 (로그용). 샘플 없으면 None"""
+        buckets, _, n = self.snapshot()
+        if n == 0:
+            return None
+        rank = q * n
+        for le, acc in buckets:
+            if acc >= rank:
+                return le
+        return None
+
+def _labels(labels):
+    if not labels:
+        return ""
+    parts = []
+    for k, v in labels.items():
+        v = str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{k}="{v}"')
+    return "{" + ",".join(parts) + "}"
+
+def _num(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
+
+def render(name, kind, help_text, samples):
+    """
+    metric 하나의 텍스트 블록
+      kind    : "counter" / "gauge" / "histogram"
+      samples : [(labels dict, 값 또는 Histogram)]
+    """
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        if kind == "histogram":
+            buckets, total, n = value.snapshot()
+            for le, acc in buckets:
+                lines.append(f"{name}_bucket{_labels(dict(labels, le=_num(le)))} {acc}")
+            lines.append(f"{name}_sum{_labels(labels)} {_num(total)}")
+            lines.append(f"{name}_count{_labels(labels)} {n}")
+        elif value is not None:
+            lines.append(f"{name}{_labels(labels)} {_num(value)}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,606 @@
+import json, threading, time
+import cv2
+
+from protocol import TYPE_IMAGE, TYPE_CMD, TYPE_ROI, Backoff, pack_roi
+from camera import FMT_BGR, crop_frame, luma, make_encoder, resize_frame
+
+# =========================
+# 카메라 파이프라인 (Pi)
+#   capture ──[최신 1장]──> encode x N ──[최신 1장]──> send
+#   각 단계 사이엔 "최신 것만" 슬롯 → 느린 단계가 앞 단계를 막지 않고, 밀린 프레임은 버림
+# =========================
+ENCODER_THREADS = 3          # Pi 4코어: capture/send 용 1개 남기고
+STATS_INTERVAL = 5.0         # 단계별 타이밍 출력 주기(초)
+
+# 움직임 감지 (변화 없는 프레임은 안 보냄)
+MOTION_SIZE = (80, 60)       # 비교용 축소 해상도
+MOTION_PIXEL_DIFF = 25       # 픽셀 밝기 차이가 이 이상이면 '변함'
+MOTION_MIN_AREA = 0.005      # 변한 픽셀 비율이 이 이상이면 전송
+KEYFRAME_INTERVAL = 5.0      # 변화 없어도 이 주기(초)마다 한 장은 보냄
+MOTION_PENDING_MAX = 8       # 통과했지만 전송 확인 전인 축소 프레임 (인코더/슬롯에 떠 있는 수보다 넉넉히)
+
+# 카메라 장치 (연결과 별개로 계속 돌림)
+CAMERA_FAIL_LIMIT = 10       # read 가 연속 이만큼 실패하면 장치를 닫고 다시 연다
+CAMERA_REOPEN_BASE = 0.5     # 다시 열기 대기: 0.5 → 1 → 2 ... 초
+CAMERA_REOPEN_MAX = 10.0
+
+# 서버가 요청한 고해상도 ROI (full_size 백엔드일 때만)
+ROI_MAX_ACTIVE = 4           # 동시에 유지하는 ROI 수 (넘으면 곧 만료될 것부터 버림)
+ROI_MAX_FPS = 5.0            # ROI 하나당 전송 상한 (서버가 더 달라고 해도)
+ROI_MAX_TTL = 30.0           # 한 번 요청으로 유지되는 최대 시간 (서버가 계속 연장해야 살아 있음)
+ROI_MAX_SIDE = 1024          # 크롭 긴 변 상한 (넓은 ROI 가 전체 프레임보다 무거워지지 않게)
+ROI_QUALITY = 85
+
+class LatestSlot:
+    """
+    크기 1짜리 큐. put 은 절대 안 막히고 이전 항목을 덮어쓴다(drop 카운트).
+    get 은 새 항목이 올 때까지 기다린다.
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.item = None
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, item):
+        with self.cond:
+            if self.item is not None:
+                self.dropped += 1
+            self.item = item
+            self.cond.notify()
+
+    def get(self, timeout=0.5):
+        """새 항목 반환. timeout 이나 close 면 None"""
+        with self.cond:
+            if self.item is None and not self.closed:
+                self.cond.wait(timeout)
+            item = self.item
+            self.item = None
+            return item
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+class CameraSource:
+    """
+    카메라를 서버 연결과 분리: 프로그램 시작 때 한 번 열어서 계속 캡처하고 최신 1장만 들고 있다.
+    재접속 때마다 VideoCapture / libcamerasrc / Picamera2 를 다시 여는(수 초) 대신
+    새 연결의 파이프라인이 reader() 로 붙기만 하면 첫 프레임이 바로 나간다.
+
+    open_camera() -> cv2.VideoCapture 처럼 read() -> (ok, frame), release() 가 있는 객체
+                     (isOpened() 가 있으면 열기 성공 여부로 씀)
+    read 가 CAMERA_FAIL_LIMIT 번 연속 실패하거나 예외가 나면 닫고 Backoff 로 다시 연다.
+    """
+
+    def __init__(self, open_camera, name="camera", fail_limit=CAMERA_FAIL_LIMIT,
+                 reopen_base=CAMERA_REOPEN_BASE, reopen_max=CAMERA_REOPEN_MAX):
+        self.open_camera = open_camera
+        self.name = name
+        self.fail_limit = fail_limit
+        self.backoff = Backoff(reopen_base, reopen_max)
+
+        self.cond = threading.Condition()
+        self.frame = None
+        self.full = None         # full_size 백엔드 + want_full 일 때 그 프레임의 원본 해상도
+        self.frame_ts = 0.0      # 그 프레임을 받은 시각 (monotonic)
+        self.seq = 0             # 새 프레임마다 +1 (reader 가 본 것과 비교)
+        self.want_full = False   # 파이프라인이 ROI 를 찍는 동안 True
+        self.stop = threading.Event()
+        self.opens = 0
+        self.read_failures = 0
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+        return self
+
+    def close(self):
+        self.stop.set()
+        with self.cond:
+            self.cond.notify_all()
+
+    def _open(self):
+        t0 = time.monotonic()
+        try:
+            cap = self.open_camera()
+        except Exception as e:
+            print(f"[PI][CAM] {self.name} open error:", e)
+            return None
+        if cap is None or (hasattr(cap, "isOpened") and not cap.isOpened()):
+            print(f"[PI][CAM] {self.name} open failed")
+            return None
+        self.opens += 1
+        print(f"[PI][CAM] {self.name} opened in {(time.monotonic() - t0) * 1000:.0f}ms"
+              + (f" (reopen #{self.opens - 1})" if self.opens > 1 else ""))
+        return cap
+
+    def _run(self):
+        while not self.stop.is_set():
+            cap = self._open()
+            if cap is None:
+                self.stop.wait(self.backoff.next())
+                continue
+
+            fails = 0
+            try:
+                while not self.stop.is_set():
+                    if hasattr(cap, "want_full"):
+                        cap.want_full = self.want_full
+                    try:
+                        ok, frame = cap.read()
+                    except Exception as e:
+                        print(f"[PI][CAM] {self.name} read error:", e)
+                        break
+                    if not ok or frame is None:
+                        fails += 1
+                        self.read_failures += 1
+                        if fails >= self.fail_limit:
+                            print(f"[PI][CAM] {self.name} {fails} reads failed, reopening")
+                            break
+                        time.sleep(0.01)   # 바로 실패를 돌려주는 드라이버에서 CPU 안 태우게
+                        continue
+                    fails = 0
+                    self.backoff.reset()
+                    with self.cond:
+                        self.frame = frame
+                        self.full = getattr(cap, "full", None)
+                        self.frame_ts = time.monotonic()
+                        self.seq += 1
+                        self.cond.notify_all()
+            finally:
+                try:
+                    cap.release()
+                except Exception:
+                    pass
+            self.stop.wait(self.backoff.next())
+
+    def reader(self):
+        """
+        CameraPipeline(read_frame=...) 용. 호출마다 아직 안 받은 최신 프레임을 돌려준다
+        (처음 호출은 들고 있던 프레임 즉시). 카메라가 다시 열리는 동안엔 기다리고,
+        close() 된 경우나 reader.cancel (CameraPipeline 이 자기 stop 이벤트를 걸어 둠) 이 켜지면 None.
+        reader.ts 는 돌려준 프레임의 실제 캡처 시각,
+        reader.full 은 같은 순간의 원본 해상도 프레임 (reader.want_full 을 켠 뒤부터, 아니면 None)
+        """
+        return _SourceReader(self)
+
+class _SourceReader:
+    def __init__(self, source):
+        self.source = source
+        self.last = 0
+        self.ts = None
+        self.full = None
+        self.cancel = None     # threading.Event - 켜지면 새 프레임을 기다리다가도 바로 None
+
+    @property
+    def want_full(self):
+        return self.source.want_full
+
+    @want_full.setter
+    def want_full(self, value):
+        self.source.want_full = value
+
+    def __call__(self):
+        src = self.source
+        cancel = self.cancel
+        with src.cond:
+            while src.seq == self.last and not src.stop.is_set():
+                if cancel is not None and cancel.is_set():
+                    return None
+                src.cond.wait(0.5)
+            if src.stop.is_set():
+                return None
+            self.last = src.seq
+            self.ts = src.frame_ts
+            self.full = src.full
+            return src.frame
+
+class StageStats:
+    """단계별 처리 시간 누적 (STATS_INTERVAL 마다 리셋)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, dt):
+        with self.lock:
+            self.count += 1
+            self.total += dt
+            if dt > self.max:
+                self.max = dt
+
+    def take(self):
+        with self.lock:
+            r = (self.count, self.total, self.max)
+            self.count, self.total, self.max = 0, 0.0, 0.0
+            return r
+
+class MotionGate:
+    """
+    축소 흑백 차분으로 '마지막으로 보낸 프레임' 대비 변화를 본다.
+    check(frame, seq) -> meta(dict) 또는 None(전송 안 함)
+      meta = {"motion": 변화 비율, "roi": [x, y, w, h](0~1 비율) 또는 None, "key": 키프레임 여부}
+    on_sent(seq) 로 실제로 나간 프레임을 알려줘야 기준 프레임이 바뀐다
+    (통과한 뒤 LatestSlot / 순서 뒤바뀜으로 버려진 프레임은 기준이 되면 안 됨)
+    """
+
+    def __init__(self, size=MOTION_SIZE, pixel_diff=MOTION_PIXEL_DIFF,
+                 min_area=MOTION_MIN_AREA, keyframe_interval=KEYFRAME_INTERVAL):
+        self.size = size
+        self.pixel_diff = pixel_diff
+        self.min_area = min_area
+        self.keyframe_interval = keyframe_interval
+        self.ref = None
+        self.ref_seq = 0
+        self.last_key = 0.0
+        self.skipped = 0
+        self.pending = {}        # seq -> (축소 프레임, 키프레임 여부) 통과했지만 아직 전송 확인 전
+        self.lock = threading.Lock()
+
+    def check(self, frame, seq):
+        gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        small = cv2.GaussianBlur(cv2.resize(gray, self.size, interpolation=cv2.INTER_AREA), (3, 3), 0)
+        now = time.monotonic()
+        with self.lock:
+            ref, last_key = self.ref, self.last_key
+
+        if ref is None:
+            self._hold(seq, small, True)
+            return {"motion": 1.0, "roi": None, "key": True}
+
+        _, mask = cv2.threshold(cv2.absdiff(small, ref), self.pixel_diff, 255, cv2.THRESH_BINARY)
+        changed = cv2.countNonZero(mask) / float(mask.size)
+
+        if changed >= self.min_area:
+            x, y, w, h = cv2.boundingRect(mask)
+            sw, sh = self.size
+            roi = [round(x / sw, 3), round(y / sh, 3), round(w / sw, 3), round(h / sh, 3)]
+            meta = {"motion": round(changed, 4), "roi": roi, "key": False}
+        elif now - last_key >= self.keyframe_interval:
+            meta = {"motion": round(changed, 4), "roi": None, "key": True}
+        else:
+            self.skipped += 1
+            return None
+
+        self._hold(seq, small, meta["key"])
+        return meta
+
+    def _hold(self, seq, small, key):
+        with self.lock:
+            self.pending[seq] = (small, key)
+            while len(self.pending) > MOTION_PENDING_MAX:
+                del self.pending[min(self.pending)]
+
+    def on_sent(self, seq):
+        """기준 프레임은 '보낸 프레임' → 아주 느린 변화도 쌓이면 결국 전송됨"""
+        with self.lock:
+            item = self.pending.pop(seq, None)
+            for old in [k for k in self.pending if k < seq]:
+                del self.pending[old]
+            if item is None or seq <= self.ref_seq:
+                return
+            self.ref, key = item
+            self.ref_seq = seq
+            if key:
+                self.last_key = time.monotonic()
+
+class RoiRequests:
+    """
+    서버가 CMD ROI 로 요청한 고해상도 영역들. 연결마다 새로 만들지 않고 Pi 스크립트 전역 하나
+      {"cmd":"ROI","id":3,"rect":[x,y,w,h](0~1),"ttl":5,"fps":2,"quality":85}  → 추가 / 연장
+      {"cmd":"ROI","id":3,"ttl":0}                                            → 바로 끔
+    ttl 안에 다시 안 오면 저절로 빠진다 (서버가 잊거나 연결이 끊겨도 계속 찍지 않게)
+    """
+
+    def __init__(self, max_active=ROI_MAX_ACTIVE, max_fps=ROI_MAX_FPS, max_ttl=ROI_MAX_TTL):
+        self.max_active = max_active
+        self.max_fps = max_fps
+        self.max_ttl = max_ttl
+        self.lock = threading.Lock()
+        self.rois = {}           # id -> {"rect", "interval", "quality", "expires", "next"}
+        self.requests = 0
+        self.sent = 0
+        self.bytes = 0
+
+    def update(self, obj):
+        """CMD ROI 한 개 반영. 새로 켜졌으면 True"""
+        try:
+            roi_id = int(obj["id"]) & 0xFFFF
+            ttl = min(float(obj.get("ttl", 0)), self.max_ttl)
+        except (KeyError, TypeError, ValueError):
+            return False
+        now = time.monotonic()
+        with self.lock:
+            self.requests += 1
+            if ttl <= 0:
+                self.rois.pop(roi_id, None)
+                return False
+            try:
+                x, y, w, h = (min(max(float(v), 0.0), 1.0) for v in obj["rect"])
+                fps = min(float(obj.get("fps") or self.max_fps), self.max_fps)
+                quality = int(obj.get("quality") or ROI_QUALITY)
+            except (KeyError, TypeError, ValueError):
+                return False
+            if w <= 0 or h <= 0 or fps <= 0:
+                return False
+            old = self.rois.get(roi_id)
+            self.rois[roi_id] = {"rect": [x, y, min(w, 1.0 - x), min(h, 1.0 - y)], "interval": 1.0 / fps,
+                                 "quality": min(max(quality, 10), 95), "expires": now + ttl,
+                                 "next": old["next"] if old else now}
+            while len(self.rois) > self.max_active:
+                del self.rois[min(self.rois, key=lambda k: self.rois[k]["expires"])]
+            return old is None
+
+    def active(self, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            for roi_id in [k for k, r in self.rois.items() if r["expires"] <= now]:
+                del self.rois[roi_id]
+            return bool(self.rois)
+
+    def due(self, now=None):
+        """지금 찍을 차례인 [(id, rect, quality)] (ROI 마다 fps 간격)"""
+        now = time.monotonic() if now is None else now
+        out = []
+        with self.lock:
+            for roi_id, r in self.rois.items():
+                if r["expires"] > now and now >= r["next"]:
+                    r["next"] = max(r["next"] + r["interval"], now + r["interval"] / 2)   # 밀려도 몰아서 안 보냄
+                    out.append((roi_id, r["rect"], r["quality"]))
+        return out
+
+    def on_sent(self, n):
+        with self.lock:
+            self.sent += 1
+            self.bytes += n
+
+    def stats(self):
+        with self.lock:
+            return {"active": sorted(self.rois), "requests": self.requests, "sent": self.sent,
+                    "kb": round(self.bytes / 1024)}
+
+class CameraPipeline:
+    """
+    read_frame() -> frame 또는 None(카메라 끝/실패 → 파이프라인 종료)
+    encode(frame, quality) -> JPEG 버퍼 또는 None (없으면 fmt 에 맞는 camera.make_encoder)
+    fmt 는 read_frame 이 주는 형식 (camera.FMT_BGR / FMT_I420) - 움직임 감지/축소/인코딩을 그 형식 그대로.
+    read_frame.ts 가 있으면 (CameraSource.reader()) 그 프레임의 실제 캡처 시각으로 씀.
+    controller(AdaptiveController) 가 있으면 quality/scale/fps 를 매 프레임 거기서 읽는다.
+    motion(MotionGate) 이 있으면 변화 없는 프레임은 인코딩/전송 안 하고,
+    보내는 프레임 앞에 FRAME_META(CMD) 로 변화 영역을 같이 보낸다.
+    tx 는 protocol.Sender (send(mtype, payload, seq, ts)) - 센서 등과 같은 연결을 공유.
+    roi(RoiRequests) 가 있고 read_frame.full 이 오면 (full_size 백엔드) 요청된 영역을 원본 해상도로 잘라
+    TYPE_ROI 로 따로 보낸다 (본 영상과 별개 스레드 / Sender 맨 뒤 채널, 움직임 없어도 요청대로).
+    run() 은 전송 실패/카메라 실패까지 막고 있다가 리턴한다.
+    """
+
+    def __init__(self, tx, read_frame, encode=None, fps=10, quality=70,
+                 controller=None, motion=None, encoders=ENCODER_THREADS, fmt=FMT_BGR, roi=None):
+        self.tx = tx
+        self.read_frame = read_frame
+        self.fmt = fmt
+        self.encode = encode or make_encoder(fmt)
+        self.fps = fps
+        self.quality = quality
+        self.controller = controller
+        self.motion = motion
+        self.encoders = encoders
+        self.roi = roi
+
+        self.raw_slot = LatestSlot()
+        self.jpg_slot = LatestSlot()
+        self.roi_slot = LatestSlot()
+        self.stop = threading.Event()
+        if hasattr(read_frame, "cancel"):
+            # 카메라가 다시 열리는 중이어도 run() 이 끝나면 캡처 스레드가 같이 빠져나오게
+            read_frame.cancel = self.stop
+
+        self.cap_stats = StageStats()
+        self.enc_stats = StageStats()
+        self.send_stats = StageStats()
+        self.cap_to_jpeg = StageStats()     # capture 직후 ~ 인코딩 끝 (백엔드/형식 비교용)
+        self.glass_to_wire = StageStats()   # capture 직후 ~ 전송 완료
+        self.seq = 0
+        self.roi_seq = 0         # ROI 크롭 전용 번호 (본 영상 seq 와 별개)
+
+    # ---- stages ----
+    def _capture_loop(self):
+        next_ts = time.monotonic()
+        try:
+            while not self.stop.is_set():
+                t0 = time.monotonic()
+                frame = self.read_frame()
+                if frame is None:
+                    if not self.stop.is_set():
+                        print("[PI] camera read failed")
+                    break
+                t1 = time.monotonic()
+                wall = time.time()   # 서버로 보내는 캡처 시각 (v2 헤더)
+                self.cap_stats.add(t1 - t0)
+                cap_ts = getattr(self.read_frame, "ts", None)
+                if cap_ts is not None:
+                    # CameraSource 가 미리 받아 둔 프레임 → 실제로 찍힌 시각으로
+                    wall -= t1 - cap_ts
+                    t1 = cap_ts
+
+                meta = None
+                if self.motion:
+                    meta = self.motion.check(luma(frame, self.fmt), self.seq + 1)   # 축소 흑백 비교라 1ms 정도
+                    if meta is None:
+                        frame = None                  # 변화 없음 → 인코딩/전송 생략
+
+                full = getattr(self.read_frame, "full", None)
+                if frame is not None:
+                    self.seq += 1
+                    self.raw_slot.put((self.seq, t1, wall, frame, meta))
+
+                if self.roi is not None:
+                    # 원본 해상도는 ROI 가 살아 있을 때만 받아 둠 (켠 다음 프레임부터 옴)
+                    if hasattr(self.read_frame, "want_full"):
+                        self.read_frame.want_full = self.roi.active()
+                    due = self.roi.due() if full is not None else None
+                    if due:
+                        self.roi_slot.put((wall, full, due))   # 움직임 게이트와 무관 → 본 영상 seq 는 안 붙임
+
+                # FPS 제어: 절대 시각 기준이라 누적 오차 없음
+                if self.controller:
+                    self.controller.update()   # send 가 오래 막혀 있어도 (on_send 가 안 와도) 조절
+                fps = self.controller.fps if self.controller else self.fps
+                next_ts += 1.0 / fps
+                delay = next_ts - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_ts = time.monotonic()
+        finally:
+            self.stop.set()
+
+    def _encode_loop(self):
+        while not self.stop.is_set():
+            item = self.raw_slot.get()
+            if item is None:
+                continue
+            seq, cap_ts, wall, frame, meta = item
+            t0 = time.monotonic()
+            quality = self.quality
+            if self.controller:
+                quality = self.controller.quality
+                scale = self.controller.scale
+                if scale != 1.0:
+                    frame = resize_frame(frame, scale, self.fmt)
+            jpg = self.encode(frame, quality)   # cv2.imencode / simplejpeg 는 GIL 을 놓으므로 스레드 병렬 OK
+            t1 = time.monotonic()
+            self.enc_stats.add(t1 - t0)
+            self.cap_to_jpeg.add(t1 - cap_ts)
+            if jpg is not None:
+                self.jpg_slot.put((seq, cap_ts, wall, jpg, meta))
+
+    def _send_loop(self):
+        last_seq = 0
+        try:
+            while not self.stop.is_set():
+                item = self.jpg_slot.get()
+                if item is None:
+                    continue
+                seq, cap_ts, wall, jpg, meta = item
+                if seq <= last_seq:
+                    continue   # 인코더가 여러 개라 순서 뒤바뀐 옛 프레임은 버림
+                last_seq = seq
+
+                t0 = time.monotonic()
+                if meta is not None:
+                    # 바로 다음 IMAGE 에 대한 정보 (서버/인식기가 정지 프레임은 건너뛸 수 있게)
+                    meta = dict(meta, cmd="FRAME_META", seq=seq)
+                    self.tx.send(TYPE_CMD, json.dumps(meta).encode("utf-8"))
+                # numpy 버퍼 그대로 (tobytes 복사 없음), v2 면 seq/캡처 시각도 같이
+                if self.controller:
+                    self.controller.begin_send()
+                self.tx.send(TYPE_IMAGE, jpg, seq=seq, ts=wall)
+                if self.motion:
+                    self.motion.on_sent(seq)
+                t1 = time.monotonic()
+                self.send_stats.add(t1 - t0)
+                self.glass_to_wire.add(t1 - cap_ts)
+                if self.controller:
+                    self.controller.on_send(len(jpg), t1 - t0)
+        except Exception as e:
+            print("[PI] image send error:", e)
+        finally:
+            self.stop.set()
+
+    def _roi_loop(self):
+        """ROI 크롭 → 인코딩 → TYPE_ROI. 느려도 본 영상 단계는 안 막음 (밀리면 LatestSlot 이 버림)"""
+        try:
+            while not self.stop.is_set():
+                item = self.roi_slot.get()
+                if item is None:
+                    continue
+                wall, full, due = item
+                for roi_id, rect, quality in due:
+                    crop = crop_frame(full, rect, self.fmt, ROI_MAX_SIDE)
+                    jpg = None if crop is None else self.encode(crop, quality)
+                    if jpg is None:
+                        continue
+                    payload = pack_roi(roi_id, rect, jpg)
+                    self.roi_seq += 1
+                    self.tx.send(TYPE_ROI, payload, seq=self.roi_seq, ts=wall)
+                    self.roi.on_sent(len(payload))
+        except Exception as e:
+            print("[PI] roi send error:", e)
+        finally:
+            self.stop.set()
+
+    # ---- 통계 ----
+    def _report(self, elapsed):
+        n_cap, t_cap, _ = self.cap_stats.take()
+        n_enc, t_enc, _ = self.enc_stats.take()
+        n_send, t_send, _ = self.send_stats.take()
+        n_c2j, t_c2j, max_c2j = self.cap_to_jpeg.take()
+        n_g2w, t_g2w, max_g2w = self.glass_to_wire.take()
+
+        def ms(total, n):
+            return total / n * 1000.0 if n else 0.0
+
+        cap_ms = ms(t_cap, n_cap)
+        enc_ms = ms(t_enc, n_enc)
+        send_ms = ms(t_send, n_send)
+
+        # 단계별 한 프레임당 점유 시간 (인코더는 병렬이라 스레드 수로 나눔)
+        load = {
+            "capture": cap_ms,
+            "encode": enc_ms / self.encoders,
+            "network": send_ms,
+        }
+        bound = max(load, key=load.get)
+
+        print(
+            f"[PI][PIPE] send {n_send / elapsed:.1f}fps"
+            f" | cap {cap_ms:.1f}ms enc {enc_ms:.1f}ms(x{self.encoders}) send {send_ms:.1f}ms"
+            f" | {self.fmt} cap->jpeg avg {ms(t_c2j, n_c2j):.1f}ms max {max_c2j * 1000:.0f}ms"
+            f" | glass->wire avg {ms(t_g2w, n_g2w):.0f}ms max {max_g2w * 1000:.0f}ms"
+            f" | drop enc={self.raw_slot.dropped} send={self.jpg_slot.dropped}"
+            f" static={self.motion.skipped if self.motion else 0}"
+            f" | {bound}-bound"
+        )
+        if self.controller:
+            st = self.controller.state()
+            print(f"[PI][ADAPT] q={st['quality']} scale={st['scale']} fps={st['fps']}"
+                  f" send={st['send_ms']}ms server_rx={st['server_rx_fps']}fps"
+                  + ("" if st["udp_loss"] is None else f" udp_loss={st['udp_loss'] * 100:.1f}%"))
+        if self.roi is not None and self.roi.active():
+            st = self.roi.stats()
+            print(f"[PI][ROI] active={st['active']} sent={st['sent']} ({st['kb']}KB)"
+                  f" drop={self.roi_slot.dropped}")
+        if hasattr(self.tx, "stats"):
+            # 채널별 대기 (센서가 영상 뒤에서 얼마나 기다렸는지)
+            print("[PI][TX] " + " | ".join(
+                f"{name} q={st['depth']}/{st['max_depth']} wait avg {st['wait_ms_avg']}ms max {st['wait_ms_max']}ms"
+                for name, st in self.tx.stats().items()))
+
+    def run(self):
+        threads = [threading.Thread(target=self._capture_loop, daemon=True),
+                   threading.Thread(target=self._send_loop, daemon=True)]
+        threads += [threading.Thread(target=self._encode_loop, daemon=True)
+                    for _ in range(self.encoders)]
+        if self.roi is not None:
+            threads.append(threading.Thread(target=self._roi_loop, daemon=True))
+        for t in threads:
+            t.start()
+
+        last = time.monotonic()
+        while not self.stop.wait(STATS_INTERVAL):
+            now = time.monotonic()
+            self._report(now - last)
+            last = now
+
+        self.raw_slot.close()
+        self.jpg_slot.close()
+        self.roi_slot.close()
+        if hasattr(self.read_frame, "want_full"):
+            self.read_frame.want_full = False
+        for t in threads:
+            t.join(timeout=2.0)
@@ -0,0 +1,385 @@
+"""
+가짜 Pi (하드웨어 없이 브리지 테스트/벤치마크용)
+
+  python pi_sim.py --devices 4 --fps 15 --size 640x480
+  python pi_sim.py --jpeg-dir ./samples --fps 10
+  python pi_sim.py --outage-every 30 --outage-sec 10    # 끊김 감지 / 복구 시간 측정
+  python pi_sim.py --roi-size 1920x1440                 # 서버 ROI 요청에 고해상도 크롭으로 응답
+
+실제 Pi 와 같은 프로토콜(HELLO / TYPE_SENSOR / TYPE_IMAGE / TYPE_CMD)로 접속한다.
+각 JPEG 에는 COM 세그먼트로 "SIMTS:<송신시각>:<device>:<seq>" 를 넣어서
+(브라우저/뷰어는 그대로 표시 가능) 헤드리스 뷰어가 end-to-end 지연을 잴 수 있다.
+"""
+import argparse, glob, json, os, random, socket, struct, threading, time, uuid
+
+from protocol import (TYPE_SENSOR, TYPE_IMAGE, TYPE_CMD, TYPE_ROI, PROTO_VERSION, HEARTBEAT_INTERVAL,
+                      HEARTBEAT_TIMEOUT, MsgReader, Sender, Backoff, UdpFrameSender, SensorBatch, set_keepalive,
+                      pack_roi)
+
+SIM_TAG = b"SIMTS:"
+SENSOR_HZ = 10               # proto 4 면 이 주기 샘플을 sensor_interval 마다 묶어서 보냄
+CONNECT_TIMEOUT = 5.0
+RECONNECT_BASE = 0.5
+RECONNECT_MAX = 30.0
+
+# =========================
+# 프레임 만들기
+# =========================
+def make_frames(width, height, count=30, quality=70):
+    """움직이는 사각형 + 노이즈 JPEG 들 (미리 인코딩해 두고 돌려씀)"""
+    import cv2
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    yy, xx = np.mgrid[0:height, 0:width]
+    bg = np.dstack([xx * 255 // width, yy * 255 // height, (xx + yy) * 127 // (width + height)]).astype(np.uint8)
+    frames = []
+    for i in range(count):
+        frame = bg.copy()
+        x = int((width - width // 6) * i / count)
+        cv2.rectangle(frame, (x, height // 3), (x + width // 6, height * 2 // 3), (255, 255, 255), -1)
+        frame = cv2.add(frame, rng.integers(0, 16, frame.shape, dtype=np.uint8))
+        ok, jpg = cv2.imencode(".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+        frames.append(jpg.tobytes())
+    return frames
+
+def load_frames(jpeg_dir):
+    frames = []
+    for path in sorted(glob.glob(os.path.join(jpeg_dir, "*.jpg")) + glob.glob(os.path.join(jpeg_dir, "*.jpeg"))):
+        with open(path, "rb") as f:
+            data = f.read()
+        if data[:2] == b"\xff\xd8":
+            frames.append(data)
+    if not frames:
+        raise SystemExit(f"no JPEG files in {jpeg_dir}")
+    return frames
+
+def tag_jpeg(jpeg, device_id, seq, ts):
+    """SOI 바로 뒤에 COM(FF FE) 세그먼트 삽입 → 디코더는 무시, 뷰어는 읽을 수 있음"""
+    body = SIM_TAG + f"{ts:.6f}:{device_id}:{seq}".encode("ascii")
+    return b"\xff\xd8\xff\xfe" + struct.pack("!H", len(body) + 2) + body + jpeg[2:]
+
+def parse_tag(jpeg):
+    """tag_jpeg 으로 넣은 (ts, device_id, seq) 또는 None"""
+    if len(jpeg) < 6 or jpeg[2:4] != b"\xff\xfe":
+        return None
+    n = struct.unpack("!H", jpeg[4:6])[0]
+    body = bytes(jpeg[6:4 + n])
+    if not body.startswith(SIM_TAG):
+        return None
+    ts, device_id, seq = body[len(SIM_TAG):].decode("ascii").rsplit(":", 2)
+    return float(ts), device_id, int(seq)
+
+# =========================
+# 가짜 Pi 한 대
+# =========================
+class SimDevice:
+    """
+    가짜 Pi 한 대. 실제 Pi 처럼 끊기면 Backoff 로 다시 붙고 같은 session 으로 HELLO.
+    outage(sec) 는 케이블을 뽑은 것처럼 FIN 없이 링크를 죽인다
+    (송수신 멈춤 + 재접속 실패) → 하트비트로 끊김 감지 / 복구 시간을 잴 수 있음.
+    """
+
+    def __init__(self, device_id, host, port, frames, fps, sensor_interval=0.5, udp=False, udp_port=None,
+                 roi_frame=None):
+        self.device_id = device_id
+        self.host = host
+        self.port = port
+        self.udp = udp                # 영상을 UDP 로 (서버 WELCOME 에 udp_port 가 와야 실제로 씀)
+        self.udp_port = udp_port      # 지정하면 WELCOME 의 포트 대신 (손실 흉내 relay 등)
+        self.frames = frames
+        self.fps = fps
+        self.sensor_interval = sensor_interval
+        self.session = uuid.uuid4().hex
+        # ROI 요청에 잘라 줄 '센서 원본' (BGR 한 장). 없으면 HELLO 에 roi 를 안 알림
+        self.roi_frame = roi_frame
+        self.roi = None
+        if roi_frame is not None:
+            from pi_pipeline import RoiRequests
+            self.roi = RoiRequests()
+        self.roi_seq = 0   # ROI 크롭 전용 번호 (IMAGE seq 와 별개)
+
+        self.sent = 0
+        self.sent_bytes = 0
+        self.cmds = 0
+        self.alerts = 0
+        self.reconnects = 0
+        self.stop = threading.Event()
+        self.conn = None
+        self.tx = None
+
+        # 링크 장애 흉내
+        self.link_up = threading.Event()
+        self.link_up.set()
+        self.outage_ts = None         # 장애 시작 (monotonic)
+        self.restore_ts = None        # 링크 복구
+        self.detect_sec = None        # 장애 → 하트비트 타임아웃으로 끊김 감지
+        self.recoveries = []          # [{"detect_sec", "recover_sec", "resumed"}]
+        self.last_rx = 0.0
+
+    def outage(self, sec):
+        self.outage_ts = time.monotonic()
+        self.restore_ts = None
+        self.detect_sec = None
+        self.link_up.clear()
+        print(f"[SIM] {self.device_id} link DOWN for {sec:.1f}s")
+        t = threading.Timer(sec, self._restore)
+        t.daemon = True
+        t.start()
+
+    def _restore(self):
+        self.restore_ts = time.monotonic()
+        self.link_up.set()
+        print(f"[SIM] {self.device_id} link UP")
+
+    def _send(self, mtype, payload, seq=None, ts=None):
+        # 장애 중에는 아무것도 안 나감 (버퍼에 쌓이지도 않게 링크 복구까지 대기)
+        while not self.link_up.wait(0.1):
+            if self.stop.is_set() or self.dead.is_set():
+                raise OSError("link down")
+        self.tx.send(mtype, payload, seq, ts)
+
+    def _on_welcome(self, obj):
+        self.tx.proto = int(obj.get("proto", 1))
+        if obj.get("udp_port"):
+            port = self.udp_port or int(obj["udp_port"])
+            self.tx.udp = UdpFrameSender.connect(self.host, port, int(obj["udp_token"]))
+        if self.restore_ts is None:
+            return
+        rec = {
+            "detect_sec": self.detect_sec,
+            "recover_sec": round(time.monotonic() - self.restore_ts, 3),
+            "resumed": bool(obj.get("resumed")),
+        }
+        self.recoveries.append(rec)
+        self.restore_ts = None
+        print(f"[SIM] {self.device_id} recovered: detect={rec['detect_sec']}s "
+              f"link-up→WELCOME={rec['recover_sec']}s resumed={rec['resumed']}")
+
+    def _cmd_loop(self, conn):
+        reader = MsgReader(conn, 64 * 1024)
+        while not self.stop.is_set() and not self.dead.is_set():
+            if not self.link_up.is_set():
+                # 장애 중: 아무것도 안 읽힘. 하트비트가 끊기면 죽은 연결로 판단
+                if time.monotonic() - self.last_rx > HEARTBEAT_TIMEOUT:
+                    self.detect_sec = round(time.monotonic() - self.outage_ts, 3)
+                    print(f"[SIM] {self.device_id} heartbeat timeout after {self.detect_sec}s")
+                    break
+                time.sleep(0.1)
+                continue
+            try:
+                mtype, payload = reader.recv_msg()
+            except socket.timeout:
+                # 0.5s 폴링. 서버가 조용히 죽은 경우도 같은 기준으로 판정
+                if time.monotonic() - self.last_rx > HEARTBEAT_TIMEOUT:
+                    print(f"[SIM] {self.device_id} heartbeat timeout")
+                    break
+                continue
+            except OSError:
+                break
+            if mtype is None:
+                break
+            self.last_rx = time.monotonic()
+            if mtype == TYPE_CMD:
+                self.cmds += 1
+                try:
+                    obj = json.loads(bytes(payload))
+                except ValueError:
+                    continue
+                cmd = obj.get("cmd")
+                if cmd == "ALERT":
+                    self.alerts += 1
+                elif cmd == "WELCOME":
+                    self._on_welcome(obj)
+                elif cmd == "ROI" and self.roi is not None:
+                    if self.roi.update(obj):
+                        print(f"[SIM] {self.device_id} ROI on: {obj.get('id')} {obj.get('rect')}")
+                elif cmd == "TIME":
+                    reply = {"cmd": "TIME", "t0": obj.get("t0"), "t1": time.time()}
+                    try:
+                        self._send(TYPE_CMD, json.dumps(reply).encode("utf-8"))
+                    except OSError:
+                        break
+        self.dead.set()
+
+    def _sensor_loop(self):
+        next_ts = time.monotonic()
+        while not self.stop.is_set() and not self.dead.is_set():
+            now = time.time()
+            try:
+                if self.tx.proto >= 4:
+                    # 실제 Pi 처럼 SENSOR_HZ 로 측정한 샘플을 묶어서
+                    batch = SensorBatch()
+                    n = max(1, int(self.sensor_interval * SENSOR_HZ))
+                    for i in range(n):
+                        batch.add("ultrasonic_cm", round(random.uniform(30, 200), 1), now - (n - 1 - i) / SENSOR_HZ)
+                    self._send(TYPE_SENSOR, batch.pack())
+                else:
+                    data = {"ultrasonic_cm": round(random.uniform(30, 200), 1), "ts": now}
+                    self._send(TYPE_SENSOR, json.dumps(data).encode("utf-8"))
+            except OSError:
+                break
+            next_ts += self.sensor_interval
+            self.stop.wait(max(0.0, next_ts - time.monotonic()))
+
+    def _heartbeat_loop(self):
+        ping = json.dumps({"cmd": "PING"}).encode("utf-8")
+        while not self.stop.wait(HEARTBEAT_INTERVAL) and not self.dead.is_set():
+            try:
+                self._send(TYPE_CMD, ping)
+            except OSError:
+                break
+
+    def _connect(self):
+        if not self.link_up.is_set():
+            raise OSError("link down")    # 장애 중 재접속 시도는 실패
+        conn = socket.create_connection((self.host, self.port), timeout=CONNECT_TIMEOUT)
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        set_keepalive(conn)
+        conn.settimeout(0.5)
+        return conn
+
+    def _session(self):
+        """연결 하나가 살아 있는 동안 프레임 송신. 끊기면 리턴"""
+        self.dead = threading.Event()
+        self.last_rx = time.monotonic()
+        self.tx = Sender(self.conn)
+        hello = {"cmd": "HELLO", "device": self.device_id, "proto": PROTO_VERSION,
+                 "session": self.session, "udp": self.udp, "roi": self.roi is not None}
+        self._send(TYPE_CMD, json.dumps(hello).encode("utf-8"))
+
+        threading.Thread(target=self._cmd_loop, args=(self.conn,), daemon=True).start()
+        threading.Thread(target=self._sensor_loop, daemon=True).start()
+        threading.Thread(target=self._heartbeat_loop, daemon=True).start()
+
+        interval = 1.0 / self.fps
+        next_ts = time.monotonic()
+        seq = self.sent
+        while not self.stop.is_set() and not self.dead.is_set():
+            seq += 1
+            now = time.time()
+            jpeg = tag_jpeg(self.frames[seq % len(self.frames)], self.device_id, seq, now)
+            self._send(TYPE_IMAGE, jpeg, seq, now)
+            self.sent += 1
+            self.sent_bytes += len(jpeg)
+            if self.roi is not None:
+                self._send_rois(now)
+
+            next_ts += interval
+            delay = next_ts - time.monotonic()
+            if delay > 0:
+                self.stop.wait(delay)
+            else:
+                next_ts = time.monotonic()
+
+    def _send_rois(self, ts):
+        from camera import crop_frame, encode_bgr
+        from pi_pipeline import ROI_MAX_SIDE
+        self.roi.active()   # 만료된 것 정리
+        for roi_id, rect, quality in self.roi.due():
+            crop = crop_frame(self.roi_frame, rect, max_side=ROI_MAX_SIDE)
+            jpg = None if crop is None else encode_bgr(crop, quality)
+            if jpg is not None:
+                payload = pack_roi(roi_id, rect, jpg)
+                self.roi_seq += 1
+                self._send(TYPE_ROI, payload, self.roi_seq, ts)
+                self.roi.on_sent(len(payload))
+
+    def run(self):
+        backoff = Backoff(RECONNECT_BASE, RECONNECT_MAX)
+        self.dead = threading.Event()
+        while not self.stop.is_set():
+            try:
+                self.conn = self._connect()
+            except OSError as e:
+                wait = backoff.next()
+                if self.outage_ts is None:
+                    print(f"[SIM] {self.device_id} connect failed ({e}), retry in {wait:.1f}s")
+                self.stop.wait(wait)
+                continue
+
+            backoff.reset()
+            try:
+                self._session()
+            except OSError as e:
+                if self.link_up.is_set():
+                    print(f"[SIM] {self.device_id} send error:", e)
+            finally:
+                self.dead.set()
+                try:
+                    self.conn.close()
+                except OSError:
+                    pass
+                self.tx.close()
+            if not self.stop.is_set():
+                self.reconnects += 1
+                self.stop.wait(backoff.next())
+
+    def start(self):
+        t = threading.Thread(target=self.run, daemon=True)
+        t.start()
+        return t
+
+def parse_size(text):
+    w, h = text.lower().split("x")
+    return int(w), int(h)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--server", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=6000)
+    ap.add_argument("--devices", type=int, default=1)
+    ap.add_argument("--fps", type=float, default=10)
+    ap.add_argument("--size", default="640x480")
+    ap.add_argument("--quality", type=int, default=70)
+    ap.add_argument("--jpeg-dir", help="이 폴더의 JPEG 들을 순서대로 재생")
+    ap.add_argument("--prefix", default="sim")
+    ap.add_argument("--udp", action="store_true", help="영상을 UDP 로 (서버 UDP_ENABLED 필요)")
+    ap.add_argument("--outage-every", type=float, default=0, help="이 간격(초)마다 링크 장애 흉내 (0 = 끔)")
+    ap.add_argument("--outage-sec", type=float, default=10.0, help="장애 지속 시간")
+    ap.add_argument("--roi-size", help="이 해상도의 '센서 원본' 에서 ROI 크롭을 보냄 (예: 1920x1440)")
+    args = ap.parse_args()
+
+    if args.jpeg_dir:
+        frames = load_frames(args.jpeg_dir)
+    else:
+        frames = make_frames(*parse_size(args.size), quality=args.quality)
+    print(f"[SIM] {len(frames)} frames, avg {sum(map(len, frames)) // len(frames)} bytes")
+
+    roi_frame = None
+    if args.roi_size:
+        from camera import synthetic_frames
+        roi_frame = synthetic_frames(*parse_size(args.roi_size), count=1)[0]
+
+    devs = [SimDevice(f"{args.prefix}-{i}", args.server, args.port, frames, args.fps, udp=args.udp,
+                      roi_frame=roi_frame)
+            for i in range(args.devices)]
+    for d in devs:
+        d.start()
+
+    next_outage = time.monotonic() + args.outage_every
+    try:
+        while any(not d.stop.is_set() for d in devs):
+            time.sleep(5)
+            print("[SIM]", ", ".join(f"{d.device_id}: sent={d.sent} cmds={d.cmds} reconnects={d.reconnects}"
+                                     + (f" roi={d.roi.sent}" if d.roi is not None else "")
+                                     for d in devs))
+            if args.outage_every and time.monotonic() >= next_outage:
+                for d in devs:
+                    d.outage(args.outage_sec)
+                next_outage = time.monotonic() + args.outage_every
+    except KeyboardInterrupt:
+        pass
+    for d in devs:
+        d.stop.set()
+
+    recs = [r for d in devs for r in d.recoveries]
+    if recs:
+        detect = [r["detect_sec"] for r in recs if r["detect_sec"] is not None]
+        recover = [r["recover_sec"] for r in recs]
+        print(f"[SIM] recoveries={len(recs)} resumed={sum(r['resumed'] for r in recs)}"
+              + (f" detect avg={sum(detect) / len(detect):.2f}s" if detect else "")
+              + f" link-up→WELCOME avg={sum(recover) / len(recover):.2f}s max={max(recover):.2f}s")
+
+if __name__ == "__main__":
+    main()
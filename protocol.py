@@ -0,0 +1,640 @@
+import random, socket, struct, threading, time
+from collections import deque
+
+# =========================
+# 공용 TCP 프로토콜 (Pi <-> Server)
+#   v1: [1B type][4B length][payload]
+#   v2: [1B 0x80|type][4B length][4B seq][8B capture_ts(us)][payload]
+#       length 는 seq/ts 12바이트 포함 → v1 수신측도 길이만큼 건너뛸 수 있음
+#       (Pi 는 서버가 WELCOME 으로 proto 2 를 알려줘야 v2 를 씀)
+#   v3: 큰 메시지를 조각으로 - 마지막 조각 전까지 type 에 0x40 (MORE) 플래그,
+#       seq/ts 는 마지막 조각에만. 조각 사이에 다른 type 메시지가 끼어들 수 있음
+#   v4: SENSOR payload 로 JSON 대신 바이너리 묶음도 받음 - 아래 SensorBatch 참고
+#   v5: TYPE_ROI - 서버가 CMD ROI 로 요청한 영역을 Pi 가 고해상도로 잘라 보냄 - 아래 ROI_HEADER 참고
+#   (선택) IMAGE 만 UDP 로 - 아래 UDP_HEADER 참고
+# =========================
+TYPE_SENSOR = 1
+TYPE_IMAGE  = 2
+TYPE_CMD    = 3
+TYPE_ROI    = 4
+
+PROTO_VERSION = 5
+FLAG_V2 = 0x80
+FLAG_MORE = 0x40                     # v3: 같은 type 의 조각이 더 온다
+
+HEADER = struct.Struct("!BI")
+HEADER_SIZE = HEADER.size            # 5
+EXT = struct.Struct("!IQ")           # v2 확장: seq, capture_ts(us, 보낸 쪽 시계)
+EXT_SIZE = EXT.size                  # 12
+
+MAX_PAYLOAD = 16 * 1024 * 1024       # 비정상 length 방어용 (16MB)
+READER_BUFSIZE = 256 * 1024          # JPEG 몇 장 들어가는 크기
+
+# 연결 생존 확인 (양쪽 기본값 - 각 스크립트 설정에서 바꿀 수 있음)
+#   양쪽 다 HEARTBEAT_INTERVAL 마다 {"cmd":"PING"} 을 보내고,
+#   HEARTBEAT_TIMEOUT 동안 아무것도 못 받으면(소켓 timeout) 끊긴 걸로 본다
+HEARTBEAT_INTERVAL = 2.0
+HEARTBEAT_TIMEOUT = 6.0
+KEEPALIVE_IDLE = 5                   # TCP keepalive: 조용한 지 몇 초 후부터 probe
+KEEPALIVE_INTERVAL = 2               # probe 간격
+KEEPALIVE_COUNT = 3                  # 몇 번 응답 없으면 끊음
+
+# UDP 영상 (선택) - IMAGE 만 데이터그램으로, SENSOR / CMD 는 TCP 그대로
+#   TCP 는 Wi-Fi 패킷 하나만 잃어도 재전송 동안 뒤의 프레임/센서가 전부 같이 멈춤 (head-of-line)
+#   → 영상은 번호 붙인 조각으로 보내고, 다 모인 프레임만 쓰고, 늦거나 빠진 프레임은 버림
+#   데이터그램: [4B token][4B seq][8B capture_ts(us)][2B index][2B count][조각]
+#     token 은 WELCOME 때 서버가 연결마다 새로 주는 값 (어느 장치/연결의 영상인지)
+UDP_HEADER = struct.Struct("!IIQHH")
+UDP_HEADER_SIZE = UDP_HEADER.size    # 20
+UDP_FRAG_SIZE = 1200                 # IP/UDP 헤더 붙어도 MTU 1500 안 → IP 단편화 없음
+UDP_FRAME_DEADLINE = 0.25            # 첫 조각부터 이 시간 안에 다 안 모이면 버림 (초)
+
+# =========================
+# 버퍼 재사용 수신기 (서버/Pi 수신 루프용)
+# =========================
+class MsgReader:
+    """
+    미리 잡아둔 bytearray 에 recv_into 로 직접 받아서
+    payload 를 memoryview 로 돌려준다 (추가 복사 없음).
+
+    ⚠ 돌려준 payload 는 다음 recv_msg() 호출 전까지만 유효하다.
+       오래 들고 있을 거면 bytes(payload) 로 한 번만 복사할 것.
+
+    v2 메시지면 self.seq / self.ts(초, 보낸 쪽 시계)가 채워지고 v1 이면 None.
+    v3 조각은 type 별로 모아서 마지막 조각이 왔을 때 한 메시지로 돌려준다
+    (이때만 새 bytearray 를 쓰므로 payload 가 다음 recv 이후에도 유효).
+    소켓에 timeout 을 걸어도 되고, socket.timeout 뒤에 다시 부르면 이어서 받는다.
+    """
+
+    def __init__(self, conn, bufsize=READER_BUFSIZE):
+        self.conn = conn
+        self.buf = bytearray(bufsize)
+        self.view = memoryview(self.buf)
+        self.start = 0   # 아직 안 읽은 데이터 시작
+        self.end = 0     # 받은 데이터 끝
+        self.seq = None
+        self.ts = None
+        self.partial = {}   # type -> 모으는 중인 조각 (bytearray)
+
+    def _fill(self, need):
+        """버퍼에 최소 need 바이트가 쌓일 때까지 받는다. 연결 끊기면 False"""
+        if self.end - self.start >= need:
+            return True
+
+        if need > len(self.buf):
+            # 버퍼보다 큰 메시지 → 한 번만 키운다 (이후 재사용)
+            size = len(self.buf)
+            while size < need:
+                size *= 2
+            buf = bytearray(size)
+            buf[:self.end - self.start] = self.view[self.start:self.end]
+            self.buf = buf
+            self.view = memoryview(buf)
+            self.end -= self.start
+            self.start = 0
+        elif self.start + need > len(self.buf):
+            # 뒤쪽 공간 부족 → 남은 데이터만 앞으로 당김
+            n = self.end - self.start
+            self.buf[:n] = self.view[self.start:self.end]
+            self.start = 0
+            self.end = n
+
+        while self.end - self.start < need:
+            n = self.conn.recv_into(self.view[self.end:])
+            if not n:
+                return False
+            self.end += n
+        return True
+
+    def recv_msg(self):
+        while True:
+            mtype, payload = self._recv_one()
+            if mtype is None:
+                return None, None
+            more = mtype & FLAG_MORE
+            mtype &= ~FLAG_MORE
+            partial = self.partial.get(mtype)
+            if not more and partial is None:
+                return mtype, payload
+            if partial is None:
+                partial = self.partial[mtype] = bytearray()
+            partial += payload
+            if len(partial) > MAX_PAYLOAD:
+                raise ValueError(f"payload too large: {len(partial)}")
+            if not more:
+                del self.partial[mtype]
+                return mtype, memoryview(partial)
+
+    def _recv_one(self):
+        if not self._fill(HEADER_SIZE):
+            return None, None
+        mtype, length = HEADER.unpack_from(self.buf, self.start)
+        if length > MAX_PAYLOAD:
+            raise ValueError(f"payload too large: {length}")
+        # 헤더는 메시지가 다 올 때까지 소비하지 않음 → recv 타임아웃이 나도 다시 부르면 이어서 읽힘
+        if not self._fill(HEADER_SIZE + length):
+            return None, None
+        self.start += HEADER_SIZE
+
+        if mtype & FLAG_V2:
+            if length < EXT_SIZE:
+                raise ValueError(f"bad v2 length: {length}")
+            mtype &= ~FLAG_V2
+            seq, ts_us = EXT.unpack_from(self.buf, self.start)
+            self.seq, self.ts = seq, ts_us / 1e6
+            self.start += EXT_SIZE
+            length -= EXT_SIZE
+        else:
+            self.seq = self.ts = None
+
+        payload = self.view[self.start:self.start + length]
+        self.start += length
+        return mtype, payload
+
+# =========================
+# 단발성 함수 (기존 recvall/recv_msg/send_msg 대체)
+# =========================
+def recvall(conn, n):
+    """n 바이트를 새 bytearray 하나에 바로 받는다 (data += chunk 없음)"""
+    data = bytearray(n)
+    view = memoryview(data)
+    got = 0
+    while got < n:
+        k = conn.recv_into(view[got:])
+        if not k:
+            return None
+        got += k
+    return data
+
+def recv_msg(conn):
+    """v1 전용 단발 수신 (v2 는 MsgReader 사용)"""
+    header = recvall(conn, HEADER_SIZE)  # 1B type + 4B length
+    if header is None:
+        return None, None
+    mtype, length = HEADER.unpack(header)
+    if length > MAX_PAYLOAD:
+        raise ValueError(f"payload too large: {length}")
+    payload = recvall(conn, length)
+    if payload is None:
+        return None, None
+    return mtype, payload
+
+def send_msg(conn, mtype, payload, seq=None, ts=None):
+    """
+    header + payload 를 이어붙이지 않고 sendmsg(scatter-gather)로 한 번에 보낸다.
+    payload 는 bytes / bytearray / memoryview / numpy 버퍼 모두 가능.
+    seq 를 주면 v2 헤더 (ts 는 캡처 시각 time.time(), 없으면 지금)
+    """
+    body = memoryview(payload).cast("B")
+    if seq is None:
+        header = HEADER.pack(mtype, len(body))
+    else:
+        ts = time.time() if ts is None else ts
+        header = HEADER.pack(mtype | FLAG_V2, EXT_SIZE + len(body)) + \
+            EXT.pack(seq & 0xFFFFFFFF, int(ts * 1e6))
+    hsize = len(header)
+
+    sendmsg = getattr(conn, "sendmsg", None)
+    if sendmsg is None:
+        # Windows 등 sendmsg 없는 환경
+        conn.sendall(header + body.tobytes())
+        return
+
+    try:
+        sent = sendmsg([header, body])
+    except (BlockingIOError, InterruptedError):
+        # eventlet green socket 은 sendmsg 가 원본 non-blocking 소켓으로 감
+        sent = 0
+
+    # 부분 전송된 나머지는 sendall 로 마저 보냄 (복사 없이 slice)
+    if sent < hsize:
+        conn.sendall(header[sent:])
+        sent = hsize
+    rest = sent - hsize
+    if rest < len(body):
+        conn.sendall(body[rest:])
+
+# =========================
+# 센서 묶음 (v4) - 샘플마다 JSON 한 개 대신 여러 샘플을 고정 크기 레코드로
+#   [1B 0xB1][1B 채널 수 n][2B 레코드 수 m][8B base_ts(us)]
+#   [채널 이름 n 개: 1B 길이 + utf-8]
+#   [레코드 m 개: 1B 채널 번호][4B base_ts 부터 us][4B float32 값]   (9B, JSON 은 샘플당 ~45B)
+#   JSON 은 '{' 로 시작하므로 첫 바이트로 구분 (서버는 둘 다 받음)
+# =========================
+SENSOR_BATCH_MAGIC = 0xB1
+SENSOR_BATCH_HEADER = struct.Struct("!BBHQ")
+SENSOR_RECORD = struct.Struct("!BIf")
+SENSOR_BATCH_MAX = 1200              # 안 보내고 쌓이는 최대 샘플 수 (넘치면 오래된 것부터 버림)
+
+class SensorBatch:
+    """
+    Pi: 센서 스레드가 add(), 전송 루프가 주기마다 pack() → TYPE_SENSOR payload 한 개.
+    연결이 끊긴 동안 쌓인 것도 (SENSOR_BATCH_MAX 까지) 다음 연결에서 나감.
+    보내다 실패하면 restore() 로 마지막 pack() 한 것을 되돌려 다음 연결에서 다시 보냄.
+    """
+
+    def __init__(self, maxlen=SENSOR_BATCH_MAX):
+        self.lock = threading.Lock()
+        self.records = deque(maxlen=maxlen)   # (channel, ts, value)
+        self.dropped = 0
+        self.unsent = []                      # 마지막 pack() 으로 꺼낸 것 (restore 용)
+
+    def add(self, channel, value, ts=None):
+        if value is None:
+            return                            # 측정 실패 (timeout / 범위 밖) 는 안 보냄
+        with self.lock:
+            if len(self.records) == self.records.maxlen:
+                self.dropped += 1
+            self.records.append((channel, time.time() if ts is None else ts, value))
+
+    def __len__(self):
+        return len(self.records)
+
+    def clear(self):
+        with self.lock:
+            self.records.clear()
+            self.unsent = []
+
+    def restore(self):
+        """마지막 pack() 것을 못 보냈을 때: 그 사이 쌓인 것 앞에 되돌림 (maxlen 넘치면 오래된 것부터 버림)"""
+        with self.lock:
+            records, self.unsent = self.unsent, []
+            room = self.records.maxlen - len(self.records)
+            if len(records) > room:
+                self.dropped += len(records) - room
+                records = records[len(records) - room:]
+            self.records.extendleft(reversed(records))
+
+    def pack(self, limit=0xFFFF):
+        """쌓인 것 (최대 limit 개) 을 payload 로 꺼냄. 없으면 None"""
+        with self.lock:
+            n = min(len(self.records), limit)
+            records = [self.records.popleft() for _ in range(n)]
+            self.unsent = records
+        if not records:
+            return None
+        names = list(dict.fromkeys(r[0] for r in records))[:255]
+        index = {name: i for i, name in enumerate(names)}
+        base_us = int(min(r[1] for r in records) * 1e6)
+        out = bytearray(SENSOR_BATCH_HEADER.pack(SENSOR_BATCH_MAGIC, len(names), 0, base_us))
+        for name in names:
+            raw = name.encode("utf-8")[:255]
+            out += bytes((len(raw),)) + raw
+        m = 0
+        for channel, ts, value in records:
+            i = index.get(channel)
+            if i is not None:
+                out += SENSOR_RECORD.pack(i, min(int(ts * 1e6) - base_us, 0xFFFFFFFF), value)
+                m += 1
+        struct.pack_into("!H", out, 2, m)
+        return bytes(out)
+
+def unpack_sensor_batch(payload):
+    """SensorBatch payload → [(channel, ts, value)]. 묶음이 아니면 (JSON 등) None, 깨졌으면 []"""
+    if len(payload) < SENSOR_BATCH_HEADER.size or payload[0] != SENSOR_BATCH_MAGIC:
+        return None
+    try:
+        _, n, m, base_us = SENSOR_BATCH_HEADER.unpack_from(payload)
+        off = SENSOR_BATCH_HEADER.size
+        names = []
+        for _ in range(n):
+            size = payload[off]
+            names.append(bytes(payload[off + 1:off + 1 + size]).decode("utf-8", errors="replace"))
+            off += 1 + size
+        end = off + m * SENSOR_RECORD.size
+        if end > len(payload):
+            return []
+        return [(names[i], (base_us + dt) / 1e6, value)
+                for i, dt, value in SENSOR_RECORD.iter_unpack(payload[off:end]) if i < n]
+    except (struct.error, IndexError):
+        return []
+
+# =========================
+# 고해상도 ROI 크롭 (v5)
+#   [2B roi id][4B x][4B y][4B w][4B h](float32, 원본 화면 대비 0~1)[JPEG]
+#   v2 헤더의 seq 는 ROI 크롭끼리의 번호 (IMAGE seq 와 별개), ts 는 잘라낸 원본 프레임의 캡처 시각
+# =========================
+ROI_HEADER = struct.Struct("!Hffff")
+
+def pack_roi(roi_id, rect, jpeg):
+    """TYPE_ROI payload. jpeg 는 bytes / numpy 버퍼 모두 가능"""
+    return b"".join((ROI_HEADER.pack(roi_id & 0xFFFF, *rect), memoryview(jpeg).cast("B")))
+
+def unpack_roi(payload):
+    """TYPE_ROI payload → (roi_id, [x, y, w, h], JPEG view). 짧거나 JPEG 가 아니면 None"""
+    if len(payload) < ROI_HEADER.size + 2:
+        return None
+    roi_id, *rect = ROI_HEADER.unpack_from(payload)
+    jpeg = memoryview(payload)[ROI_HEADER.size:]
+    if jpeg[:2] != b"\xff\xd8":
+        return None
+    return roi_id, [round(v, 4) for v in rect], jpeg
+
+# =========================
+# 연결 설정 / 재접속 간격
+# =========================
+def set_keepalive(sock, idle=KEEPALIVE_IDLE, interval=KEEPALIVE_INTERVAL, count=KEEPALIVE_COUNT):
+    """
+    OS 기본 keepalive 는 2시간 뒤에야 probe → 반쯤 끊긴 Wi-Fi 연결을 몇 분씩 못 알아챔.
+    TCP_USER_TIMEOUT(Linux): 보낸 데이터가 이 시간 안에 ack 안 되면 커널이 연결을 끊음
+    """
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    opts = (("TCP_KEEPIDLE", idle), ("TCP_KEEPINTVL", interval), ("TCP_KEEPCNT", count),
+            ("TCP_USER_TIMEOUT", (idle + interval * count) * 1000))
+    for name, value in opts:
+        opt = getattr(socket, name, None)
+        if opt is None and name == "TCP_KEEPIDLE":
+            opt = getattr(socket, "TCP_KEEPALIVE", None)   # macOS 이름
+        if opt is not None:
+            try:
+                sock.setsockopt(socket.IPPROTO_TCP, opt, value)
+            except OSError:
+                pass
+
+class UdpFrameSender:
+    """
+    connect() 한 UDP 소켓으로 IMAGE 한 장을 UDP_FRAG_SIZE 조각으로 나눠 보낸다.
+    재전송 없음: 잃어버린 조각은 서버가 그 프레임을 버리는 것으로 끝 (다음 프레임은 안 기다림).
+    """
+
+    def __init__(self, sock, token, frag_size=UDP_FRAG_SIZE):
+        self.sock = sock
+        self.token = token
+        self.frag_size = frag_size
+        self.frames = 0
+        self.datagrams = 0
+        self.errors = 0
+
+    @classmethod
+    def connect(cls, host, port, token):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 256 * 1024)   # 프레임 여러 장 분량
+        sock.connect((host, port))
+        return cls(sock, token)
+
+    def send_frame(self, payload, seq, ts=None):
+        body = memoryview(payload).cast("B")
+        ts_us = int((time.time() if ts is None else ts) * 1e6)
+        count = max(1, -(-len(body) // self.frag_size))
+        sendmsg = getattr(self.sock, "sendmsg", None)
+        try:
+            for i in range(count):
+                header = UDP_HEADER.pack(self.token, seq & 0xFFFFFFFF, ts_us, i, count)
+                chunk = body[i * self.frag_size:(i + 1) * self.frag_size]
+                if sendmsg is not None:
+                    sendmsg([header, chunk])
+                else:
+                    self.sock.send(header + chunk.tobytes())
+                self.datagrams += 1
+        except ConnectionRefusedError:
+            # 서버 UDP 포트가 닫힘 (ICMP) - 연결 상태는 TCP 하트비트가 판단
+            self.errors += 1
+            return
+        self.frames += 1
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+class FrameReassembler:
+    """
+    UDP 조각을 seq 별로 모은다. add() 가 완성된 프레임 payload 를 돌려줌 (아니면 None).
+    버리는 경우:
+      - 첫 조각부터 deadline 이 지나도 덜 모임 (잃어버린 조각)
+      - 더 새 프레임이 먼저 완성됨 → 옛 프레임은 늦게 와도 쓸모없음 (순서 뒤바뀐 표시 없음)
+    손실률은 버린 프레임에서 못 받은 조각 수로 계산 (연결이 바뀌어도 누적).
+    """
+
+    def __init__(self, deadline=UDP_FRAME_DEADLINE):
+        self.deadline = deadline
+        self.partial = {}           # seq -> [t_first, ts_us, parts(list), received]
+        self.last_done = None       # 마지막으로 내보낸 seq
+        self.frames = 0             # 완성
+        self.dropped = 0            # 버린 프레임
+        self.frags_received = 0
+        self.frags_lost = 0
+
+    def reset(self):
+        """새 연결 (Pi 파이프라인 seq 가 처음부터 다시 시작)"""
+        for seq in list(self.partial):
+            self._drop(seq)
+        self.last_done = None
+
+    def _drop(self, seq):
+        _, _, parts, received = self.partial.pop(seq)
+        self.dropped += 1
+        self.frags_lost += len(parts) - received
+
+    def expire(self, now):
+        for seq, entry in list(self.partial.items()):
+            if now - entry[0] > self.deadline:
+                self._drop(seq)
+
+    def add(self, seq, ts_us, index, count, chunk, now):
+        """chunk 는 수신 버퍼 view 라도 됨 (여기서 복사). 완성되면 (payload, ts초)"""
+        if self.last_done is not None and seq <= self.last_done:
+            return None             # 이미 내보냈거나 버린 프레임의 늦은 조각
+        entry = self.partial.get(seq)
+        if entry is None:
+            if count == 0 or index >= count:
+                return None
+            entry = self.partial[seq] = [now, ts_us, [None] * count, 0]
+        parts = entry[2]
+        if index >= len(parts) or parts[index] is not None:
+            return None             # 잘못된 번호 / 중복
+        parts[index] = bytes(chunk)
+        entry[3] += 1
+        self.frags_received += 1
+        self.expire(now)
+        if entry[3] < len(parts):
+            return None
+
+        del self.partial[seq]
+        for old in [s for s in self.partial if s < seq]:
+            self._drop(old)         # 더 새 프레임이 완성됨
+        self.last_done = seq
+        self.frames += 1
+        return b"".join(parts), entry[1] / 1e6
+
+    def stats(self):
+        frags = self.frags_received + self.frags_lost
+        done = self.frames + self.dropped
+        return {
+            "frames": self.frames,
+            "dropped": self.dropped,
+            "pending": len(self.partial),
+            "fragment_loss": round(self.frags_lost / frags, 4) if frags else 0.0,
+            "frame_loss": round(self.dropped / done, 4) if done else 0.0,
+        }
+
+class Backoff:
+    """지수 backoff + jitter (여러 Pi 가 동시에 끊겨도 한꺼번에 몰려오지 않게)"""
+
+    def __init__(self, base=0.5, cap=30.0):
+        self.base = base
+        self.cap = cap
+        self.attempt = 0
+
+    def next(self):
+        delay = min(self.cap, self.base * (2 ** self.attempt))
+        self.attempt += 1
+        return random.uniform(delay / 2, delay)
+
+    def reset(self):
+        self.attempt = 0
+
+# =========================
+# 연결 하나를 여러 스레드가 같이 쓸 때 (Pi: 센서/카메라/CMD 응답)
+#   소켓은 writer 스레드 하나만 만진다. 채널별 큐에서 우선순위 높은 것부터 꺼내고,
+#   큰 IMAGE 는 CHUNK_SIZE 조각으로 나눠서 조각 사이에 CMD/센서가 먼저 나갈 수 있게 함
+# =========================
+CHANNELS = ("cmd", "sensor", "image", "roi")     # 앞쪽이 우선 (ROI 크롭은 본 영상을 밀어내지 않게 맨 뒤)
+CHANNEL_OF = {TYPE_CMD: 0, TYPE_SENSOR: 1, TYPE_IMAGE: 2, TYPE_ROI: 3}
+CHUNKED_TYPES = (TYPE_IMAGE, TYPE_ROI)           # v3 조각 전송 대상
+CHUNK_SIZE = 8 * 1024    # Wi-Fi 2Mbps 에서 ~30ms → 센서가 최대 이만큼만 기다림
+
+class _Outgoing:
+    __slots__ = ("mtype", "body", "seq", "ts", "offset", "t_enq", "done", "error")
+
+    def __init__(self, mtype, payload, seq, ts):
+        self.mtype = mtype
+        self.body = memoryview(payload).cast("B")
+        self.seq = seq
+        self.ts = ts
+        self.offset = 0          # 조각 전송 중이면 다음 보낼 위치
+        self.t_enq = time.monotonic()
+        self.done = threading.Event()
+        self.error = None
+
+class Sender:
+    """
+    send() 는 그 메시지가 소켓에 다 써질 때까지 막힌다 (예전 send_msg 처럼 backpressure 유지).
+    proto 는 서버 WELCOME 으로 올림: 2 이상이면 seq/ts 헤더, 3 이상이면 IMAGE / ROI 조각 전송.
+    udp 에 UdpFrameSender 를 넣으면 (WELCOME 에 udp_port 가 왔을 때) seq 있는 IMAGE 는
+    큐를 거치지 않고 UDP 로 바로 나간다 (TCP 큐엔 SENSOR / CMD 만 남음).
+    """
+
+    def __init__(self, conn, chunk_size=CHUNK_SIZE):
+        self.conn = conn
+        self.chunk_size = chunk_size
+        self.proto = 1
+        self.udp = None
+        self.cond = threading.Condition()
+        self.queues = [deque() for _ in CHANNELS]
+        self.counters = [self._new_counter() for _ in CHANNELS]
+        self.error = None
+        self.closed = False
+        self.thread = threading.Thread(target=self._writer, daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def _new_counter():
+        return {"sent": 0, "bytes": 0, "max_depth": 0, "waits": 0, "wait_sum": 0.0, "wait_max": 0.0}
+
+    def send(self, mtype, payload, seq=None, ts=None):
+        udp = self.udp
+        if udp is not None and mtype == TYPE_IMAGE and seq is not None:
+            if self.error is not None:
+                raise self.error
+            if self.closed:
+                raise OSError("sender closed")
+            udp.send_frame(payload, seq, ts)
+            return
+        out = _Outgoing(mtype, payload, seq, ts)
+        ch = CHANNEL_OF.get(mtype, 0)
+        with self.cond:
+            if self.error is not None:
+                raise self.error
+            if self.closed:
+                raise OSError("sender closed")
+            q = self.queues[ch]
+            q.append(out)
+            c = self.counters[ch]
+            c["max_depth"] = max(c["max_depth"], len(q))
+            self.cond.notify()
+        out.done.wait()
+        if out.error is not None:
+            raise out.error
+
+    def _writer(self):
+        while True:
+            with self.cond:
+                while not self.closed and not any(self.queues):
+                    self.cond.wait()
+                if self.closed:
+                    return
+                ch = next(i for i, q in enumerate(self.queues) if q)
+                out = self.queues[ch][0]
+                if out.offset == 0:
+                    c = self.counters[ch]
+                    wait = time.monotonic() - out.t_enq
+                    c["waits"] += 1
+                    c["wait_sum"] += wait
+                    c["wait_max"] = max(c["wait_max"], wait)
+
+            try:
+                finished = self._write(out)
+            except OSError as e:
+                self._fail(e)
+                return
+
+            if finished:
+                with self.cond:
+                    q = self.queues[ch]
+                    if q and q[0] is out:   # close() 가 먼저 비웠을 수 있음
+                        q.popleft()
+                    c = self.counters[ch]
+                    c["sent"] += 1
+                    c["bytes"] += len(out.body)
+                out.done.set()
+
+    def _write(self, out):
+        """조각 하나 또는 남은 전부를 쓴다. 메시지가 끝났으면 True"""
+        rest = len(out.body) - out.offset
+        if self.proto >= 3 and out.mtype in CHUNKED_TYPES and rest > self.chunk_size:
+            end = out.offset + self.chunk_size
+            send_msg(self.conn, out.mtype | FLAG_MORE, out.body[out.offset:end])
+            out.offset = end
+            return False
+        body = out.body[out.offset:] if out.offset else out.body
+        if self.proto >= 2 and out.seq is not None:
+            send_msg(self.conn, out.mtype, body, out.seq, out.ts)
+        else:
+            send_msg(self.conn, out.mtype, body)
+        return True
+
+    def _fail(self, error):
+        with self.cond:
+            self.error = error
+            pending = [out for q in self.queues for out in q]
+            for q in self.queues:
+                q.clear()
+        for out in pending:
+            out.error = error
+            out.done.set()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        self._fail(OSError("sender closed"))
+        if self.udp is not None:
+            self.udp.close()
+
+    def stats(self):
+        """채널별 큐 깊이 / 대기 시간 (호출할 때마다 max, 평균 구간 리셋)"""
+        out = {}
+        with self.cond:
+            for name, q, c in zip(CHANNELS, self.queues, self.counters):
+                out[name] = {
+                    "depth": len(q),
+                    "max_depth": c["max_depth"],
+                    "sent": c["sent"],
+                    "kb": round(c["bytes"] / 1024),
+                    "wait_ms_avg": round(c["wait_sum"] / c["waits"] * 1000, 1) if c["waits"] else 0.0,
+                    "wait_ms_max": round(c["wait_max"] * 1000, 1),
+                }
+                c.update(max_depth=len(q), waits=0, wait_sum=0.0, wait_max=0.0)
+        return out
@@ -0,0 +1,273 @@
+import json, mmap, os, re, struct, time
+from collections import deque
+
+import numpy as np
+
+# =========================
+# 알림 전후 녹화 (서버)
+#   장치마다 최근 pre_sec 초의 JPEG 를 링에 들고 있다가 (bridge 가 이미 가진 bytes 참조만, 복사 없음)
+#   알림이 오면 그 링 + 이후 post_sec 초 프레임을 세그먼트 파일로 이어 씀. 알림이 또 오면 연장.
+#
+#   세그먼트 = 파일 3 개 (recordings/<device>/<시작시각>.*)
+#     .mjpg : JPEG 를 그대로 이어붙임 (append only, 그대로 MJPEG 로 재생 가능)
+#     .idx  : 프레임마다 20B [8B ts(float64)][8B offset][4B length] (little endian, numpy 로 바로 읽음)
+#     .json : 장치 / 시작·끝 / 알림 목록 (닫을 때 갱신)
+#   재생은 .idx 를 searchsorted → .mjpg 를 mmap 해서 그 구간만 읽음
+#
+#   디스크 I/O 는 add()/trigger() 에서 하지 않음: pending 큐에 넣기만 하고
+#   flush() / enforce_retention() 을 서버가 백그라운드(OS 스레드)에서 부름
+# =========================
+INDEX_DTYPE = np.dtype([("ts", "<f8"), ("offset", "<u8"), ("length", "<u4")])
+INDEX_RECORD = struct.Struct("<dQI")
+SEGMENT_NAME = re.compile(r"^\d{8}-\d{6}-\d{3}$")
+
+def safe_name(device_id):
+    name = re.sub(r"[^A-Za-z0-9_.-]", "_", device_id)[:64]
+    # "" / "." / ".." 는 디렉터리 이름으로 쓰면 root 밖을 가리킴
+    return name if name.strip(".") else "_"
+
+class Segment:
+    def __init__(self, root, device_id, start_ts, reason):
+        self.device_id = device_id
+        self.dir = os.path.join(root, safe_name(device_id))
+        ms = int(start_ts * 1000) % 1000
+        self.name = time.strftime("%Y%m%d-%H%M%S", time.localtime(start_ts)) + f"-{ms:03d}"
+        self.base = os.path.join(self.dir, self.name)
+        self.meta = {"device": device_id, "start": start_ts, "end": start_ts, "frames": 0, "bytes": 0,
+                     "alerts": [reason], "closed": False}
+        self.data = None      # 파일 핸들 (flush 스레드만 만짐)
+        self.index = None
+
+    def write(self, ts, jpeg):
+        if self.data is None:
+            os.makedirs(self.dir, exist_ok=True)
+            self.data = open(self.base + ".mjpg", "ab")
+            self.index = open(self.base + ".idx", "ab")
+            self._write_meta()
+        offset = self.data.tell()
+        self.data.write(jpeg)
+        self.index.write(INDEX_RECORD.pack(ts, offset, len(jpeg)))
+        self.meta["end"] = ts
+        self.meta["frames"] += 1
+        self.meta["bytes"] += len(jpeg)
+
+    def close(self):
+        if self.data is None:
+            return
+        self.data.close()
+        self.index.close()
+        self.data = self.index = None
+        self.meta["closed"] = True
+        self._write_meta()
+
+    def _write_meta(self):
+        tmp = self.base + ".json.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f, ensure_ascii=False)
+        os.replace(tmp, self.base + ".json")
+
+class _DeviceState:
+    def __init__(self):
+        self.ring = deque()     # (ts, jpeg) 최근 pre_sec 초
+        self.ring_bytes = 0
+        self.segment = None     # 녹화 중이면 Segment
+        self.until = 0.0        # 이 시각까지 녹화 (알림마다 연장)
+
+class EventRecorder:
+    def __init__(self, root, pre_sec=10.0, post_sec=20.0, max_segment_sec=300.0,
+                 pre_max_bytes=16 * 1024 * 1024, retention_sec=7 * 86400, max_bytes=2 * 1024 ** 3):
+        self.root = root
+        self.pre_sec = pre_sec
+        self.post_sec = post_sec
+        self.max_segment_sec = max_segment_sec
+        self.pre_max_bytes = pre_max_bytes
+        self.retention_sec = retention_sec
+        self.max_bytes = max_bytes
+        self.devices = {}
+        self.pending = deque()  # (segment, ts, jpeg) / (segment, None, None) = 닫기. flush() 가 비움
+        self.segments = 0
+        self.deleted = 0
+
+    def _state(self, device_id):
+        st = self.devices.get(device_id)
+        if st is None:
+            st = self.devices[device_id] = _DeviceState()
+        return st
+
+    def add(self, device_id, jpeg, ts):
+        """프레임마다 (웹 루프): 참조만 링 / 녹화 큐에 넣음"""
+        st = self._state(device_id)
+        self._expire(st, ts)
+        if st.segment is not None:
+            self.pending.append((st.segment, ts, jpeg))
+        st.ring.append((ts, jpeg))
+        st.ring_bytes += len(jpeg)
+        while st.ring and (ts - st.ring[0][0] > self.pre_sec or st.ring_bytes > self.pre_max_bytes):
+            st.ring_bytes -= len(st.ring.popleft()[1])
+
+    def trigger(self, device_id, reason, ts=None):
+        """알림: 녹화 시작 (링에 있던 것부터) 또는 연장"""
+        ts = time.time() if ts is None else ts
+        st = self._state(device_id)
+        self._expire(st, ts)
+        st.until = max(st.until, ts + self.post_sec)
+        if st.segment is not None:
+            alerts = st.segment.meta["alerts"]
+            if reason not in alerts[-8:]:
+                alerts.append(reason)
+            return False
+        st.segment = Segment(self.root, device_id, st.ring[0][0] if st.ring else ts, reason)
+        self.segments += 1
+        self.pending.extend((st.segment, t, j) for t, j in st.ring)
+        print(f"[REC] {device_id}: recording {st.segment.name} ({reason}, pre {len(st.ring)} frames)")
+        return True
+
+    def tick(self, now=None):
+        """프레임이 끊겨도 (Pi 연결 끊김) 녹화가 닫히게 주기적으로"""
+        now = time.time() if now is None else now
+        for st in list(self.devices.values()):
+            self._expire(st, now)
+
+    def _expire(self, st, now):
+        seg = st.segment
+        if seg is None:
+            return
+        if now > st.until or now - seg.meta["start"] > self.max_segment_sec:
+            self.pending.append((seg, None, None))
+            st.segment = None
+            if now <= st.until:
+                # 너무 길어진 녹화는 끊어서 새 세그먼트로 이어감 (파일 하나가 끝없이 크지 않게)
+                st.segment = Segment(self.root, seg.device_id, now, seg.meta["alerts"][-1])
+                self.segments += 1
+
+    # ---------- 여기부터는 OS 스레드 (tpool) 에서 ----------
+    def flush(self):
+        """pending 을 디스크에. 쓴 프레임 수"""
+        n = 0
+        touched = set()
+        while self.pending:
+            seg, ts, jpeg = self.pending.popleft()
+            if ts is None:
+                seg.close()
+                touched.discard(seg)
+            else:
+                seg.write(ts, jpeg)
+                touched.add(seg)
+                n += 1
+        for seg in touched:
+            # 녹화 중에도 목록 / 재생 쪽이 최신 프레임까지 보이게
+            seg.data.flush()
+            seg.index.flush()
+            seg._write_meta()
+        return n
+
+    def list(self, device_id=None):
+        """디스크의 세그먼트 메타 (최신 것부터)"""
+        out = []
+        dirs = [safe_name(device_id)] if device_id else (os.listdir(self.root) if os.path.isdir(self.root) else [])
+        for d in dirs:
+            path = os.path.join(self.root, d)
+            if not os.path.isdir(path):
+                continue
+            for f in os.listdir(path):
+                if not f.endswith(".json"):
+                    continue
+                try:
+                    with open(os.path.join(path, f), encoding="utf-8") as fp:
+                        meta = json.load(fp)
+                except (OSError, ValueError):
+                    continue
+                meta["id"] = f"{d}/{f[:-5]}"
+                out.append(meta)
+        out.sort(key=lambda m: m.get("start", 0), reverse=True)
+        return out
+
+    def enforce_retention(self, now=None):
+        """보관 기간 / 전체 용량 초과분을 오래된 세그먼트부터 지움 (녹화 중인 건 안 지움)"""
+        now = time.time() if now is None else now
+        open_ids = {f"{safe_name(st.segment.device_id)}/{st.segment.name}"
+                    for st in list(self.devices.values()) if st.segment is not None}
+        metas = self.list()
+        segs = [m for m in metas if m["id"] not in open_ids and m.get("closed")]
+        total = sum(m.get("bytes", 0) for m in metas)
+        removed = 0
+        for m in sorted(segs, key=lambda m: m.get("start", 0)):
+            if now - m.get("end", 0) <= self.retention_sec and total <= self.max_bytes:
+                break
+            base = os.path.join(self.root, *m["id"].split("/"))
+            for ext in (".mjpg", ".idx", ".json"):
+                try:
+                    os.remove(base + ext)
+                except OSError:
+                    pass
+            total -= m.get("bytes", 0)
+            removed += 1
+        if removed:
+            self.deleted += removed
+            print(f"[REC] retention: removed {removed} segments")
+        return removed
+
+    def open(self, segment_id):
+        """재생용 SegmentReader. 없거나 이름이 이상하면 None"""
+        parts = segment_id.split("/")
+        if len(parts) != 2 or safe_name(parts[0]) != parts[0] or not SEGMENT_NAME.match(parts[1]):
+            return None
+        base = os.path.join(self.root, *parts)
+        if not os.path.exists(base + ".idx"):
+            return None
+        return SegmentReader(base)
+
+    def stats(self):
+        return {"recording": sorted(d for d, st in self.devices.items() if st.segment is not None),
+                "segments": self.segments, "pending": len(self.pending), "deleted": self.deleted,
+                "pre_frames": {d: len(st.ring) for d, st in self.devices.items()}}
+
+class SegmentReader:
+    """
+    .idx / .mjpg 를 mmap - 프레임을 찾을 때 파일 전체를 읽지 않음.
+    열었을 때까지 쓰인 프레임만 보임 (녹화 중인 세그먼트도 열 수 있음)
+    """
+
+    def __init__(self, base):
+        self.files = []
+        self.index = np.frombuffer(self._map(base + ".idx"), INDEX_DTYPE,
+                                   count=os.path.getsize(base + ".idx") // INDEX_DTYPE.itemsize)
+        self.data = self._map(base + ".mjpg")
+        # 인덱스는 썼는데 데이터가 아직 파일에 안 보이는 끝부분은 제외
+        if len(self.index) and self.data is not None:
+            ends = self.index["offset"] + self.index["length"]
+            self.index = self.index[:int(np.searchsorted(ends, len(self.data), "right"))]
+
+    def _map(self, path):
+        f = open(path, "rb")
+        self.files.append(f)
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self.index)
+
+    def timestamps(self):
+        return self.index["ts"]
+
+    def find(self, ts):
+        """ts 시각에 보이던 프레임 (ts 이전 마지막 것) 번호"""
+        i = int(np.searchsorted(self.index["ts"], ts, "right")) - 1
+        return min(max(i, 0), len(self.index) - 1)
+
+    def frame(self, i):
+        """(ts, JPEG memoryview) - mmap 위 view (close 전까지 유효)"""
+        rec = self.index[i]
+        off, n = int(rec["offset"]), int(rec["length"])
+        return float(rec["ts"]), memoryview(self.data)[off:off + n]
+
+    def close(self):
+        self.index = self.index[:0]
+        if isinstance(self.data, mmap.mmap):
+            try:
+                self.data.close()
+            except BufferError:
+                pass      # 아직 밖에 view 가 남아 있으면 GC 때 닫힘
+        for f in self.files:
+            f.close()
@@ -0,0 +1,162 @@
+import math, threading
+import numpy as np
+
+# =========================
+# 센서 시계열 저장 (서버, 메모리 고정)
+#   장치 x 채널마다 Series 하나 = 링 두 개
+#     raw    : 받은 샘플 그대로 RAW_CAPACITY 개 (10 Hz 면 1시간)
+#     rollup : ROLLUP_SEC 단위 min/max/sum/count ROLLUP_CAPACITY 개 (1초면 24시간)
+#   링은 numpy 배열을 미리 잡아두고 덮어씀 → 오래 돌아도 메모리가 안 늘어남
+#   조회는 step 간격 bucket 으로 min/max/mean (reduceat, 파이썬 루프 없음)
+#     step < ROLLUP_SEC 이면 raw, 아니면 rollup 에서 (몇 시간 범위도 bucket 수만큼만 계산)
+# =========================
+RAW_CAPACITY = 36000
+ROLLUP_SEC = 1.0
+ROLLUP_CAPACITY = 86400
+MAX_POINTS = 2000             # 한 번에 돌려주는 bucket 수 (넘으면 step 을 늘림)
+
+class Ring:
+    """시각 순서로만 쌓이는 고정 크기 열(column) 묶음. columns = {이름: dtype}"""
+
+    def __init__(self, capacity, columns):
+        self.capacity = capacity
+        self.cols = {name: np.zeros(capacity, dtype) for name, dtype in columns.items()}
+        self.head = 0          # 다음에 쓸 자리
+        self.count = 0
+
+    def append(self, **values):
+        i = self.head
+        for name, v in values.items():
+            self.cols[name][i] = v
+        self.head = (i + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def segments(self):
+        """오래된 것부터 (start, end) 구간 1~2 개"""
+        if self.count < self.capacity:
+            return [(0, self.count)]
+        return [(self.head, self.capacity), (0, self.head)]
+
+    def oldest(self):
+        if not self.count:
+            return None
+        return self.cols["ts"][self.segments()[0][0]]
+
+    def range(self, t0, t1, names):
+        """ts 가 [t0, t1) 인 행들 (시각 순). 구간마다 searchsorted 라 전체를 훑지 않음"""
+        ts = self.cols["ts"]
+        parts = []
+        for a, b in self.segments():
+            lo = a + np.searchsorted(ts[a:b], t0, "left")
+            hi = a + np.searchsorted(ts[a:b], t1, "left")
+            if hi > lo:
+                parts.append((lo, hi))
+        return {name: np.concatenate([self.cols[name][lo:hi] for lo, hi in parts])
+                if parts else self.cols[name][:0] for name in names}
+
+    def nbytes(self):
+        return sum(c.nbytes for c in self.cols.values())
+
+class Series:
+    def __init__(self, raw_capacity=RAW_CAPACITY, rollup_sec=ROLLUP_SEC, rollup_capacity=ROLLUP_CAPACITY):
+        self.raw = Ring(raw_capacity, {"ts": np.float64, "value": np.float32})
+        self.rollup = Ring(rollup_capacity, {"ts": np.float64, "min": np.float32, "max": np.float32,
+                                             "sum": np.float64, "count": np.uint32})
+        self.rollup_sec = rollup_sec
+        self.last_ts = -math.inf
+        self.bucket = None       # 아직 안 닫힌 rollup bucket [ts, min, max, sum, count]
+        self.samples = 0
+
+    def add(self, ts, value):
+        if not math.isfinite(value):
+            return
+        # 시계 보정 등으로 뒤로 간 시각은 직전 시각으로 (링은 정렬돼 있어야 searchsorted 가능)
+        ts = max(ts, self.last_ts)
+        self.last_ts = ts
+        self.raw.append(ts=ts, value=value)
+        self.samples += 1
+
+        start = math.floor(ts / self.rollup_sec) * self.rollup_sec
+        b = self.bucket
+        if b is not None and b[0] == start:
+            b[1] = min(b[1], value)
+            b[2] = max(b[2], value)
+            b[3] += value
+            b[4] += 1
+            return
+        if b is not None:
+            self.rollup.append(ts=b[0], min=b[1], max=b[2], sum=b[3], count=b[4])
+        self.bucket = [start, value, value, value, 1]
+
+    def query(self, t0, t1, step):
+        """[t0, t1) 을 step 초 bucket 으로 → 샘플 있는 bucket 만 (t, min, max, mean, count)"""
+        if step < self.rollup_sec:
+            rows = self.raw.range(t0, t1, ("ts", "value"))
+            ts, vmin, vmax, vsum = rows["ts"], rows["value"], rows["value"], rows["value"].astype(np.float64)
+            cnt = np.ones(len(ts), np.uint32)
+        else:
+            rows = self.rollup.range(t0, t1, ("ts", "min", "max", "sum", "count"))
+            ts, vmin, vmax, vsum, cnt = rows["ts"], rows["min"], rows["max"], rows["sum"], rows["count"]
+            b = self.bucket
+            if b is not None and t0 <= b[0] < t1:   # 지금 채우는 중인 bucket 도 포함
+                ts = np.append(ts, b[0])
+                vmin = np.append(vmin, np.float32(b[1]))
+                vmax = np.append(vmax, np.float32(b[2]))
+                vsum = np.append(vsum, b[3])
+                cnt = np.append(cnt, np.uint32(b[4]))
+        if not len(ts):
+            return {"t": [], "min": [], "max": [], "mean": [], "count": []}
+
+        idx = ((ts - t0) // step).astype(np.int64)
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(idx)) + 1))   # 정렬돼 있어서 bucket 경계만 찾으면 됨
+        n = np.add.reduceat(cnt.astype(np.int64), starts)
+        return {
+            "t": np.round(t0 + idx[starts] * step, 3).tolist(),
+            "min": np.round(np.minimum.reduceat(vmin, starts).astype(np.float64), 2).tolist(),
+            "max": np.round(np.maximum.reduceat(vmax, starts).astype(np.float64), 2).tolist(),
+            "mean": np.round(np.add.reduceat(vsum, starts) / n, 2).tolist(),
+            "count": n.tolist(),
+        }
+
+    def nbytes(self):
+        return self.raw.nbytes() + self.rollup.nbytes()
+
+class SensorStore:
+    """(device_id, channel) → Series. 채널은 처음 값이 올 때 생김"""
+
+    def __init__(self, **series_kwargs):
+        self.lock = threading.Lock()
+        self.series = {}
+        self.series_kwargs = series_kwargs
+
+    def add(self, device_id, channel, ts, value):
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return
+        with self.lock:
+            s = self.series.get((device_id, channel))
+            if s is None:
+                s = self.series[(device_id, channel)] = Series(**self.series_kwargs)
+            s.add(ts, value)
+
+    def channels(self, device_id):
+        with self.lock:
+            return sorted(ch for dev, ch in self.series if dev == device_id)
+
+    def query(self, device_id, t0, t1, step=None, channels=None):
+        """step 없으면 범위를 500 등분. 결과 bucket 이 MAX_POINTS 를 넘지 않게 step 을 늘림"""
+        span = max(t1 - t0, 1e-3)
+        step = max(step or span / 500, span / MAX_POINTS, 1e-3)
+        out = {}
+        with self.lock:
+            for (dev, ch), s in self.series.items():
+                if dev == device_id and (not channels or ch in channels):
+                    out[ch] = s.query(t0, t1, step)
+        return step, out
+
+    def stats(self):
+        with self.lock:
+            return {"series": len(self.series),
+                    "samples": sum(s.samples for s in self.series.values()),
+                    "memory_mb": round(sum(s.nbytes() for s in self.series.values()) / 1e6, 1)}
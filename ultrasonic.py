@@ -0,0 +1,244 @@
+import math, random, statistics, threading, time
+
+# =========================
+# 초음파 센서 (HC-SR04) - 인터럽트(엣지 콜백) 방식
+#   기존 get_distance 는 ECHO 핀을 while 로 돌면서 기다려서 코어 하나를 잡아먹었음
+#   → 엣지 콜백으로 시각만 찍고, 측정 스레드는 Event 로 잠들어 있음
+# =========================
+SOUND_CM_PER_SEC = 34300
+MIN_CM, MAX_CM = 2.0, 400.0   # 센서 측정 범위 밖은 버림
+ECHO_TIMEOUT = 0.03           # 4m 왕복 ≈ 23ms
+SAMPLE_HZ = 10                # 측정 주기 (HC-SR04 는 60ms 이상 간격 권장)
+FILTER_WINDOW = 5             # median 필터 창 크기
+OUTLIER_CM = 30.0             # median 에서 이만큼(또는 25%) 넘게 튀면 이상치
+
+# =========================
+# 백엔드: trigger() 후 wait_echo() 가 펄스 길이(초) 또는 None
+# =========================
+class GpioBackend:
+    """
+    RPi.GPIO 엣지 콜백으로 ECHO 상승/하강 시각을 찍는다.
+    콜백은 별도 스레드에서 늦게 불리므로 핀 값을 다시 읽어 상승/하강을 가리지 않고
+    trigger() 뒤 첫 엣지 = 상승, 두 번째 = 하강 으로 순서로 판단
+    (가까운 물체는 펄스가 100~600us 라 콜백이 핀을 읽을 때면 이미 LOW 인 경우가 많음)
+    """
+
+    def __init__(self, trig_pin, echo_pin):
+        import RPi.GPIO as GPIO
+        self.GPIO = GPIO
+        self.trig_pin = trig_pin
+        self.echo_pin = echo_pin
+
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setup(trig_pin, GPIO.OUT)
+        GPIO.setup(echo_pin, GPIO.IN)
+        GPIO.output(trig_pin, False)
+        time.sleep(0.5)  # 센서 안정화 대기
+
+        self.lock = threading.Lock()
+        self.edges = 0           # trigger() 뒤 받은 엣지 수
+        self.rise_ns = 0
+        self.pulse_ns = 0
+        self.cpu_sec = 0.0       # 콜백 스레드에서 쓴 CPU (UltrasonicSensor.stats 에 합산)
+        self.done = threading.Event()
+        GPIO.add_event_detect(echo_pin, GPIO.BOTH, callback=self._on_edge)
+
+    def _on_edge(self, channel):
+        # GPIO 콜백 스레드: 시각만 찍고 바로 리턴
+        now = time.monotonic_ns()
+        cpu0 = time.thread_time()
+        with self.lock:
+            self.edges += 1
+            if self.edges == 1:
+                self.rise_ns = now
+            elif self.edges == 2:
+                pulse = now - self.rise_ns
+                # 센서 최대 거리보다 긴 펄스는 말이 안 됨 (이전 측정의 늦은 엣지 등) → 이번 측정은 타임아웃
+                if pulse <= ECHO_TIMEOUT * 1e9:
+                    self.pulse_ns = pulse
+                    self.done.set()
+        self.cpu_sec += time.thread_time() - cpu0
+
+    def trigger(self):
+        with self.lock:
+            self.done.clear()
+            self.edges = 0
+            self.rise_ns = 0
+            self.pulse_ns = 0
+        # TRIG 핀에 10us 펄스
+        self.GPIO.output(self.trig_pin, True)
+        time.sleep(0.00001)
+        self.GPIO.output(self.trig_pin, False)
+
+    def wait_echo(self, timeout):
+        if not self.done.wait(timeout):
+            return None
+        return self.pulse_ns / 1e9
+
+    def close(self):
+        self.GPIO.remove_event_detect(self.echo_pin)
+        self.GPIO.cleanup((self.trig_pin, self.echo_pin))
+
+class SimulatedBackend:
+    """
+    하드웨어 없이 테스트용. distance_fn(t) 로 실제 거리를 만들고
+    노이즈 / 튀는 값 / 무응답을 섞는다.
+    """
+
+    def __init__(self, distance_fn=None, noise_cm=1.0, spike_prob=0.05, dropout_prob=0.03, seed=None):
+        self.distance_fn = distance_fn or (lambda t: 100.0 + 50.0 * math.sin(t / 3.0))
+        self.noise_cm = noise_cm
+        self.spike_prob = spike_prob
+        self.dropout_prob = dropout_prob
+        self.rng = random.Random(seed)
+        self.t0 = time.monotonic()
+        self.pulse = None
+
+    def trigger(self):
+        d = self.distance_fn(time.monotonic() - self.t0) + self.rng.gauss(0.0, self.noise_cm)
+        r = self.rng.random()
+        if r < self.dropout_prob:
+            self.pulse = None
+        else:
+            if r < self.dropout_prob + self.spike_prob:
+                d = self.rng.uniform(MIN_CM, MAX_CM)   # 반사 잘못 잡힌 값
+            self.pulse = 2.0 * d / SOUND_CM_PER_SEC
+
+    def wait_echo(self, timeout):
+        if self.pulse is None or self.pulse > timeout:
+            time.sleep(timeout)
+            return None
+        time.sleep(self.pulse)
+        return self.pulse
+
+    def close(self):
+        pass
+
+# =========================
+# 필터
+# =========================
+class MedianFilter:
+    """최근 window 개 median + 이상치 제거"""
+
+    def __init__(self, window=FILTER_WINDOW, outlier_cm=OUTLIER_CM):
+        self.window = window
+        self.outlier_cm = outlier_cm
+        self.values = []
+        self.rejected = 0
+
+    def add(self, cm):
+        """필터된 값 반환 (아직 판단 못 하면 None)"""
+        if self.values:
+            med = statistics.median(self.values)
+            limit = max(self.outlier_cm, med * 0.25)
+            # 창이 꽉 찼을 때만 이상치 판정 (처음엔 기준이 불안정)
+            if len(self.values) >= self.window and abs(cm - med) > limit:
+                self.rejected += 1
+                # 계속 튀면 진짜 변화일 수 있으니 가장 오래된 값만 밀어냄
+                self.values.pop(0)
+                return statistics.median(self.values)
+
+        self.values.append(cm)
+        if len(self.values) > self.window:
+            self.values.pop(0)
+        return statistics.median(self.values)
+
+# =========================
+# 센서 스레드 (고정 주기, 누적 오차 없음)
+# =========================
+class UltrasonicSensor:
+    """
+    백그라운드 스레드가 SAMPLE_HZ 로 측정하고 latest() 로 최신 값을 준다.
+    on_sample(reading) 콜백을 주면 샘플마다 호출 (알림 엔진 등)
+      reading = {"cm": 필터값 또는 None, "raw_cm": 원시값 또는 None, "ts": 측정 시각(time.time())}
+    """
+
+    def __init__(self, backend, hz=SAMPLE_HZ, window=FILTER_WINDOW, on_sample=None):
+        self.backend = backend
+        self.period = 1.0 / float(hz)
+        self.filter = MedianFilter(window)
+        self.on_sample = on_sample
+
+        self.lock = threading.Lock()
+        self.reading = {"cm": None, "raw_cm": None, "ts": 0.0}
+        self.samples = 0
+        self.timeouts = 0
+        self.out_of_range = 0
+        self.overruns = 0
+        self.cpu_sec = 0.0
+        self.stop = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+        return self
+
+    def _sample(self):
+        self.backend.trigger()
+        pulse = self.backend.wait_echo(ECHO_TIMEOUT)
+        if pulse is None:
+            self.timeouts += 1
+            return None
+        cm = pulse * SOUND_CM_PER_SEC / 2.0
+        if not (MIN_CM <= cm <= MAX_CM):
+            self.out_of_range += 1
+            return None
+        return round(cm, 2)
+
+    def _loop(self):
+        next_ts = time.monotonic()
+        while not self.stop.is_set():
+            cpu0 = time.thread_time()
+            raw = self._sample()
+            cm = self.filter.add(raw) if raw is not None else None
+            self.cpu_sec += time.thread_time() - cpu0   # 측정 + 필터만 (on_sample 은 제외)
+            reading = {"cm": None if cm is None else round(cm, 1), "raw_cm": raw, "ts": time.time()}
+            with self.lock:
+                self.reading = reading
+                self.samples += 1
+            if self.on_sample:
+                self.on_sample(reading)
+
+            # 고정 주기: 시작 시각 기준으로 다음 슬롯 (밀리면 건너뜀)
+            next_ts += self.period
+            delay = next_ts - time.monotonic()
+            if delay > 0:
+                self.stop.wait(delay)
+            else:
+                self.overruns += 1
+                next_ts = time.monotonic()
+
+    def latest(self):
+        with self.lock:
+            return dict(self.reading)
+
+    def stats(self):
+        """cpu_us_per_sample: 측정 경로만 = 측정 스레드의 trigger / 대기 / 필터 + 백엔드 엣지 콜백 스레드
+        (on_sample 에서 하는 알림 판단 / 전송 묶음은 포함 안 함)"""
+        n = max(self.samples, 1)
+        cpu_sec = self.cpu_sec + getattr(self.backend, "cpu_sec", 0.0)
+        return {
+            "samples": self.samples,
+            "timeouts": self.timeouts,
+            "out_of_range": self.out_of_range,
+            "outliers": self.filter.rejected,
+            "overruns": self.overruns,
+            "cpu_us_per_sample": round(cpu_sec / n * 1e6, 1),
+        }
+
+    def close(self):
+        self.stop.set()
+        if self.thread:
+            self.thread.join(timeout=1.0)
+        self.backend.close()
+
+if __name__ == "__main__":
+    # 하드웨어 없이 시뮬레이션: python ultrasonic.py
+    sensor = UltrasonicSensor(SimulatedBackend(seed=1)).start()
+    try:
+        for _ in range(10):
+            time.sleep(1.0)
+            print("[SENSOR]", sensor.latest(), sensor.stats())
+    finally:
+        sensor.close()